@@ -6,10 +6,10 @@ from msgq import fake_event_handle, pub_sock, sub_sock, drain_sock_raw, context
 
 import os
 import capnp
+import struct
 import time
 
-from typing import Optional, List, Union, Dict, Deque
-from collections import deque
+from typing import Optional, List, Union, Dict, Tuple
 
 from cereal import log
 from cereal.services import SERVICE_LIST
@@ -22,6 +22,44 @@ def log_from_bytes(dat: bytes) -> capnp.lib.capnp._DynamicStructReader:
     return msg
 
 
+def _event_layout() -> Tuple[Dict[int, str], int, int, int, bool]:
+  # where the union discriminant, logMonoTime and valid are in the data section of an Event
+  node = log.Event.schema.node.struct
+  fields = {f.name: f for f in node.fields}
+  which = {f.discriminantValue: f.name for f in node.fields if f.discriminantValue != 0xffff}
+  log_mono_time, valid = fields['logMonoTime'].slot, fields['valid'].slot
+  assert log_mono_time.type.which() == 'uint64' and valid.type.which() == 'bool'
+  return which, node.discriminantOffset * 2, log_mono_time.offset * 8, valid.offset, valid.defaultValue.bool
+
+_EVENT_WHICH, _EVENT_WHICH_OFFSET, _EVENT_LOG_MONO_TIME_OFFSET, _EVENT_VALID_BIT, _EVENT_VALID_DEFAULT = _event_layout()
+
+
+def event_header(dat: bytes) -> Optional[Tuple[str, int, bool]]:
+  """Returns which, logMonoTime and valid of a serialized Event without decoding it,
+  or None if the message isn't laid out as expected and needs a full decode"""
+  try:
+    # segment table, padded to a word, then the root pointer
+    n_segments = struct.unpack_from('<I', dat)[0] + 1
+    root = (4 + 4 * n_segments + 7) & ~7
+    ptr_offset, data_words = struct.unpack_from('<iH', dat, root)
+    if ptr_offset & 3 != 0:
+      return None  # not a struct pointer
+    data = root + 8 + (ptr_offset >> 2) * 8
+    data_size = data_words * 8
+
+    if _EVENT_WHICH_OFFSET + 2 > data_size or _EVENT_LOG_MONO_TIME_OFFSET + 8 > data_size or _EVENT_VALID_BIT >= data_size * 8:
+      return None
+    which = _EVENT_WHICH.get(struct.unpack_from('<H', dat, data + _EVENT_WHICH_OFFSET)[0])
+    if which is None:
+      return None
+    log_mono_time = struct.unpack_from('<Q', dat, data + _EVENT_LOG_MONO_TIME_OFFSET)[0]
+    # bools are stored xor'd with their default
+    valid = bool(dat[data + _EVENT_VALID_BIT // 8] >> (_EVENT_VALID_BIT % 8) & 1) != _EVENT_VALID_DEFAULT
+  except (struct.error, IndexError):
+    return None
+  return which, log_mono_time, valid
+
+
 def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
   args = {
     'valid': False,
@@ -87,10 +125,51 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
       return log_from_bytes(dat)
 
 
+class RecvDts:
+  """Times between received messages in a ring buffer, with running sums
+  over all of them and over the most recent tenth"""
+  def __init__(self, maxlen: int):
+    self.maxlen = maxlen
+    self.recent_len = int(maxlen / 10)
+    self.buf = [0.] * maxlen
+    self.idx = 0
+    self.count = 0
+    self.total = 0.
+    self.recent_total = 0.
+
+  def __len__(self) -> int:
+    return self.count
+
+  def append(self, dt: float) -> None:
+    if self.count >= self.recent_len:
+      self.recent_total -= self.buf[self.idx - self.recent_len]
+    if self.count == self.maxlen:
+      self.total -= self.buf[self.idx]
+    else:
+      self.count += 1
+
+    self.buf[self.idx] = dt
+    self.total += dt
+    self.recent_total += dt
+    self.idx = (self.idx + 1) % self.maxlen
+
+    if self.idx == 0:
+      # recompute once per lap, so rounding errors of the running sums don't accumulate
+      self.total = sum(self.buf)
+      self.recent_total = sum(self.buf[-self.recent_len:])
+
+  def avg_freq(self) -> float:
+    return self.count / self.total
+
+  def avg_freq_recent(self) -> float:
+    return min(self.count, self.recent_len) / self.recent_total
+
+
 class SubMaster:
   def __init__(self, services: List[str], poll: Optional[str] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
-               ignore_valid: Optional[List[str]] = None, addr: str = "127.0.0.1", frequency: Optional[float] = None):
+               ignore_valid: Optional[List[str]] = None, addr: str = "127.0.0.1", frequency: Optional[float] = None,
+               lazy: bool = False):
     self.frame = -1
     self.seen = {s: False for s in services}
     self.updated = {s: False for s in services}
@@ -98,12 +177,17 @@ class SubMaster:
     self.recv_frame = {s: 0 for s in services}
     self.alive = {s: False for s in services}
     self.freq_ok = {s: False for s in services}
-    self.recv_dts: Dict[str, Deque[float]] = {}
+    self.recv_dts: Dict[str, RecvDts] = {}
     self.sock = {}
     self.data = {}
     self.valid = {}
     self.logMonoTime = {}
 
+    # with lazy, messages are kept serialized until they're accessed
+    self.lazy = lazy
+    self.raw: Dict[str, bytes] = {}
+    self.updated_services: List[str] = []
+
     self.max_freq = {}
     self.min_freq = {}
 
@@ -148,15 +232,28 @@ class SubMaster:
           min_freq = min(freq, freq / 2.)
       self.max_freq[s] = max_freq*1.2
       self.min_freq[s] = min_freq*0.8
-      self.recv_dts[s] = deque(maxlen=int(10*freq))
+      self.recv_dts[s] = RecvDts(int(10*freq))
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    if s in self.raw:
+      self.data[s] = getattr(log_from_bytes(self.raw.pop(s)), s)
     return self.data[s]
 
   def _check_avg_freq(self, s: str) -> bool:
     return SERVICE_LIST[s].frequency > 0.99 and (s not in self.ignore_average_freq) and (s not in self.ignore_alive)
 
   def update(self, timeout: int = 100) -> None:
+    if self.lazy:
+      dats = []
+      for sock in self.poller.poll(timeout):
+        dats.append(sock.receive(non_blocking=True))
+
+      # non-blocking receive for non-polled sockets
+      for s in self.non_polled_services:
+        dats.append(self.sock[s].receive(non_blocking=True))
+      self.update_raw_msgs(time.monotonic(), dats)
+      return
+
     msgs = []
     for sock in self.poller.poll(timeout):
       msgs.append(recv_one_or_none(sock))
@@ -166,25 +263,56 @@ class SubMaster:
       msgs.append(recv_one_or_none(self.sock[s]))
     self.update_msgs(time.monotonic(), msgs)
 
-  def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+  def _start_update(self) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    for s in self.updated_services:
+      self.updated[s] = False
+    self.updated_services.clear()
+
+  def _update_service(self, cur_time: float, s: str, log_mono_time: int, valid: bool) -> None:
+    self.seen[s] = True
+    self.updated[s] = True
+    self.updated_services.append(s)
+
+    if self.recv_time[s] > 1e-5:
+      self.recv_dts[s].append(cur_time - self.recv_time[s])
+    self.recv_time[s] = cur_time
+    self.recv_frame[s] = self.frame
+    self.logMonoTime[s] = log_mono_time
+    self.valid[s] = valid
+
+  def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+    self._start_update()
     for msg in msgs:
       if msg is None:
         continue
 
       s = msg.which()
-      self.seen[s] = True
-      self.updated[s] = True
-
-      if self.recv_time[s] > 1e-5:
-        self.recv_dts[s].append(cur_time - self.recv_time[s])
-      self.recv_time[s] = cur_time
-      self.recv_frame[s] = self.frame
+      self._update_service(cur_time, s, msg.logMonoTime, msg.valid)
       self.data[s] = getattr(msg, s)
-      self.logMonoTime[s] = msg.logMonoTime
-      self.valid[s] = msg.valid
+      self.raw.pop(s, None)
+    self._update_checks(cur_time)
+
+  def update_raw_msgs(self, cur_time: float, dats: List[Optional[bytes]]) -> None:
+    self._start_update()
+    for dat in dats:
+      if dat is None:
+        continue
+
+      header = event_header(dat)
+      if header is None:
+        msg = log_from_bytes(dat)
+        s = msg.which()
+        self._update_service(cur_time, s, msg.logMonoTime, msg.valid)
+        self.data[s] = getattr(msg, s)
+        self.raw.pop(s, None)
+      else:
+        s, log_mono_time, valid = header
+        self._update_service(cur_time, s, log_mono_time, valid)
+        self.raw[s] = dat
+    self._update_checks(cur_time)
 
+  def _update_checks(self, cur_time: float) -> None:
     for s in self.data:
       if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
         # alive if delay is within 10x the expected frequency
@@ -192,11 +320,9 @@ class SubMaster:
 
         # check average frequency; slow to fall, quick to recover
         dts = self.recv_dts[s]
-        assert dts.maxlen is not None
-        recent_dts = list(dts)[-int(dts.maxlen / 10):]
         try:
-          avg_freq = 1 / (sum(dts) / len(dts))
-          avg_freq_recent = 1 / (sum(recent_dts) / len(recent_dts))
+          avg_freq = dts.avg_freq()
+          avg_freq_recent = dts.avg_freq_recent()
         except ZeroDivisionError:
           avg_freq = 0
           avg_freq_recent = 0
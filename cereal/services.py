@@ -79,6 +79,7 @@ _services: dict[str, tuple] = {
   "frogpilotDeviceState": (True, 2., 1),
   "frogpilotNavigation": (True, 1., 10),
   "frogpilotPlan": (True, 20., 5),
+  "managerProfile": (True, 0.2, 1),
 
   # debug
   "uiDebug": (True, 0., 1),
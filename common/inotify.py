@@ -0,0 +1,101 @@
+import ctypes
+import os
+import select
+import struct
+from typing import NamedTuple
+
+# from linux/inotify.h
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+class InotifyEvent(NamedTuple):
+  wd: int
+  mask: int
+  cookie: int
+  name: str
+  path: str | None  # the watched path this event is for
+
+
+class Inotify:
+  """
+  Minimal wrapper around the Linux inotify API.
+  For example this will print files created in /tmp:
+  with Inotify() as inotify:
+    inotify.add_watch("/tmp", IN_CREATE)
+    for event in inotify.read():
+      print(event.path, event.name)
+  """
+  def __init__(self):
+    self._libc = ctypes.CDLL(None, use_errno=True)
+    self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+    self.paths: dict[int, str] = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def close(self) -> None:
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+    self.paths.clear()
+
+  def fileno(self) -> int:
+    return self.fd
+
+  def add_watch(self, path: str, mask: int) -> int:
+    wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    self.paths[wd] = path
+    return wd
+
+  def rm_watch(self, wd: int) -> None:
+    self.paths.pop(wd, None)
+    self._libc.inotify_rm_watch(self.fd, wd)
+
+  def read(self, timeout: float | None = 0) -> list[InotifyEvent]:
+    """Returns pending events, waiting up to timeout seconds (forever if None) for the first one."""
+    if not select.select([self.fd], [], [], timeout)[0]:
+      return []
+
+    try:
+      buf = os.read(self.fd, _READ_SIZE)
+    except BlockingIOError:
+      return []
+
+    events = []
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(buf):
+      wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+      offset += _EVENT_HEADER.size
+      name = buf[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+      offset += name_len
+
+      events.append(InotifyEvent(wd, mask, cookie, name, self.paths.get(wd)))
+      if mask & IN_IGNORED:
+        # watch was removed, either explicitly or because the path was deleted
+        self.paths.pop(wd, None)
+    return events
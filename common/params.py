@@ -1,8 +1,126 @@
-from openpilot.common.params_pyx import Params, ParamKeyType, UnknownKeyName
-assert Params
+import fcntl
+import os
+import tempfile
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
+from openpilot.common.inotify import IN_CLOSE_WRITE, IN_DELETE, IN_MOVED_TO, IN_Q_OVERFLOW, Inotify
+from openpilot.common.params_pyx import Params as _Params, ParamKeyType, UnknownKeyName
 assert ParamKeyType
 assert UnknownKeyName
 
+
+def _key_name(key) -> str:
+  return key.decode() if isinstance(key, bytes) else key
+
+
+class Params(_Params):
+  """Adds batched reads and writes and change notifications to the C++ Params. These follow its
+  on disk layout: values are files in <path>/d, written through a temp file that is renamed into
+  place while holding <path>/.lock."""
+
+  @contextmanager
+  def _lock(self, operation: int) -> Iterator[None]:
+    lock_path = os.path.join(os.path.dirname(self.get_param_path()), ".lock")
+    try:
+      fd = os.open(lock_path, os.O_RDONLY if operation == fcntl.LOCK_SH else os.O_CREAT | os.O_RDONLY, 0o775)
+    except FileNotFoundError:
+      # nothing was ever put, no need to lock for reading
+      yield
+      return
+
+    try:
+      fcntl.flock(fd, operation)
+      yield
+    finally:
+      os.close(fd)
+
+  def get_many(self, keys: Iterable[str], encoding: str | None = None) -> dict:
+    """Reads several params under a single shared lock, so a put_many is seen either entirely or not at all"""
+    keys = [_key_name(self.check_key(key)) for key in keys]
+
+    ret: dict = {}
+    with self._lock(fcntl.LOCK_SH):
+      dir_fd = os.open(self.get_param_path(), os.O_RDONLY | os.O_DIRECTORY)
+      try:
+        for key in keys:
+          try:
+            fd = os.open(key, os.O_RDONLY, dir_fd=dir_fd)
+          except FileNotFoundError:
+            ret[key] = None
+            continue
+
+          with os.fdopen(fd, 'rb') as f:
+            val = f.read()
+          ret[key] = None if not len(val) else val if encoding is None else val.decode(encoding)
+      finally:
+        os.close(dir_fd)
+    return ret
+
+  def put_many(self, values: dict) -> None:
+    """
+    Writes several params with a single lock acquisition and directory fsync.
+    Like put, this blocks until every param is written to disk.
+    """
+    if not len(values):
+      return
+
+    params_dir = self.get_param_path()
+    tmp_paths = []
+    try:
+      for key, dat in values.items():
+        key = _key_name(self.check_key(key))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_value_", dir=os.path.dirname(params_dir))
+        tmp_paths.append((tmp_path, key))
+        with os.fdopen(fd, 'wb') as f:
+          f.write(dat.encode() if isinstance(dat, str) else dat)
+          f.flush()
+          os.fsync(f.fileno())
+
+      with self._lock(fcntl.LOCK_EX):
+        while len(tmp_paths):
+          tmp_path, key = tmp_paths.pop()
+          os.rename(tmp_path, os.path.join(params_dir, key))
+
+        dir_fd = os.open(params_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+          os.fsync(dir_fd)
+        finally:
+          os.close(dir_fd)
+    finally:
+      for tmp_path, _ in tmp_paths:
+        os.unlink(tmp_path)
+
+  def watch(self, keys: Iterable[str], timeout: float | None = None, encoding: str | None = None) -> Iterator[dict]:
+    """
+    Yields the current values of keys, then blocks until some of them are written or removed and
+    yields {key: value} for those. With a timeout, {} is yielded if nothing changed in that time.
+    """
+    keys = [_key_name(self.check_key(key)) for key in keys]
+
+    with Inotify() as inotify:
+      inotify.add_watch(self.get_param_path(), IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE)
+      yield self.get_many(keys, encoding)
+
+      while True:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed: set[str] = set()
+        while not len(changed):
+          remaining = None if deadline is None else max(deadline - time.monotonic(), 0.)
+          events = inotify.read(remaining)
+          for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+              changed.update(keys)
+            elif event.name in keys:
+              changed.add(event.name)
+
+          if not len(events) and remaining == 0.:
+            break
+
+        yield self.get_many([key for key in keys if key in changed], encoding)
+
+
 if __name__ == "__main__":
   import sys
 
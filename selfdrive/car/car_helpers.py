@@ -6,7 +6,7 @@ from collections.abc import Callable
 from cereal import car
 from openpilot.common.params import Params
 from openpilot.selfdrive.car.interfaces import get_interface_attr
-from openpilot.selfdrive.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
+from openpilot.selfdrive.car.fingerprints import get_fingerprint_index
 from openpilot.selfdrive.car.vin import get_vin, is_valid_vin, VIN_UNKNOWN
 from openpilot.selfdrive.car.fw_versions import get_fw_versions_ordered, get_present_ecus, match_fw_to_car, set_obd_multiplexing
 from openpilot.selfdrive.car.mock.values import CAR as MOCK
@@ -72,7 +72,8 @@ interfaces = load_interfaces(interface_names)
 
 def can_fingerprint(next_can: Callable) -> tuple[str | None, dict[int, dict]]:
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_legacy_fingerprint_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  index = get_fingerprint_index()
+  candidate_cars = {i: index.all_cars for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1, as bitsets of cars
   frame = 0
   car_fingerprint = None
   done = False
@@ -91,17 +92,17 @@ def can_fingerprint(next_can: Callable) -> tuple[str | None, dict[int, dict]]:
       for b in candidate_cars:
         # Ignore extended messages and VIN query response.
         if can.src == b and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
-          candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+          candidate_cars[b] &= index.compatible(can.address, len(can.dat))
 
     # if we only have one car choice and the time since we got our first
     # message has elapsed, exit
     for b in candidate_cars:
-      if len(candidate_cars[b]) == 1 and frame > FRAME_FINGERPRINT:
+      if candidate_cars[b].bit_count() == 1 and frame > FRAME_FINGERPRINT:
         # fingerprint done
-        car_fingerprint = candidate_cars[b][0]
+        car_fingerprint = index.to_cars(candidate_cars[b])[0]
 
     # bail if no cars left or we've been waiting for more than 2s
-    failed = (all(len(cc) == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
+    failed = (all(cc == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
     succeeded = car_fingerprint is not None
     done = failed or succeeded
 
@@ -95,8 +95,6 @@ class Car:
     # FrogPilot variables
     self.frogpilot_toggles = FrogPilotVariables.toggles
 
-    self.update_toggles = False
-
   def state_update(self) -> car.CarState:
     """carState update loop, driven by can"""
 
@@ -200,10 +198,7 @@ class Car:
 
       # Update FrogPilot parameters
       if FrogPilotVariables.toggles_updated:
-        self.update_toggles = True
-      elif self.update_toggles:
-        FrogPilotVariables.update_frogpilot_params()
-        self.update_toggles = False
+        FrogPilotVariables.load_frogpilot_params()
 
 def main():
   config_realtime_process(4, Priority.CTRL_HIGH)
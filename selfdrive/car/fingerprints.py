@@ -1,3 +1,6 @@
+from collections import defaultdict
+from functools import cache
+
 from openpilot.selfdrive.car.interfaces import get_interface_attr
 from openpilot.selfdrive.car.body.values import CAR as BODY
 from openpilot.selfdrive.car.chrysler.values import CAR as CHRYSLER
@@ -25,6 +28,37 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+class FingerprintIndex:
+  """Inverted index of the legacy fingerprints. Candidate cars are a bitset over cars,
+     for each (address, length) it holds the cars with a fingerprint containing it."""
+  def __init__(self, fingerprints: dict[str, list[dict[int, int]]]):
+    self.cars = list(fingerprints.keys())
+    self.car_bits = {car_name: 1 << i for i, car_name in enumerate(self.cars)}
+    self.all_cars = (1 << len(self.cars)) - 1
+
+    self.index: dict[tuple[int, int], int] = defaultdict(int)
+    for car_name, car_fingerprints in fingerprints.items():
+      for fingerprint in car_fingerprints:
+        # add alien debug address
+        for adr, length in (fingerprint | _DEBUG_ADDRESS).items():
+          self.index[(adr, length)] |= self.car_bits[car_name]
+
+  def compatible(self, address: int, length: int) -> int:
+    """Returns the bitset of cars that could have sent a message"""
+    # ignore addresses that are more than 11 bits
+    if address >= 0x800:
+      return self.all_cars
+    return self.index.get((address, length), 0)
+
+  def to_cars(self, candidates: int) -> list[str]:
+    return [car_name for car_name, bit in self.car_bits.items() if candidates & bit]
+
+
+@cache
+def get_fingerprint_index() -> FingerprintIndex:
+  return FingerprintIndex(_FINGERPRINTS)
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -35,18 +69,9 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  index = get_fingerprint_index()
+  compatible = index.compatible(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if compatible & index.car_bits[car_name]]
 
 
 def all_known_cars():
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from collections import defaultdict
 from collections.abc import Iterator
+from functools import cache
 from typing import Any, Protocol, TypeVar
 
 from tqdm import tqdm
@@ -48,6 +49,49 @@ def build_fw_dict(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], filt
   return dict(fw_versions_dict)
 
 
+class FwIndex:
+  """Lookup tables for exact and fuzzy FW matching of one brand, or all brands with brand None.
+  Built once from FW_VERSIONS, see get_fw_index."""
+  def __init__(self, brand: str | None):
+    # candidate -> ECUs to check for exact matching: (ecu, addr, expected versions, needed when missing)
+    self.exact: dict[str, tuple[tuple[Any, AddrType, frozenset[bytes], bool], ...]] = {}
+    # (addr, sub_addr, fw) -> candidates for fuzzy matching
+    fuzzy: defaultdict[tuple[int, int | None, bytes], set[str]] = defaultdict(set)
+
+    for candidate, fw_by_addr in FW_VERSIONS.items():
+      if not is_brand(MODEL_TO_BRAND[candidate], brand):
+        continue
+
+      config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+      ecus = []
+      for ecu, fws in fw_by_addr.items():
+        ecu_type = ecu[0]
+        # Virtual debug ecu doesn't need to match the database
+        if ecu_type != Ecu.debug:
+          # Some models can sometimes miss an ecu, or show on two different addresses
+          # FIXME: this logic can be improved to be more specific, should require one of the two addresses
+          # Non essential ecus can be missing
+          essential = ecu_type in ESSENTIAL_ECUS and candidate not in config.non_essential_ecus.get(ecu_type, [])
+          ecus.append((ecu, ecu[1:], frozenset(fws), essential))
+
+        # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+        # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+        # impossible to get 3 matching versions, even if two models with shared parts are released at the same
+        # time and only one is in our database.
+        if ecu_type not in FUZZY_EXCLUDE_ECUS:
+          for f in fws:
+            fuzzy[(ecu[1], ecu[2], f)].add(candidate)
+
+      self.exact[candidate] = tuple(ecus)
+
+    self.fuzzy: dict[tuple[int, int | None, bytes], frozenset[str]] = {k: frozenset(v) for k, v in fuzzy.items()}
+
+
+@cache
+def get_fw_index(brand: str | None = None) -> FwIndex:
+  return FwIndex(brand)
+
+
 class MatchFwToCar(Protocol):
   def __call__(self, live_fw_versions: LiveFwVersions, match_brand: str = None, log: bool = True) -> set[str]:
     ...
@@ -58,24 +102,8 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = N
   that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
   the match is rejected."""
 
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
-      continue
-
-    if candidate == exclude:
-      continue
-
-    for addr, fws in fw_by_addr.items():
-      # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-      # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-      # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-      # time and only one is in our database.
-      if addr[0] in FUZZY_EXCLUDE_ECUS:
-        continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+  # Lookup table from (addr, sub_addr, fw) to set of candidate cars
+  all_fw_versions = get_fw_index(match_brand).fuzzy
 
   matched_ecus = set()
   match: str | None = None
@@ -83,14 +111,17 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = N
     ecu_key = (addr[0], addr[1])
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
+      candidates = all_fw_versions.get((*ecu_key, version), frozenset())
+      if exclude in candidates:
+        candidates = candidates - {exclude}
 
       if len(candidates) == 1:
         matched_ecus.add(ecu_key)
+        candidate = next(iter(candidates))
         if match is None:
-          match = candidates[0]
+          match = candidate
         # We uniquely matched two different cars. No fuzzy match possible
-        elif match != candidates[0]:
+        elif match != candidate:
           return set()
 
   # Note that it is possible to match to a candidate without all its ECUs being present
@@ -111,37 +142,25 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str = N
   if extra_fw_versions is None:
     extra_fw_versions = {}
 
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = live_fw_versions.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
+  matches = set()
+  for candidate, ecus in get_fw_index(match_brand).exact.items():
+    extra_versions = extra_fw_versions.get(candidate, {})
+    for ecu, addr, expected_versions, essential in ecus:
+      found_versions = live_fw_versions.get(addr)
+      if not found_versions:
+        if essential:
+          break
         continue
 
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
+      if ecu in extra_versions:
+        expected_versions = expected_versions.union(extra_versions[ecu])
+
+      if expected_versions.isdisjoint(found_versions):
         break
+    else:
+      matches.add(candidate)
 
-  return set(candidates.keys()) - invalid
+  return matches
 
 
 def match_fw_to_car(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], vin: str,
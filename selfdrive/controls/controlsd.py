@@ -110,7 +110,7 @@ class Controls:
                                    'managerState', 'liveParameters', 'radarState', 'liveTorqueParameters',
                                    'testJoystick', 'frogpilotCarState', 'frogpilotPlan'] + self.camera_packets + self.sensor_packets,
                                   ignore_alive=ignore, ignore_avg_freq=ignore+['radarState', 'testJoystick'], ignore_valid=['testJoystick', ],
-                                  frequency=int(1/DT_CTRL))
+                                  frequency=int(1/DT_CTRL), lazy=True)
 
     self.joystick_mode = self.params.get_bool("JoystickDebugMode")
 
@@ -208,7 +208,6 @@ class Controls:
     self.speed_check = False
     self.speed_limit_changed = False
     self.stopped_for_light = False
-    self.update_toggles = False
     self.use_old_long = self.CP.carName == "hyundai" and not self.params.get_bool("NewLongAPI")
     self.use_old_long |= self.CP.carName == "gm" and not self.params.get_bool("NewLongAPIGM")
 
@@ -913,28 +912,32 @@ class Controls:
 
     self.CS_prev = CS
 
-  def read_personality_param(self):
+  def read_personality_param(self, personality=None):
     try:
-      return int(self.params.get('LongitudinalPersonality'))
+      return int(self.params.get('LongitudinalPersonality') if personality is None else personality)
     except (ValueError, TypeError):
       return log.LongitudinalPersonality.standard
 
   def params_thread(self, evt):
-    while not evt.is_set():
-      self.is_metric = self.params.get_bool("IsMetric")
+    # params are only read when they change, the loop still runs at 10Hz for the speed limit controller's experimental mode
+    values = {}
+    for changed in self.params.watch(("IsMetric", "ExperimentalMode", "LongitudinalPersonality", "JoystickDebugMode"), timeout=0.1):
+      if evt.is_set():
+        break
+
+      values.update(changed)
+      self.is_metric = values["IsMetric"] == b"1"
       if self.CP.openpilotLongitudinalControl and not self.frogpilot_toggles.conditional_experimental_mode:
-        self.experimental_mode = self.params.get_bool("ExperimentalMode") or self.frogpilot_toggles.speed_limit_controller and SpeedLimitController.experimental_mode
-      self.personality = self.read_personality_param()
+        self.experimental_mode = values["ExperimentalMode"] == b"1" or self.frogpilot_toggles.speed_limit_controller and SpeedLimitController.experimental_mode
+      self.personality = self.read_personality_param(values["LongitudinalPersonality"])
       if self.CP.notCar:
-        self.joystick_mode = self.params.get_bool("JoystickDebugMode")
-      time.sleep(0.1)
+        self.joystick_mode = values["JoystickDebugMode"] == b"1"
 
       # Update FrogPilot parameters
       if FrogPilotVariables.toggles_updated:
-        self.update_toggles = True
-      elif self.update_toggles or self.sm.frame * DT_CTRL < 1:  # Force updates at first to check the current state of "Always On Lateral" and holiday theme
+        FrogPilotVariables.load_frogpilot_params()
+      elif self.sm.frame * DT_CTRL < 1:  # Force updates at first to check the current state of "Always On Lateral" and holiday theme
         FrogPilotVariables.update_frogpilot_params()
-        self.update_toggles = False
 
   def controlsd_thread(self):
     e = threading.Event()
@@ -11,6 +11,7 @@ if __name__ == '__main__':  # generating code
   from openpilot.third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
 else:
   from openpilot.selfdrive.controls.lib.lateral_mpc_lib.c_generated_code.acados_ocp_solver_pyx import AcadosOcpSolverCython
+  from openpilot.selfdrive.controls.lib.mpc_helpers import get_all_stages, set_all_stages
 
 LAT_MPC_DIR = os.path.dirname(os.path.abspath(__file__))
 EXPORT_DIR = os.path.join(LAT_MPC_DIR, "c_generated_code")
@@ -141,14 +142,11 @@ class LateralMpc:
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N, 1))
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    set_all_stages(self.solver, "yref", self.yref, COST_E_DIM)
 
     # Somehow needed for stable init
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
-      self.solver.set(i, 'p', np.zeros(P_DIM))
+    set_all_stages(self.solver, 'x', np.zeros((N+1, X_DIM)))
+    set_all_stages(self.solver, 'p', np.zeros((N+1, P_DIM)))
     self.solver.constraints_set(0, "lbx", x0)
     self.solver.constraints_set(0, "ubx", x0)
     self.solver.solve()
@@ -176,20 +174,15 @@ class LateralMpc:
     # rotation_radius = p_cp[1]
     self.yref[:,1] = heading_pts * (v_ego + SPEED_OFFSET)
     self.yref[:,2] = yaw_rate_pts * (v_ego + SPEED_OFFSET)
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-      self.solver.set(i, "p", p_cp[i])
-    self.solver.set(N, "p", p_cp[N])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    set_all_stages(self.solver, "yref", self.yref, COST_E_DIM)
+    set_all_stages(self.solver, "p", p_cp)
 
     t = time.monotonic()
     self.solution_status = self.solver.solve()
     self.solve_time = time.monotonic() - t
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    get_all_stages(self.solver, 'x', self.x_sol)
+    get_all_stages(self.solver, 'u', self.u_sol)
     self.cost = self.solver.get_cost()
 
 
@@ -14,6 +14,7 @@ if __name__ == '__main__':  # generating code
   from openpilot.third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
 else:
   from openpilot.selfdrive.controls.lib.longitudinal_mpc_lib.c_generated_code.acados_ocp_solver_pyx import AcadosOcpSolverCython
+  from openpilot.selfdrive.controls.lib.mpc_helpers import get_all_stages, set_all_stages
 
   from openpilot.selfdrive.frogpilot.controls.lib.frogpilot_variables import CITY_SPEED_LIMIT
 
@@ -251,6 +252,7 @@ class LongitudinalMpc:
     self.mode = mode
     self.dt = dt
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.marshalling_time = 0.0
     self.reset()
     self.source = SOURCES[2]
 
@@ -263,14 +265,11 @@ class LongitudinalMpc:
     self.prev_a = np.array(self.a_solution)
     self.j_solution = np.zeros(N)
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    set_all_stages(self.solver, "yref", self.yref, COST_E_DIM)
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N,1))
     self.params = np.zeros((N+1, PARAM_DIM))
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
+    set_all_stages(self.solver, 'x', np.zeros((N+1, X_DIM)))
     self.last_cloudlog_t = 0
     self.status = False
     self.crash_cnt = 0.0
@@ -317,8 +316,7 @@ class LongitudinalMpc:
     self.x0[1] = v
     self.x0[2] = a
     if abs(v_prev - v) > 2.:  # probably only helps if v < v_prev
-      for i in range(N+1):
-        self.solver.set(i, 'x', self.x0)
+      set_all_stages(self.solver, 'x', np.tile(self.x0, (N+1, 1)))
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
@@ -413,9 +411,6 @@ class LongitudinalMpc:
     self.yref[:,2] = v
     self.yref[:,3] = a
     self.yref[:,5] = j
-    for i in range(N):
-      self.solver.set(i, "yref", self.yref[i])
-    self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
 
     self.params[:,2] = np.min(x_obstacles, axis=1)
     self.params[:,3] = np.copy(self.prev_a)
@@ -440,10 +435,12 @@ class LongitudinalMpc:
   def run(self):
     # t0 = time.monotonic()
     # reset = 0
-    for i in range(N+1):
-      self.solver.set(i, 'p', self.params[i])
+    t = time.monotonic()
+    set_all_stages(self.solver, "yref", self.yref, COST_E_DIM)
+    set_all_stages(self.solver, 'p', self.params)
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
+    marshalling_time = time.monotonic() - t
 
     self.solution_status = self.solver.solve()
     self.solve_time = float(self.solver.get_stats('time_tot')[0])
@@ -458,10 +455,11 @@ class LongitudinalMpc:
     # print(f"long_mpc residuals: {res[0]:.2e}, {res[1]:.2e}, {res[2]:.2e}, {res[3]:.2e}")
     # self.solver.print_statistics()
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    t = time.monotonic()
+    get_all_stages(self.solver, 'x', self.x_sol)
+    get_all_stages(self.solver, 'u', self.u_sol)
+    # time spent passing data to and from the solver, compare to solve_time
+    self.marshalling_time = marshalling_time + time.monotonic() - t
 
     self.v_solution = self.x_sol[:,1]
     self.a_solution = self.x_sol[:,2]
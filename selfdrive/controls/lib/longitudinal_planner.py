@@ -260,6 +260,7 @@ class LongitudinalPlanner:
     longitudinalPlan.modelMonoTime = sm.logMonoTime['modelV2']
     longitudinalPlan.processingDelay = (plan_send.logMonoTime / 1e9) - sm.logMonoTime['modelV2']
     longitudinalPlan.solverExecutionTime = self.mpc.solve_time
+    longitudinalPlan.solverMarshallingTime = self.mpc.marshalling_time
 
     longitudinalPlan.allowBrake = True
     longitudinalPlan.allowThrottle = True
@@ -0,0 +1,23 @@
+import numpy as np
+
+
+def set_all_stages(solver, field: str, values: np.ndarray, terminal_dim: int | None = None) -> None:
+  """Sets field of every stage from a row of values, the terminal stage gets the first terminal_dim columns.
+  Solvers built before AcadosOcpSolverCython.set_all_stages are set one stage at a time."""
+  if hasattr(solver, 'set_all_stages'):
+    solver.set_all_stages(field, values)
+    return
+
+  for i in range(len(values) - 1):
+    solver.set(i, field, values[i])
+  solver.set(len(values) - 1, field, values[-1][:terminal_dim])
+
+
+def get_all_stages(solver, field: str, out: np.ndarray) -> np.ndarray:
+  """Reads field of the first len(out) stages into out"""
+  if hasattr(solver, 'get_all_stages'):
+    return solver.get_all_stages(field, out)
+
+  for i in range(len(out)):
+    out[i] = solver.get(i, field)
+  return out
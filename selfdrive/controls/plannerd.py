@@ -31,13 +31,11 @@ def plannerd_thread():
   longitudinal_planner = LongitudinalPlanner(CP)
   pm = messaging.PubMaster(['longitudinalPlan', 'uiPlan'])
   sm = messaging.SubMaster(['carControl', 'carState', 'controlsState', 'radarState', 'modelV2', 'frogpilotCarControl', 'frogpilotCarState', 'frogpilotPlan'],
-                           poll='modelV2', ignore_avg_freq=['radarState'])
+                           poll='modelV2', ignore_avg_freq=['radarState'], lazy=True)
 
   # FrogPilot variables
   frogpilot_toggles = FrogPilotVariables.toggles
 
-  update_toggles = False
-
   while True:
     sm.update()
     if sm.updated['modelV2']:
@@ -47,10 +45,7 @@ def plannerd_thread():
 
     # Update FrogPilot parameters
     if FrogPilotVariables.toggles_updated:
-      update_toggles = True
-    elif update_toggles:
-      FrogPilotVariables.update_frogpilot_params()
-      update_toggles = False
+      FrogPilotVariables.load_frogpilot_params()
 
 def main():
   plannerd_thread()
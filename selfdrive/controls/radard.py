@@ -1,18 +1,16 @@
 #!/usr/bin/env python3
 import importlib
-import math
 from collections import deque
 from typing import Any
 
 import capnp
+import numpy as np
 from cereal import messaging, log, car
 from openpilot.common.numpy_fast import interp
 from openpilot.common.params import Params
 from openpilot.common.realtime import DT_CTRL, Ratekeeper, Priority, config_realtime_process
 from openpilot.common.swaglog import cloudlog
 
-from openpilot.common.simple_kalman import KF1D
-
 from openpilot.selfdrive.frogpilot.controls.lib.frogpilot_variables import FrogPilotVariables
 
 # Default lead acceleration decay set to 50% at 1s
@@ -50,101 +48,101 @@ class KalmanParams:
     self.K = [[interp(dt, dts, K0)], [interp(dt, dts, K1)]]
 
 
-class Track:
-  def __init__(self, identifier: int, v_lead: float, kalman_params: KalmanParams):
-    self.identifier = identifier
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
+class Tracks:
+  """Struct-of-arrays radar track table, sorted by track id. All Kalman filters are stepped together."""
+  def __init__(self, kalman_params: KalmanParams):
+    A, C, K = kalman_params.A, kalman_params.C, kalman_params.K
+    # same constant gain filter as KF1D: x = (A - K*C) x + K*meas
+    self.A_K = np.array([[A[0][0] - K[0][0] * C[0], A[0][1] - K[0][0] * C[1]],
+                         [A[1][0] - K[1][0] * C[0], A[1][1] - K[1][0] * C[1]]])
+    self.K = np.array([K[0][0], K[1][0]])
+
+    self.ids = np.zeros(0, dtype=np.int64)
+    self.dRel = np.zeros(0)
+    self.yRel = np.zeros(0)
+    self.vRel = np.zeros(0)
+    self.vLead = np.zeros(0)
+    self.measured = np.zeros(0, dtype=bool)
+    self.vLeadK = np.zeros(0)
+    self.aLeadK = np.zeros(0)
+    self.aLeadTau = np.zeros(0)
+    self.cnt = np.zeros(0, dtype=np.int64)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def update(self, ids: np.ndarray, d_rel: np.ndarray, y_rel: np.ndarray, v_rel: np.ndarray, v_lead: np.ndarray, measured: np.ndarray):
+    # ids must be sorted and unique, tracks that are missing are dropped and new ones are started
+    if len(self.ids):
+      idxs = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+      existing = self.ids[idxs] == ids
+    else:
+      existing = np.zeros(len(ids), dtype=bool)
 
-  def update(self, d_rel: float, y_rel: float, v_rel: float, v_lead: float, measured: float):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
+    def prev(values: np.ndarray, new_value) -> np.ndarray:
+      return np.where(existing, values[idxs], new_value) if len(self.ids) else np.broadcast_to(new_value, len(ids))
 
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
+    v_lead_k = prev(self.vLeadK, v_lead)
+    a_lead_k = prev(self.aLeadK, 0.)
+    a_lead_tau = prev(self.aLeadTau, _LEAD_ACCEL_TAU)
+    cnt = prev(self.cnt, 0)
 
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+    # computed velocity and accelerations, new tracks start at the measurement
+    self.vLeadK = np.where(existing, self.A_K[0, 0] * v_lead_k + self.A_K[0, 1] * a_lead_k + self.K[0] * v_lead, v_lead_k)
+    self.aLeadK = np.where(existing, self.A_K[1, 0] * v_lead_k + self.A_K[1, 1] * a_lead_k + self.K[1] * v_lead, a_lead_k)
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau *= 0.9
-
-    self.cnt += 1
+    self.aLeadTau = np.where(np.abs(self.aLeadK) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
+    self.cnt = cnt + 1
 
-  def get_key_for_cluster(self):
-    # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
-
-  def reset_a_lead(self, aLeadK: float, aLeadTau: float):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
+    self.ids = ids
+    self.dRel = d_rel   # LONG_DIST
+    self.yRel = y_rel   # -LAT_DIST
+    self.vRel = v_rel   # REL_SPEED
+    self.vLead = v_lead
+    self.measured = measured   # measured or estimate
 
-  def get_RadarState(self, model_prob: float = 0.0):
+  def get_RadarState(self, idx: int, model_prob: float = 0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
-      "aLeadTau": float(self.aLeadTau),
+      "dRel": float(self.dRel[idx]),
+      "yRel": float(self.yRel[idx]),
+      "vRel": float(self.vRel[idx]),
+      "vLead": float(self.vLead[idx]),
+      "vLeadK": float(self.vLeadK[idx]),
+      "aLeadK": float(self.aLeadK[idx]),
+      "aLeadTau": float(self.aLeadTau[idx]),
       "status": True,
       "fcw": self.is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "radarTrackId": self.identifier,
+      "radarTrackId": int(self.ids[idx]),
     }
 
-  def potential_low_speed_lead(self, v_ego: float):
+  def potential_low_speed_lead(self, v_ego: float) -> np.ndarray:
     # stop for stuff in front of you and low speed, even without model confirmation
     # Radar points closer than 0.75, are almost always glitches on toyota radars
-    return abs(self.yRel) < 1.0 and (v_ego < V_EGO_STATIONARY) and (0.75 < self.dRel < 25)
+    return (np.abs(self.yRel) < 1.0) & (v_ego < V_EGO_STATIONARY) & (0.75 < self.dRel) & (self.dRel < 25)
 
   def is_potential_fcw(self, model_prob: float):
     return model_prob > .9
 
-  def __str__(self):
-    ret = f"x: {self.dRel:4.1f}  y: {self.yRel:4.1f}  v: {self.vRel:4.1f}  a: {self.aLeadK:4.1f}"
-    return ret
-
-
-def laplacian_pdf(x: float, mu: float, b: float):
-  b = max(b, 1e-4)
-  return math.exp(-abs(x-mu)/b)
-
 
-def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: dict[int, Track]):
+def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: Tracks) -> int | None:
   offset_vision_dist = lead.x[0] - RADAR_TO_CAMERA
 
-  def prob(c):
-    prob_d = laplacian_pdf(c.dRel, offset_vision_dist, lead.xStd[0])
-    prob_y = laplacian_pdf(c.yRel, -lead.y[0], lead.yStd[0])
-    prob_v = laplacian_pdf(c.vRel + v_ego, lead.v[0], lead.vStd[0])
-
-    # This isn't exactly right, but it's a good heuristic
-    return prob_d * prob_y * prob_v
-
-  track = max(tracks.values(), key=prob)
+  # product of laplacian pdfs for distance, lateral position and speed, compared in log space
+  # This isn't exactly right, but it's a good heuristic
+  log_prob = -(np.abs(tracks.dRel - offset_vision_dist) / max(lead.xStd[0], 1e-4) +
+               np.abs(tracks.yRel + lead.y[0]) / max(lead.yStd[0], 1e-4) +
+               np.abs(tracks.vRel + v_ego - lead.v[0]) / max(lead.vStd[0], 1e-4))
+  idx = int(np.argmax(log_prob))
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
-  dist_sane = abs(track.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
-  vel_sane = (abs(track.vRel + v_ego - lead.v[0]) < 10) or (v_ego + track.vRel > 3)
+  dist_sane = abs(tracks.dRel[idx] - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
+  vel_sane = (abs(tracks.vRel[idx] + v_ego - lead.v[0]) < 10) or (v_ego + tracks.vRel[idx] > 3)
   if dist_sane and vel_sane:
-    return track
+    return idx
   else:
     return None
 
@@ -167,7 +165,7 @@ def get_RadarState_from_vision(lead_msg: capnp._DynamicStructReader, v_ego: floa
   }
 
 
-def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capnp._DynamicStructReader,
+def get_lead(v_ego: float, ready: bool, tracks: Tracks, lead_msg: capnp._DynamicStructReader,
              model_v_ego: float, lead_detection_threshold: float, low_speed_override: bool = True) -> dict[str, Any]:
   # Determine leads, this is where the essential logic happens
   if len(tracks) > 0 and ready and lead_msg.prob > lead_detection_threshold:
@@ -177,18 +175,18 @@ def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capn
 
   lead_dict = {'status': False}
   if track is not None:
-    lead_dict = track.get_RadarState(lead_msg.prob)
+    lead_dict = tracks.get_RadarState(track, lead_msg.prob)
   elif (track is None) and ready and (lead_msg.prob > lead_detection_threshold):
     lead_dict = get_RadarState_from_vision(lead_msg, v_ego, model_v_ego)
 
   if low_speed_override:
-    low_speed_tracks = [c for c in tracks.values() if c.potential_low_speed_lead(v_ego)]
+    low_speed_tracks = np.flatnonzero(tracks.potential_low_speed_lead(v_ego))
     if len(low_speed_tracks) > 0:
-      closest_track = min(low_speed_tracks, key=lambda c: c.dRel)
+      closest_track = low_speed_tracks[np.argmin(tracks.dRel[low_speed_tracks])]
 
       # Only choose new track if it is actually closer than the previous one
-      if (not lead_dict['status']) or (closest_track.dRel < lead_dict['dRel']):
-        lead_dict = closest_track.get_RadarState()
+      if (not lead_dict['status']) or (tracks.dRel[closest_track] < lead_dict['dRel']):
+        lead_dict = tracks.get_RadarState(closest_track)
 
   return lead_dict
 
@@ -199,8 +197,8 @@ class RadarD:
 
     self.current_time = 0.0
 
-    self.tracks: dict[int, Track] = {}
     self.kalman_params = KalmanParams(radar_ts)
+    self.tracks = Tracks(self.kalman_params)
 
     self.v_ego = 0.0
     self.v_ego_hist = deque([0.0], maxlen=delay+1)
@@ -216,7 +214,6 @@ class RadarD:
     self.frogpilot_toggles = FrogPilotVariables.toggles
 
     self.secret_good_openpilot = self.frogpilot_toggles.secretgoodopenpilot_model
-    self.update_toggles = False
 
   def update(self, sm: messaging.SubMaster, rr):
     self.ready = sm.seen['modelV2']
@@ -233,26 +230,15 @@ class RadarD:
       self.v_ego_hist.append(self.v_ego)
       self.last_v_ego_frame = sm.recv_frame['carState']
 
-    ar_pts = {}
-    for pt in radar_points:
-      ar_pts[pt.trackId] = [pt.dRel, pt.yRel, pt.vRel, pt.measured]
-
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
+    # last point wins for duplicate track ids, same as keying by trackId
+    pts = np.array([(pt.trackId, pt.dRel, pt.yRel, pt.vRel, pt.measured) for pt in radar_points], dtype=np.float64).reshape(-1, 5)
+    ids, last = np.unique(pts[::-1, 0].astype(np.int64), return_index=True)
+    pts = pts[len(pts) - 1 - last]
 
     # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
-
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(ids, v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
+    # align v_ego by a fixed time to align it with the radar measurement
+    v_lead = pts[:, 3] + self.v_ego_hist[0]
+    self.tracks.update(ids, pts[:, 1], pts[:, 2], pts[:, 3], v_lead, pts[:, 4].astype(bool))
 
     # *** publish radarState ***
     self.radar_state_valid = sm.all_checks() and len(radar_errors) == 0
@@ -272,10 +258,7 @@ class RadarD:
 
     # Update FrogPilot parameters
     if FrogPilotVariables.toggles_updated:
-      self.update_toggles = True
-    elif self.update_toggles:
-      FrogPilotVariables.update_frogpilot_params()
-      self.update_toggles = False
+      FrogPilotVariables.load_frogpilot_params()
 
   def publish(self, pm: messaging.PubMaster, lag_ms: float):
     assert self.radar_state is not None
@@ -289,12 +272,13 @@ class RadarD:
     # publish tracks for UI debugging (keep last)
     tracks_msg = messaging.new_message('liveTracks', len(self.tracks))
     tracks_msg.valid = self.radar_state_valid
-    for index, tid in enumerate(sorted(self.tracks.keys())):
+    tracks = zip(self.tracks.ids.tolist(), self.tracks.dRel.tolist(), self.tracks.yRel.tolist(), self.tracks.vRel.tolist(), strict=True)
+    for index, (tid, d_rel, y_rel, v_rel) in enumerate(tracks):
       tracks_msg.liveTracks[index] = {
         "trackId": tid,
-        "dRel": float(self.tracks[tid].dRel),
-        "yRel": float(self.tracks[tid].yRel),
-        "vRel": float(self.tracks[tid].vRel),
+        "dRel": d_rel,
+        "yRel": y_rel,
+        "vRel": v_rel,
       }
     pm.send('liveTracks', tracks_msg)
 
@@ -350,7 +334,7 @@ def main():
   RD = RadarD(CP.radarTimeStep, RI.delay)
 
   if not FrogPilotVariables.toggles.radarless_model:
-    sm = messaging.SubMaster(['modelV2', 'carState'], frequency=int(1./DT_CTRL))
+    sm = messaging.SubMaster(['modelV2', 'carState'], frequency=int(1./DT_CTRL), lazy=True)
     pm = messaging.PubMaster(['radarState', 'liveTracks'])
 
     while True:
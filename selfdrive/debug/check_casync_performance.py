@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import argparse
+import functools
+import lzma
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from Crypto.Hash import SHA512
+
+from openpilot.system.updated.casync import casync
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LatencyHandler(SimpleHTTPRequestHandler):
+  latency = 0.0
+
+  def do_GET(self):
+    time.sleep(self.latency)
+    super().do_GET()
+
+  def log_message(self, format, *args):
+    pass
+
+
+def create_store(dat, store_path):
+  # fixed size chunks, stored the same way casync make does
+  target = []
+  for offset in range(0, len(dat), CHUNK_SIZE):
+    chunk = dat[offset:offset + CHUNK_SIZE]
+    sha = SHA512.new(chunk, truncate="256").digest()
+    target.append(casync.Chunk(sha, offset, len(chunk)))
+
+    chunk_path = os.path.join(store_path, sha.hex()[:4], sha.hex() + ".cacnk")
+    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+    with open(chunk_path, 'wb') as f:
+      f.write(lzma.compress(chunk))
+  return target
+
+
+def run(target, sources, out_path, num_workers):
+  if os.path.exists(out_path):
+    os.unlink(out_path)
+
+  start_t = time.monotonic()
+  stats = casync.extract(target, sources, out_path, num_workers=num_workers)
+  return time.monotonic() - start_t, stats
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Time casync extract from a chunk store served over local HTTP",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--size", type=int, default=64, help="Image size in MB")
+  parser.add_argument("--latency", type=float, default=0.02, help="Added latency per chunk request in seconds")
+  parser.add_argument("--seed-fraction", type=float, default=0.5, help="Fraction of the image that is available in a local seed")
+  parser.add_argument("--workers", type=int, nargs='+', default=[1, 4, casync.EXTRACT_WORKERS])
+  args = parser.parse_args()
+
+  LatencyHandler.latency = args.latency
+
+  with tempfile.TemporaryDirectory() as tmp:
+    # half random so lzma has something to do, half compressible
+    dat = bytearray(os.urandom(args.size * 1024 * 1024))
+    dat[::2] = bytes(len(dat[::2]))
+    dat = bytes(dat)
+
+    store_path = os.path.join(tmp, "store")
+    target = create_store(dat, store_path)
+
+    # the seed is the target image with a fraction of its chunks changed
+    seed = bytearray(dat)
+    rnd = random.Random(0)
+    for chunk in target:
+      if rnd.random() >= args.seed_fraction:
+        seed[chunk.offset:chunk.offset + chunk.length] = os.urandom(chunk.length)
+    seed_path = os.path.join(tmp, "seed")
+    with open(seed_path, 'wb') as f:
+      f.write(seed)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(LatencyHandler, directory=store_path))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    seed_reader = casync.FileChunkReader(seed_path)
+    sources = [
+      ('seed', seed_reader, casync.build_chunk_dict(target)),
+      ('remote', casync.RemoteChunkReader(url), casync.build_chunk_dict(target)),
+    ]
+
+    out_path = os.path.join(tmp, "out")
+    print(f"{len(target)} chunks, {args.size} MB, {args.latency * 1000:.0f} ms latency")
+    for num_workers in args.workers:
+      t, stats = run(target, sources, out_path, num_workers)
+      with open(out_path, 'rb') as f:
+        assert f.read() == dat
+
+      print(f"{num_workers} workers: {t:.2f} s, {args.size / t:.1f} MB/s, " +
+            ", ".join(f"{name} {size / (1024 * 1024):.1f} MB" for name, size in stats.items()))
+
+    server.shutdown()
+    seed_reader.f.close()
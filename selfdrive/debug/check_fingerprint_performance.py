@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from openpilot.selfdrive.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint, interface_names
+from openpilot.selfdrive.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS, all_legacy_fingerprint_cars, is_valid_for_fingerprint
+from openpilot.tools.lib.logreader import LogReader
+
+N_RUNS = 10
+N_FRAMES = 202  # can_fingerprint reads at most this many frames
+
+
+def legacy_can_fingerprint(next_can):
+  # fingerprinting as it was done before the inverted index, by checking every candidate's fingerprints
+  candidate_cars = {i: all_legacy_fingerprint_cars() for i in [0, 1]}
+  frame = 0
+  car_fingerprint = None
+  done = False
+
+  while not done:
+    a = next_can()
+
+    for can in a.can:
+      for b in candidate_cars:
+        if can.src == b and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
+          candidate_cars[b] = [car_name for car_name in candidate_cars[b]
+                               if any(is_valid_for_fingerprint(can, fingerprint | _DEBUG_ADDRESS) for fingerprint in _FINGERPRINTS[car_name])]
+
+    for b in candidate_cars:
+      if len(candidate_cars[b]) == 1 and frame > FRAME_FINGERPRINT:
+        car_fingerprint = candidate_cars[b][0]
+
+    failed = (all(len(cc) == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
+    done = failed or car_fingerprint is not None
+    frame += 1
+
+  return car_fingerprint, None
+
+
+def time_fingerprint(fn, can_msgs, runs):
+  ets = []
+  for _ in range(runs):
+    it = iter(can_msgs)
+    start_t = time.process_time_ns()
+    car_fingerprint, _ = fn(lambda: next(it))
+    ets.append((time.process_time_ns() - start_t) * 1e-6)
+  return car_fingerprint, ets
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Replay the CAN traffic at the start of routes through CAN fingerprinting and time it per brand",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("routes", nargs='+', help="Routes or segments to replay, starting from their first segment")
+  parser.add_argument("--runs", type=int, default=N_RUNS)
+  args = parser.parse_args()
+
+  brands = {model: brand for brand, models in interface_names.items() for model in models}
+
+  results = defaultdict(lambda: ([], []))
+  for route in args.routes:
+    can_msgs = []
+    for msg in LogReader(route, sort_by_time=True):
+      if msg.which() == 'can':
+        can_msgs.append(msg)
+        if len(can_msgs) == N_FRAMES:
+          break
+    assert len(can_msgs) == N_FRAMES, f"{route}: only {len(can_msgs)} can messages"
+
+    car_fingerprint, ets = time_fingerprint(can_fingerprint, can_msgs, args.runs)
+    legacy_car_fingerprint, legacy_ets = time_fingerprint(legacy_can_fingerprint, can_msgs, args.runs)
+    assert car_fingerprint == legacy_car_fingerprint, f"{route}: {car_fingerprint} != {legacy_car_fingerprint}"
+
+    brand = brands.get(car_fingerprint, "unknown")
+    print(f"{route}: {car_fingerprint} in {np.mean(ets):.2f} ms, legacy {np.mean(legacy_ets):.2f} ms")
+    results[brand][0].extend(ets)
+    results[brand][1].extend(legacy_ets)
+
+  print()
+  print(f"{'brand':<12} {'index ms':>10} {'legacy ms':>10}")
+  for brand, (ets, legacy_ets) in sorted(results.items()):
+    print(f"{brand:<12} {np.mean(ets):>10.2f} {np.mean(legacy_ets):>10.2f}")
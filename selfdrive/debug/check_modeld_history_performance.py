@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.history import FramePairBuffer, HistoryBuffer
+
+N_FRAMES = 1000
+MODEL_FRAME_SIZE = 512 * 256 * 3 // 2
+
+
+class LegacyHistory:
+  # the history inputs of ModelState as they were before the ring buffers, shifted on every frame
+  def __init__(self, secret):
+    self.secret = secret
+    history_len = ModelConstants.HISTORY_BUFFER_LEN_SECRET if secret else ModelConstants.HISTORY_BUFFER_LEN
+    self.desire = np.zeros(ModelConstants.DESIRE_LEN * (history_len + 1), dtype=np.float32)
+    self.prev_desired_curv = np.zeros(ModelConstants.PREV_DESIRED_CURV_LEN * (history_len + 1), dtype=np.float32)
+    self.features_buffer = np.zeros(history_len * ModelConstants.FEATURE_LEN, dtype=np.float32)
+    self.full_features_20Hz = np.zeros((ModelConstants.FULL_HISTORY_BUFFER_LEN, ModelConstants.FEATURE_LEN), dtype=np.float32)
+    self.desire_20Hz = np.zeros((ModelConstants.FULL_HISTORY_BUFFER_LEN + 1, ModelConstants.DESIRE_LEN), dtype=np.float32)
+    self.input_imgs_20hz = [np.zeros(MODEL_FRAME_SIZE * 5, dtype=np.float32) for _ in range(2)]
+    self.input_imgs = [np.zeros(MODEL_FRAME_SIZE * 2, dtype=np.float32) for _ in range(2)]
+
+  def step(self, desire, imgs, features, curv):
+    copied = 0
+    if self.secret:
+      self.desire_20Hz[:-1] = self.desire_20Hz[1:]
+      self.desire_20Hz[-1] = desire
+      self.desire[:] = self.desire_20Hz.reshape((25, 4, -1)).max(axis=1).flatten()
+      copied += self.desire_20Hz.nbytes + self.desire.nbytes
+
+      for img, imgs_20hz, input_imgs in zip(imgs, self.input_imgs_20hz, self.input_imgs, strict=True):
+        imgs_20hz[:-MODEL_FRAME_SIZE] = imgs_20hz[MODEL_FRAME_SIZE:]
+        imgs_20hz[-MODEL_FRAME_SIZE:] = img
+        input_imgs[:MODEL_FRAME_SIZE] = imgs_20hz[:MODEL_FRAME_SIZE]
+        input_imgs[MODEL_FRAME_SIZE:] = imgs_20hz[-MODEL_FRAME_SIZE:]
+        copied += imgs_20hz.nbytes + input_imgs.nbytes
+
+      self.full_features_20Hz[:-1] = self.full_features_20Hz[1:]
+      self.full_features_20Hz[-1] = features
+      self.features_buffer[:] = self.full_features_20Hz[np.arange(-4, -100, -4)[::-1]].flatten()
+      copied += self.full_features_20Hz.nbytes + self.features_buffer.nbytes
+    else:
+      self.desire[:-ModelConstants.DESIRE_LEN] = self.desire[ModelConstants.DESIRE_LEN:]
+      self.desire[-ModelConstants.DESIRE_LEN:] = desire
+      self.features_buffer[:-ModelConstants.FEATURE_LEN] = self.features_buffer[ModelConstants.FEATURE_LEN:]
+      self.features_buffer[-ModelConstants.FEATURE_LEN:] = features
+      copied += self.desire.nbytes + self.features_buffer.nbytes
+
+    self.prev_desired_curv[:-ModelConstants.PREV_DESIRED_CURV_LEN] = self.prev_desired_curv[ModelConstants.PREV_DESIRED_CURV_LEN:]
+    self.prev_desired_curv[-ModelConstants.PREV_DESIRED_CURV_LEN:] = curv
+    return copied + self.prev_desired_curv.nbytes
+
+
+class RingHistory:
+  # the history inputs of ModelState, the model reads the views returned by flat and pair
+  def __init__(self, secret):
+    self.secret = secret
+    history_len = ModelConstants.HISTORY_BUFFER_LEN_SECRET if secret else ModelConstants.HISTORY_BUFFER_LEN
+    self.prev_desired_curv = HistoryBuffer(history_len + 1, ModelConstants.PREV_DESIRED_CURV_LEN)
+    self.features = HistoryBuffer(history_len, ModelConstants.FEATURE_LEN)
+    self.desire = HistoryBuffer(history_len + 1, ModelConstants.DESIRE_LEN)
+    self.desire_input = np.zeros(ModelConstants.DESIRE_LEN * (history_len + 1), dtype=np.float32)
+    self.features_input = np.zeros(history_len * ModelConstants.FEATURE_LEN, dtype=np.float32)
+    self.full_features_20Hz = HistoryBuffer(ModelConstants.FULL_HISTORY_BUFFER_LEN, ModelConstants.FEATURE_LEN)
+    self.desire_20Hz = HistoryBuffer(ModelConstants.FULL_HISTORY_BUFFER_LEN + 1, ModelConstants.DESIRE_LEN)
+    self.input_imgs_20hz = [FramePairBuffer(5, MODEL_FRAME_SIZE) for _ in range(2)]
+    self.views: list[np.ndarray] = []
+
+  def step(self, desire, imgs, features, curv):
+    self.views = []  # what the model would be pointed at
+    copied = 0
+    if self.secret:
+      self.desire_20Hz.push(desire)
+      self.desire_20Hz.history.reshape((25, 4, -1)).max(axis=1, out=self.desire_input.reshape((25, -1)))
+      copied += 2 * desire.nbytes + self.desire_input.nbytes
+
+      for img, imgs_20hz in zip(imgs, self.input_imgs_20hz, strict=True):
+        imgs_20hz.push(img)
+        self.views.append(imgs_20hz.pair)
+        copied += img.nbytes * (2 if imgs_20hz.idx == 0 else 1)
+
+      self.full_features_20Hz.push(features)
+      gathered = self.full_features_20Hz.history[-4 * ModelConstants.HISTORY_BUFFER_LEN_SECRET::4]
+      self.features_input.reshape(gathered.shape)[:] = gathered
+      copied += 2 * features.nbytes + self.features_input.nbytes
+    else:
+      self.desire.push(desire)
+      self.features.push(features)
+      self.views += [self.desire.flat, self.features.flat]
+      copied += 2 * desire.nbytes + 2 * features.nbytes
+
+    self.prev_desired_curv.push(curv)
+    self.views.append(self.prev_desired_curv.flat)
+    return copied + 2 * curv.nbytes
+
+
+def run(history, n_frames):
+  rng = np.random.default_rng(0)
+  desire = rng.random(ModelConstants.DESIRE_LEN, dtype=np.float32)
+  imgs = [rng.random(MODEL_FRAME_SIZE, dtype=np.float32) for _ in range(2)]
+  features = rng.random(ModelConstants.FEATURE_LEN, dtype=np.float32)
+  curv = rng.random(ModelConstants.PREV_DESIRED_CURV_LEN, dtype=np.float32)
+
+  ets, copied = [], []
+  for _ in range(n_frames):
+    start_t = time.process_time_ns()
+    copied.append(history.step(desire, imgs, features, curv))
+    ets.append((time.process_time_ns() - start_t) * 1e-3)
+  return ets, copied
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Time the per frame updates of the modeld history inputs, shifted arrays against ring buffers",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--frames", type=int, default=N_FRAMES)
+  args = parser.parse_args()
+
+  for secret in (False, True):
+    print("secret good openpilot" if secret else "supercombo")
+    for name, history in (("shifted", LegacyHistory(secret)), ("ring", RingHistory(secret))):
+      ets, copied = run(history, args.frames)
+      print(f"  {name:<8} mean {np.mean(ets):8.1f} us, p99 {np.percentile(ets, 99):8.1f} us, copied {np.mean(copied) / 1024:8.1f} KiB per frame")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import argparse
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants, Plan
+from openpilot.selfdrive.modeld.fill_model_msg import PublishState, fill_model_msg
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+
+N_FRAMES = 2000
+METADATA_PATH = Path(__file__).parents[1] / 'modeld/models/supercombo_metadata.pkl'
+
+
+def get_model_outputs(n_frames):
+  # random outputs of the model, with plans going forward like real ones so lane lines get times
+  with open(METADATA_PATH, 'rb') as f:
+    model_metadata = pickle.load(f)
+
+  rng = np.random.default_rng(0)
+  parser = Parser()
+  outputs = []
+  for _ in range(n_frames):
+    raw = rng.standard_normal(model_metadata['output_shapes']['outputs'][1]).astype(np.float32)
+    outs = parser.parse_outputs({k: raw[np.newaxis, v].copy() for k, v in model_metadata['output_slices'].items()}, False)
+    outs = {k: v.copy() for k, v in outs.items()}
+    outs['plan'][0,:,Plan.POSITION][:,0] = np.cumsum(rng.uniform(0, 10, ModelConstants.IDX_N))
+    outputs.append(outs)
+  return outputs
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Time building and serializing modelV2 messages from model outputs",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--frames", type=int, default=N_FRAMES)
+  args = parser.parse_args()
+
+  outputs = get_model_outputs(args.frames)
+  publish_state = PublishState()
+
+  ets = []
+  for frame_id, outs in enumerate(outputs):
+    start_t = time.process_time_ns()
+    fill_model_msg(outs, publish_state, frame_id, frame_id, frame_id, 0., 0, 0, 0.05, False, True, False).to_bytes()
+    ets.append((time.process_time_ns() - start_t) * 1e-3)
+
+  print(f"modelV2 publish: mean {np.mean(ets):.1f} us, p50 {np.percentile(ets, 50):.1f} us, p99 {np.percentile(ets, 99):.1f} us")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from cereal import car
+from openpilot.selfdrive.controls.radard import RadarD
+from openpilot.tools.lib.logreader import LogReader
+
+N_RUNS = 10
+
+
+class ReplaySubMaster:
+  # the parts of SubMaster that RadarD.update uses
+  def __init__(self):
+    self.data = {}
+    self.seen = {'modelV2': False, 'carState': False}
+    self.logMonoTime = {'modelV2': 0, 'carState': 0}
+    self.recv_frame = {'modelV2': 0, 'carState': 0}
+
+  def __getitem__(self, s):
+    return self.data[s]
+
+  def all_checks(self):
+    return all(self.seen.values())
+
+  def update_msg(self, msg):
+    s = msg.which()
+    self.data[s] = getattr(msg, s)
+    self.seen[s] = True
+    self.logMonoTime[s] = msg.logMonoTime
+    self.recv_frame[s] += 1
+
+  def copy(self):
+    sm = ReplaySubMaster()
+    sm.data, sm.seen, sm.logMonoTime, sm.recv_frame = dict(self.data), dict(self.seen), dict(self.logMonoTime), dict(self.recv_frame)
+    return sm
+
+
+def get_frames(lr):
+  # radar points are rebuilt from the recorded liveTracks, which radard publishes from the raw tracks
+  frames = []
+  sm = ReplaySubMaster()
+  for msg in lr:
+    if msg.which() in ('carState', 'modelV2'):
+      sm.update_msg(msg)
+    elif msg.which() == 'liveTracks' and sm.all_checks():
+      rr = car.RadarData.new_message()
+      points = rr.init('points', len(msg.liveTracks))
+      for pt, track in zip(points, msg.liveTracks, strict=True):
+        pt.trackId = track.trackId
+        pt.dRel = track.dRel
+        pt.yRel = track.yRel
+        pt.vRel = track.vRel
+        pt.measured = True
+      frames.append((sm.copy(), rr.as_reader()))
+  return frames
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Replay radar tracks and modelV2 from a route through radard and time each update",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("route", help="The route or segment range to replay")
+  parser.add_argument("--radar-ts", type=float, default=0.05, help="Radar time step (CarParams.radarTimeStep)")
+  parser.add_argument("--runs", type=int, default=N_RUNS)
+  args = parser.parse_args()
+
+  frames = get_frames(LogReader(args.route, sort_by_time=True))
+  assert len(frames), "no liveTracks with carState and modelV2 found"
+  num_tracks = [len(rr.points) for _, rr in frames]
+
+  ets = []
+  for _ in tqdm(range(args.runs)):
+    RD = RadarD(args.radar_ts)
+    for sm, rr in frames:
+      start_t = time.process_time_ns()
+      RD.update(sm, rr)
+      ets.append((time.process_time_ns() - start_t) * 1e-3)
+
+  print(f'{len(frames)} radar frames, {np.mean(num_tracks):.1f} mean tracks, {max(num_tracks)} max tracks, {args.runs} runs')
+  print(f'{np.mean(ets):.1f} mean us, {np.percentile(ets, 99):.1f} p99 us, {max(ets):.1f} max us per update')
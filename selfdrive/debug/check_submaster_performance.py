@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal.services import SERVICE_LIST
+
+N_CYCLES = 10000
+
+# the services and update rates of the SubMasters in controlsd, plannerd and radard
+DAEMONS = {
+  "controlsd": (['deviceState', 'pandaStates', 'peripheralState', 'modelV2', 'liveCalibration',
+                 'carOutput', 'driverMonitoringState', 'longitudinalPlan', 'liveLocationKalman',
+                 'managerState', 'liveParameters', 'radarState', 'liveTorqueParameters',
+                 'testJoystick', 'frogpilotCarState', 'frogpilotPlan', 'roadCameraState', 'driverCameraState',
+                 'wideRoadCameraState', 'accelerometer', 'gyroscope'], 100.),
+  "plannerd": (['carControl', 'carState', 'controlsState', 'radarState', 'modelV2', 'frogpilotCarControl',
+                'frogpilotCarState', 'frogpilotPlan'], 20.),
+  "radard": (['modelV2', 'carState'], 100.),
+}
+
+
+def get_cycles(services, freq, n_cycles):
+  # every service publishes at its own rate, the cycles are at the daemon's rate
+  dats = {}
+  for s in services:
+    try:
+      msg = messaging.new_message(s, valid=True)
+    except Exception:
+      msg = messaging.new_message(s, 1, valid=True)
+    dats[s] = msg.to_bytes()
+
+  cycles = []
+  for i in range(n_cycles):
+    cycle = [dats[s] for s in services if SERVICE_LIST[s].frequency > 0 and
+             int(i * SERVICE_LIST[s].frequency / freq) != int((i - 1) * SERVICE_LIST[s].frequency / freq)]
+    cycles.append((i / freq, cycle))
+  return cycles
+
+
+def run(sm, cycles, lazy, access):
+  ets = []
+  for cur_time, dats in cycles:
+    start_t = time.process_time_ns()
+    if lazy:
+      sm.update_raw_msgs(cur_time, dats)
+    else:
+      sm.update_msgs(cur_time, [messaging.log_from_bytes(dat) for dat in dats])
+    for s in access:
+      if sm.updated[s]:
+        sm[s]
+    sm.all_checks()
+    ets.append((time.process_time_ns() - start_t) * 1e-3)
+  return ets
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Time the per cycle overhead of SubMaster with the services of the control daemons",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--cycles", type=int, default=N_CYCLES)
+  parser.add_argument("--access", type=float, default=0.5, help="Fraction of the services read when updated")
+  args = parser.parse_args()
+
+  for daemon, (services, freq) in DAEMONS.items():
+    cycles = get_cycles(services, freq, args.cycles)
+    access = services[:int(len(services) * args.access)]
+    print(f"{daemon}: {len(services)} services at {freq:.0f} Hz, {sum(len(c) for _, c in cycles) / len(cycles):.1f} messages per cycle")
+    for lazy in (False, True):
+      ets = run(messaging.SubMaster(services, frequency=freq, lazy=lazy), cycles, lazy, access)
+      print(f"  {'lazy' if lazy else 'eager'}: mean {np.mean(ets):.1f} us, p99 {np.percentile(ets, 99):.1f} us")
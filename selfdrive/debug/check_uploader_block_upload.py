@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import bz2
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from openpilot.system.loggerd import uploader
+from openpilot.system.loggerd.uploader import UPLOAD_BLOCK_SIZE, Uploader
+
+
+class BlobHandler(BaseHTTPRequestHandler):
+  """
+  Stand-in for the upload_url API and a block blob store. Put Block stores uncommitted blocks,
+  Put Block List commits them, a plain PUT stores the whole blob. Block indexes in fail_blocks fail
+  once each, with a dropped connection or the given status code.
+  """
+  blobs: dict[str, bytes] = {}
+  uncommitted: dict[str, dict[str, bytes]] = {}
+  block_puts: Counter = Counter()
+  fail_blocks: dict[int, int | None] = {}
+  lock = threading.Lock()
+
+  def do_GET(self):
+    url = urllib.parse.urlparse(self.path)
+    path = urllib.parse.parse_qs(url.query)['path'][0]
+    host, port = self.server.server_address[:2]
+    body = json.dumps({'url': f"http://{host}:{port}/blob/{path}", 'headers': {'x-ms-blob-type': 'BlockBlob'}}).encode()
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_PUT(self):
+    url = urllib.parse.urlparse(self.path)
+    query = urllib.parse.parse_qs(url.query)
+    data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    with self.lock:
+      if query.get('comp') == ['block']:
+        block_id = query['blockid'][0]
+        idx = int(base64.b64decode(block_id))
+        self.block_puts[(url.path, idx)] += 1
+        if idx in self.fail_blocks:
+          status = self.fail_blocks.pop(idx)
+          if status is None:
+            self.close_connection = True  # closed without a response
+          else:
+            self.send_response(status)
+            self.end_headers()
+          return
+        self.uncommitted.setdefault(url.path, {})[block_id] = data
+      elif query.get('comp') == ['blocklist']:
+        blocks = self.uncommitted.pop(url.path, {})
+        block_ids = [b.split("</Latest>")[0] for b in data.decode().split("<Latest>")[1:]]
+        if any(block_id not in blocks for block_id in block_ids):
+          self.send_response(400)
+          self.end_headers()
+          return
+        self.blobs[url.path] = b"".join(blocks[block_id] for block_id in block_ids)
+      else:
+        self.blobs[url.path] = data
+
+    self.send_response(201)
+    self.end_headers()
+
+  def log_message(self, format, *args):
+    pass
+
+
+class LocalApi:
+  def __init__(self, host: str):
+    self.host = host
+
+  def get(self, endpoint, timeout=None, access_token=None, **params):
+    return requests.get(f"{self.host}/{endpoint}", params=params, timeout=timeout)
+
+  def get_token(self):
+    return ""
+
+
+def check(name: str, ok: bool) -> bool:
+  print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+  return ok
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Check block uploads, retries and resuming against a local HTTP stand-in",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--blocks", type=int, default=6, help="Size of the uploaded file in upload blocks")
+  parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the file is written, needs user xattrs")
+  args = parser.parse_args()
+
+  server = ThreadingHTTPServer(("127.0.0.1", 0), BlobHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  host = f"http://127.0.0.1:{server.server_address[1]}"
+  uploader.Api = lambda dongle_id: LocalApi(host)
+
+  root = tempfile.mkdtemp(dir=args.dir)
+  logdir = "0000000a--0000000000--0"
+  os.makedirs(os.path.join(root, logdir))
+  fn = os.path.join(root, logdir, "rlog")
+  with open(fn, "wb") as f:
+    f.write(os.urandom(args.blocks * UPLOAD_BLOCK_SIZE - 1000))
+  with open(fn, "rb") as f:
+    expected = f.read()
+
+  results = []
+  for key, decode in ((f"{logdir}/rlog", lambda dat: dat), (f"{logdir}/rlog.bz2", bz2.decompress)):
+    print(key)
+    blob = f"/blob/{key}"
+    BlobHandler.block_puts.clear()
+    fail_idx = args.blocks // 2
+
+    # a dropped connection is retried within the upload, an error response fails it
+    BlobHandler.fail_blocks = {1: None, fail_idx: 500}
+    ok = Uploader("0" * 16, root).upload("rlog", key, fn, 0, False)
+    results.append(check("upload fails on an error response", not ok and blob not in BlobHandler.blobs))
+    results.append(check("dropped connection is retried", BlobHandler.block_puts[(blob, 1)] == 2))
+    results.append(check("progress is kept with the file", Uploader.get_block_progress(key, fn) == fail_idx))
+
+    # a new uploader, like after a restart, only sends the rest
+    ok = Uploader("0" * 16, root).upload("rlog", key, fn, 0, False)
+    results.append(check("resumed upload succeeds", ok and decode(BlobHandler.blobs.get(blob, b"")) == expected))
+    results.append(check("sent blocks aren't sent again", all(BlobHandler.block_puts[(blob, i)] == (2 if i == 1 else 1)
+                                                               for i in range(fail_idx))))
+    results.append(check("progress is cleared", Uploader.get_block_progress(key, fn) == 0))
+
+  server.shutdown()
+  shutil.rmtree(root)
+  print("all checks passed" if all(results) else "some checks FAILED")
@@ -1,11 +1,24 @@
 #!/usr/bin/env python3
 import argparse
+import time
 
 from openpilot.tools.lib.live_logreader import live_logreader
+from openpilot.selfdrive.car.fw_versions import match_fw_to_car
 from openpilot.tools.lib.logreader import LogReader, ReadMode
 from panda.python import uds
 
 
+def match_fw(lr):
+  # matches the FW versions the car was fingerprinted with against the current database
+  for msg in lr:
+    if msg.which() == 'carParams':
+      CP = msg.carParams
+      start_t = time.monotonic()
+      exact_match, matches = match_fw_to_car(CP.carFw, CP.carVin, log=False)
+      print(f"{CP.carFingerprint}: {'exact' if exact_match else 'fuzzy'} {matches} in {(time.monotonic() - start_t) * 1e3:.2f} ms")
+      break
+
+
 def main(route: str | None, addrs: list[int]):
   """
   TODO:
@@ -44,7 +57,12 @@ if __name__ == "__main__":
   parser = argparse.ArgumentParser(description='View back and forth ISO-TP communication between various ECUs given an address')
   parser.add_argument('route', nargs='?', help='Route name, live if not specified')
   parser.add_argument('--addrs', nargs='*', default=[], help='List of tx address to view (0x7e0 for engine)')
+  parser.add_argument('--match', action='store_true', help='Match the FW versions in carParams of the route instead')
   args = parser.parse_args()
 
-  addrs = [int(addr, base=16) if addr.startswith('0x') else int(addr) for addr in args.addrs]
-  main(args.route, addrs)
+  if args.match:
+    assert args.route is not None, "matching needs a route"
+    match_fw(LogReader(args.route, default_mode=ReadMode.QLOG))
+  else:
+    addrs = [int(addr, base=16) if addr.startswith('0x') else int(addr) for addr in args.addrs]
+    main(args.route, addrs)
@@ -11,6 +11,7 @@ from openpilot.system.version import get_build_metadata
 
 from openpilot.selfdrive.frogpilot.controls.lib.frogpilot_functions import MODELS_PATH
 from openpilot.selfdrive.frogpilot.controls.lib.model_manager import DEFAULT_MODEL, DEFAULT_MODEL_NAME, process_model_name
+from openpilot.selfdrive.frogpilot.controls.lib.toggle_snapshot import ToggleSnapshot
 
 CITY_SPEED_LIMIT = 25  # 55mph is typically the minimum speed for highways
 CRUISING_SPEED = 5     # Roughly the speed cars go when not touching the gas while in drive
@@ -23,10 +24,13 @@ class FrogPilotVariables:
     self.params = Params()
     self.params_memory = Params("/dev/shm/params")
 
+    self.snapshot = ToggleSnapshot()
+    self.generation = 0
+
     self.has_prime = self.params.get_int("PrimeType") > 0
     self.release = get_build_metadata().release_channel
 
-    self.update_frogpilot_params(False)
+    self.load_frogpilot_params(False)
 
   @property
   def toggles(self):
@@ -34,9 +38,21 @@ class FrogPilotVariables:
 
   @property
   def toggles_updated(self):
-    return self.params_memory.get_bool("FrogPilotTogglesUpdated")
+    return self.snapshot.generation != self.generation
+
+  def load_frogpilot_params(self, started=True):
+    # Computes the toggles from Params if no process has published them yet
+    generation = self.snapshot.load(self.frogpilot_toggles)
+    if generation:
+      self.generation = generation
+    else:
+      self.update_frogpilot_params(started)
 
   def update_frogpilot_params(self, started=True):
+    self.compute_frogpilot_params(started)
+    self.generation = self.snapshot.publish(self.frogpilot_toggles)
+
+  def compute_frogpilot_params(self, started):
     toggle = self.frogpilot_toggles
 
     openpilot_installed = self.params.get_bool("HasAcceptedTerms")
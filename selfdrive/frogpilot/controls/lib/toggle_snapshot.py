@@ -0,0 +1,145 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from types import SimpleNamespace
+
+SNAPSHOT_PATH = "/dev/shm/frogpilot_toggles"
+SNAPSHOT_SIZE = 64 * 1024
+
+LOAD_RETRIES = 10
+
+# generation, crc32 of the layout and values, layout length, values length
+HEADER = struct.Struct("<QIII")
+GENERATION = struct.Struct("<Q")
+
+VALUE_FORMATS = {"?": "?", "q": "q", "d": "d", "n": ""}
+
+
+def _field(name, value):
+  if value is None:
+    return [name, "n", 0], []
+  if isinstance(value, bool):
+    return [name, "?", 1], [value]
+  if isinstance(value, int):
+    return [name, "q", 1], [value]
+  if isinstance(value, float):
+    return [name, "d", 1], [value]
+  if isinstance(value, str):
+    encoded = value.encode("utf-8")
+    return [name, "s", len(encoded)], [encoded]
+  if isinstance(value, list):
+    return [name, "l", len(value)], [float(v) for v in value]
+  raise TypeError(f"unsupported toggle type for {name}: {type(value).__name__}")
+
+
+def _value_format(code, count):
+  if code == "s":
+    return f"{count}s"
+  if code == "l":
+    return f"{count}d"
+  return VALUE_FORMATS[code]
+
+
+class ToggleSnapshot:
+  """
+  The FrogPilot toggles packed into a fixed size file in /dev/shm. Writers pack every toggle
+  with struct next to a small JSON layout of names and types and bump the generation counter,
+  readers map the file read-only so checking for new toggles is a single read of the counter.
+  """
+  def __init__(self, path=SNAPSHOT_PATH):
+    self.path = path
+    self.mm = None
+    self.layout = None  # (layout bytes, values struct, fields)
+
+  def _map(self):
+    try:
+      fd = os.open(self.path, os.O_RDONLY)
+    except FileNotFoundError:
+      return False
+
+    try:
+      if os.fstat(fd).st_size < SNAPSHOT_SIZE:
+        return False
+      self.mm = mmap.mmap(fd, SNAPSHOT_SIZE, prot=mmap.PROT_READ)
+    finally:
+      os.close(fd)
+    return True
+
+  @property
+  def generation(self):
+    if self.mm is None and not self._map():
+      return 0
+    return GENERATION.unpack_from(self.mm)[0]
+
+  def publish(self, toggles: SimpleNamespace):
+    """Writes the toggles and returns the new generation"""
+    layout, values = [], []
+    for name, value in vars(toggles).items():
+      field, field_values = _field(name, value)
+      layout.append(field)
+      values += field_values
+
+    layout_bytes = json.dumps(layout, separators=(",", ":")).encode("utf-8")
+    values_bytes = struct.pack("<" + "".join(_value_format(code, count) for _, code, count in layout), *values)
+    payload = layout_bytes + values_bytes
+    if HEADER.size + len(payload) > SNAPSHOT_SIZE:
+      raise ValueError(f"toggle snapshot is {len(payload)} bytes, larger than {SNAPSHOT_SIZE - HEADER.size}")
+
+    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      # the lock serializes writers, readers detect partial writes with the crc
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      if os.fstat(fd).st_size < SNAPSHOT_SIZE:
+        os.ftruncate(fd, SNAPSHOT_SIZE)
+
+      with mmap.mmap(fd, SNAPSHOT_SIZE) as mm:
+        generation = GENERATION.unpack_from(mm)[0] + 1
+        mm[HEADER.size:HEADER.size + len(payload)] = payload
+        HEADER.pack_into(mm, 0, generation, zlib.crc32(payload), len(layout_bytes), len(values_bytes))
+    finally:
+      os.close(fd)
+    return generation
+
+  def load(self, toggles: SimpleNamespace):
+    """Updates toggles in place from the latest snapshot and returns its generation, 0 if there is none"""
+    if self.mm is None and not self._map():
+      return 0
+
+    for _ in range(LOAD_RETRIES):
+      generation, crc, layout_len, values_len = HEADER.unpack_from(self.mm)
+      if generation == 0:
+        return 0
+
+      payload = self.mm[HEADER.size:HEADER.size + layout_len + values_len]
+      if zlib.crc32(payload) == crc and GENERATION.unpack_from(self.mm)[0] == generation:
+        break
+    else:
+      return 0
+
+    layout_bytes = payload[:layout_len]
+    if self.layout is None or self.layout[0] != layout_bytes:
+      fields = json.loads(layout_bytes)
+      values_struct = struct.Struct("<" + "".join(_value_format(code, count) for _, code, count in fields))
+      self.layout = (layout_bytes, values_struct, fields)
+
+    _, values_struct, fields = self.layout
+    values = values_struct.unpack_from(payload, layout_len)
+
+    i = 0
+    for name, code, count in fields:
+      if code == "n":
+        setattr(toggles, name, None)
+      elif code == "s":
+        setattr(toggles, name, values[i].decode("utf-8"))
+        i += 1
+      elif code == "l":
+        setattr(toggles, name, list(values[i:i + count]))
+        i += count
+      else:
+        setattr(toggles, name, values[i])
+        i += 1
+    return generation
@@ -130,7 +130,7 @@ def frogpilot_thread():
     if params_memory.get_bool("DownloadAllModels"):
       run_thread_with_lock("download_all_models", locks["download_all_models"], download_all_models, (params, params_memory))
 
-    if FrogPilotVariables.toggles_updated:
+    if params_memory.get_bool("FrogPilotTogglesUpdated"):
       update_toggles = True
     elif update_toggles:
       run_thread_with_lock("update_frogpilot_params", locks["update_frogpilot_params"], FrogPilotVariables.update_frogpilot_params, (started,))
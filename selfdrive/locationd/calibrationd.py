@@ -64,8 +64,6 @@ class Calibrator:
     # FrogPilot variables
     self.frogpilot_toggles = FrogPilotVariables.toggles
 
-    self.update_toggles = False
-
     self.param_put = param_put
 
     self.not_car = False
@@ -178,10 +176,7 @@ class Calibrator:
 
     # Update FrogPilot parameters
     if FrogPilotVariables.toggles_updated:
-      self.update_toggles = True
-    elif self.update_toggles:
-      FrogPilotVariables.update_frogpilot_params()
-      self.update_toggles = False
+      FrogPilotVariables.load_frogpilot_params()
 
   def handle_v_ego(self, v_ego: float) -> None:
     self.v_ego = v_ego
@@ -5,25 +5,50 @@ from cereal import log
 
 
 class NPQueue:
-  def __init__(self, maxlen: int, rowsize: int) -> None:
+  """
+  Fixed size queue of rows in a preallocated circular buffer. Every row is stored twice,
+  so the rows in insertion order are always available as a contiguous view without copying.
+  With track_moments the sum of the outer products of the rows is kept up to date on every append.
+  """
+  def __init__(self, maxlen: int, rowsize: int, track_moments: bool = False) -> None:
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.zeros((2 * maxlen, rowsize))
+    self.start = 0
+    self.count = 0
+    self.track_moments = track_moments
+    self.second_moment = np.zeros((rowsize, rowsize))
 
   def __len__(self) -> int:
-    return len(self.arr)
+    return self.count
+
+  @property
+  def arr(self) -> np.ndarray:
+    return self.buf[self.start:self.start + self.count]
 
   def append(self, pt: list[float]) -> None:
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    if self.count < self.maxlen:
+      idx = self.count
+      self.count += 1
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      idx = self.start
+      self.start = (self.start + 1) % self.maxlen
+      if self.track_moments:
+        self.second_moment -= np.outer(self.buf[idx], self.buf[idx])
+
+    self.buf[idx] = pt
+    self.buf[idx + self.maxlen] = pt
+    if self.track_moments:
+      if self.start == 0 and self.count == self.maxlen:
+        # recompute once per lap, so rounding errors of the updates don't accumulate
+        self.second_moment = self.arr.T @ self.arr
+      else:
+        self.second_moment += np.outer(self.buf[idx], self.buf[idx])
 
 
 class PointBuckets:
   def __init__(self, x_bounds: list[tuple[float, float]], min_points: list[float], min_points_total: int, points_per_bucket: int, rowsize: int) -> None:
     self.x_bounds = x_bounds
-    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize) for bounds in x_bounds}
+    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize, track_moments=True) for bounds in x_bounds}
     self.buckets_min_points = dict(zip(x_bounds, min_points, strict=True))
     self.min_points_total = min_points_total
 
@@ -41,6 +66,10 @@ class PointBuckets:
   def add_point(self, x: float, y: float, bucket_val: float) -> None:
     raise NotImplementedError
 
+  def get_second_moment(self) -> np.ndarray:
+    # equal to points.T @ points over all points
+    return sum(v.second_moment for v in self.buckets.values())
+
   def get_points(self, num_points: int = None) -> Any:
     points = np.vstack([x.arr for x in self.buckets.values()])
     if num_points is None:
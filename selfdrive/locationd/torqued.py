@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import numpy as np
-from collections import deque, defaultdict
 
 import cereal.messaging as messaging
 from cereal import car, log
@@ -9,7 +8,7 @@ from openpilot.common.realtime import config_realtime_process, DT_MDL
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.swaglog import cloudlog
 from openpilot.selfdrive.controls.lib.vehicle_model import ACCELERATION_DUE_TO_GRAVITY
-from openpilot.selfdrive.locationd.helpers import PointBuckets, ParameterEstimator
+from openpilot.selfdrive.locationd.helpers import NPQueue, PointBuckets, ParameterEstimator
 
 from openpilot.selfdrive.frogpilot.controls.lib.frogpilot_variables import FrogPilotVariables
 
@@ -17,8 +16,6 @@ HISTORY = 5  # secs
 POINTS_PER_BUCKET = 1500
 MIN_POINTS_TOTAL = 4000
 MIN_POINTS_TOTAL_QLOG = 600
-FIT_POINTS_TOTAL = 2000
-FIT_POINTS_TOTAL_QLOG = 600
 MIN_VEL = 15  # m/s
 FRICTION_FACTOR = 1.5  # ~85% of data coverage
 FACTOR_SANITY = 0.3
@@ -56,21 +53,17 @@ class TorqueEstimator(ParameterEstimator):
     # FrogPilot variables
     self.frogpilot_toggles = FrogPilotVariables.toggles
 
-    self.update_toggles = False
-
     self.hist_len = int(HISTORY / DT_MDL)
     self.lag = CP.steerActuatorDelay + .2   # from controlsd
     if decimated:
       self.min_bucket_points = MIN_BUCKET_POINTS / 10
       self.min_points_total = MIN_POINTS_TOTAL_QLOG
-      self.fit_points = FIT_POINTS_TOTAL_QLOG
       self.factor_sanity = FACTOR_SANITY_QLOG
       self.friction_sanity = FRICTION_SANITY_QLOG
 
     else:
       self.min_bucket_points = MIN_BUCKET_POINTS
       self.min_points_total = MIN_POINTS_TOTAL
-      self.fit_points = FIT_POINTS_TOTAL
       self.factor_sanity = FACTOR_SANITY
       self.friction_sanity = FRICTION_SANITY
 
@@ -139,7 +132,12 @@ class TorqueEstimator(ParameterEstimator):
   def reset(self):
     self.resets += 1.0
     self.decay = MIN_FILTER_DECAY
-    self.raw_points = defaultdict(lambda: deque(maxlen=self.hist_len))
+    # time, active | time, steer torque | time, vego, steer override
+    self.raw_points = {
+      "carControl": NPQueue(maxlen=self.hist_len, rowsize=2),
+      "carOutput": NPQueue(maxlen=self.hist_len, rowsize=2),
+      "carState": NPQueue(maxlen=self.hist_len, rowsize=3),
+    }
     self.filtered_points = TorqueBuckets(x_bounds=STEER_BUCKET_BOUNDS,
                                          min_points=self.min_bucket_points,
                                          min_points_total=self.min_points_total,
@@ -147,14 +145,20 @@ class TorqueEstimator(ParameterEstimator):
                                          rowsize=3)
 
   def estimate_params(self):
-    points = self.filtered_points.get_points(self.fit_points)
+    # second moment of the [x, 1, y] points, maintained as points are added
+    moment = self.filtered_points.get_second_moment()
     # total least square solution as both x and y are noisy observations
     # this is empirically the slope of the hysteresis parallelogram as opposed to the line through the diagonals
     try:
-      _, _, v = np.linalg.svd(points, full_matrices=False)
-      slope, offset = -v.T[0:2, 2] / v.T[2, 2]
-      _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
-      friction_coeff = np.std(spread) * FRICTION_FACTOR
+      # the right singular vector of the smallest singular value of the points
+      _, v = np.linalg.eigh(moment)
+      slope, offset = -v[0:2, 0] / v[2, 0]
+      # std of the points rotated by the slope, from their covariance
+      n = moment[1, 1]
+      mean = moment[[0, 2], 1] / n
+      cov = moment[np.ix_([0, 2], [0, 2])] / n - np.outer(mean, mean)
+      rot = slope2rot(slope)[:, 1]
+      friction_coeff = np.sqrt(max(rot @ cov @ rot, 0.)) * FRICTION_FACTOR
     except np.linalg.LinAlgError as e:
       cloudlog.exception(f"Error computing live torque params: {e}")
       slope = offset = friction_coeff = np.nan
@@ -168,30 +172,27 @@ class TorqueEstimator(ParameterEstimator):
 
     # Update FrogPilot parameters
     if FrogPilotVariables.toggles_updated:
-      self.update_toggles = True
-    elif self.update_toggles:
-      FrogPilotVariables.update_frogpilot_params()
-      self.update_toggles = False
+      FrogPilotVariables.load_frogpilot_params()
 
   def handle_log(self, t, which, msg):
     if which == "carControl":
-      self.raw_points["carControl_t"].append(t + self.lag)
-      self.raw_points["active"].append(msg.latActive)
+      self.raw_points["carControl"].append((t + self.lag, msg.latActive))
     elif which == "carOutput":
-      self.raw_points["carOutput_t"].append(t + self.lag)
-      self.raw_points["steer_torque"].append(-msg.actuatorsOutput.steer)
+      self.raw_points["carOutput"].append((t + self.lag, -msg.actuatorsOutput.steer))
     elif which == "carState":
-      self.raw_points["carState_t"].append(t + self.lag)
-      self.raw_points["vego"].append(msg.vEgo)
-      self.raw_points["steer_override"].append(msg.steeringPressed)
+      self.raw_points["carState"].append((t + self.lag, msg.vEgo, msg.steeringPressed))
     elif which == "liveLocationKalman":
-      if len(self.raw_points['steer_torque']) == self.hist_len:
+      if len(self.raw_points['carOutput']) == self.hist_len:
         yaw_rate = msg.angularVelocityCalibrated.value[2]
         roll = msg.orientationNED.value[0]
-        active = np.interp(np.arange(t - MIN_ENGAGE_BUFFER, t, DT_MDL), self.raw_points['carControl_t'], self.raw_points['active']).astype(bool)
-        steer_override = np.interp(np.arange(t - MIN_ENGAGE_BUFFER, t, DT_MDL), self.raw_points['carState_t'], self.raw_points['steer_override']).astype(bool)
-        vego = np.interp(t, self.raw_points['carState_t'], self.raw_points['vego'])
-        steer = np.interp(t, self.raw_points['carOutput_t'], self.raw_points['steer_torque'])
+        car_control = self.raw_points['carControl'].arr
+        car_output = self.raw_points['carOutput'].arr
+        car_state = self.raw_points['carState'].arr
+        engage_buffer_t = np.arange(t - MIN_ENGAGE_BUFFER, t, DT_MDL)
+        active = np.interp(engage_buffer_t, car_control[:, 0], car_control[:, 1]).astype(bool)
+        steer_override = np.interp(engage_buffer_t, car_state[:, 0], car_state[:, 2]).astype(bool)
+        vego = np.interp(t, car_state[:, 0], car_state[:, 1])
+        steer = np.interp(t, car_output[:, 0], car_output[:, 1])
         lateral_acc = (vego * yaw_rate) - (np.sin(roll) * ACCELERATION_DUE_TO_GRAVITY)
         if all(active) and (not any(steer_override)) and (vego > MIN_VEL) and (abs(steer) > STEER_MIN_THRESHOLD) and (abs(lateral_acc) <= LAT_ACC_THRESHOLD):
           self.filtered_points.add_point(float(steer), float(lateral_acc))
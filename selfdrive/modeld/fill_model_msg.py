@@ -1,4 +1,5 @@
 import os
+import time
 import capnp
 import numpy as np
 from cereal import log
@@ -8,11 +9,17 @@ SEND_RAW_PRED = os.getenv('SEND_RAW_PRED')
 
 ConfidenceClass = log.ModelDataV2.ConfidenceClass
 
-class PublishState:
-  def __init__(self):
-    self.disengage_buffer = np.zeros(ModelConstants.CONFIDENCE_BUFFER_LEN*ModelConstants.DISENGAGE_WIDTH, dtype=np.float32)
-    self.prev_brake_5ms2_probs = np.zeros(ModelConstants.FCW_5MS2_PROBS_WIDTH, dtype=np.float32)
-    self.prev_brake_3ms2_probs = np.zeros(ModelConstants.FCW_3MS2_PROBS_WIDTH, dtype=np.float32)
+X_IDXS = np.array(ModelConstants.X_IDXS)
+T_IDXS = np.array(ModelConstants.T_IDXS)
+
+DISENGAGE_PREDICTIONS = {
+  'brakeDisengageProbs': Meta.BRAKE_DISENGAGE,
+  'gasDisengageProbs': Meta.GAS_DISENGAGE,
+  'steerOverrideProbs': Meta.STEER_OVERRIDE,
+  'brake3MetersPerSecondSquaredProbs': Meta.HARD_BRAKE_3,
+  'brake4MetersPerSecondSquaredProbs': Meta.HARD_BRAKE_4,
+  'brake5MetersPerSecondSquaredProbs': Meta.HARD_BRAKE_5,
+}
 
 def fill_xyzt(builder, t, x, y, z, x_std=None, y_std=None, z_std=None):
   builder.t = t
@@ -41,116 +48,182 @@ def fill_xyvat(builder, t, x, y, v, a, x_std=None, y_std=None, v_std=None, a_std
   if a_std is not None:
     builder.aStd = a_std.tolist()
 
-def fill_model_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str, np.ndarray], publish_state: PublishState,
-                   vipc_frame_id: int, vipc_frame_id_extra: int, frame_id: int, frame_drop: float,
-                   timestamp_eof: int, timestamp_llk: int, model_execution_time: float,
-                   nav_enabled: bool, valid: bool, secret_good_openpilot: bool) -> None:
-  frame_age = frame_id - vipc_frame_id if frame_id > vipc_frame_id else 0
-  msg.valid = valid
+class ModelV2Template:
+  """
+  A serialized modelV2 event with all the lists already initialized. The floats that change every frame
+  are first set to unique markers to find where they are stored, then a frame is written with a numpy
+  assignment per group of values and read back as a message, instead of setting ~100 lists one by one.
+  """
+  def __init__(self):
+    self.n_markers = 0
+    self.groups: dict[str, tuple[int, tuple[int, ...]]] = {}
 
-  modelV2 = msg.modelV2
-  modelV2.frameId = vipc_frame_id
-  modelV2.frameIdExtra = vipc_frame_id_extra
-  modelV2.frameAge = frame_age
-  modelV2.frameDropPerc = frame_drop * 100
-  modelV2.timestampEof = timestamp_eof
-  modelV2.locationMonoTime = timestamp_llk
-  modelV2.modelExecutionTime = model_execution_time
-  modelV2.navEnabled = nav_enabled
+    msg = log.Event.new_message()
+    modelV2 = msg.init('modelV2')
 
-  # plan
-  position = modelV2.position
-  fill_xyzt(position, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.POSITION].T, *net_output_data['plan_stds'][0,:,Plan.POSITION].T)
-  velocity = modelV2.velocity
-  fill_xyzt(velocity, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.VELOCITY].T)
-  acceleration = modelV2.acceleration
-  fill_xyzt(acceleration, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ACCELERATION].T)
-  orientation = modelV2.orientation
-  fill_xyzt(orientation, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.T_FROM_CURRENT_EULER].T)
-  orientation_rate = modelV2.orientationRate
-  fill_xyzt(orientation_rate, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ORIENTATION_RATE].T)
+    # plan
+    plan = self.markers('plan', (Plan.ORIENTATION_RATE.stop, ModelConstants.IDX_N))
+    plan_stds = self.markers('plan_stds', (3, ModelConstants.IDX_N))
+    for i, builder in enumerate([modelV2.position, modelV2.velocity, modelV2.acceleration, modelV2.orientation, modelV2.orientationRate]):
+      fill_xyzt(builder, ModelConstants.T_IDXS, *plan[3*i:3*i+3], *(plan_stds if i == 0 else ()))
 
-  # lateral planning
-  action = modelV2.action
-  action.desiredCurvature = float(net_output_data['desired_curvature'][0,0])
-
-  # times at X_IDXS according to model plan
-  PLAN_T_IDXS = [np.nan] * ModelConstants.IDX_N
-  PLAN_T_IDXS[0] = 0.0
-  plan_x = net_output_data['plan'][0,:,Plan.POSITION][:,0].tolist()
-  for xidx in range(1, ModelConstants.IDX_N):
-    tidx = 0
-    # increment tidx until we find an element that's further away than the current xidx
-    while tidx < ModelConstants.IDX_N - 1 and plan_x[tidx+1] < ModelConstants.X_IDXS[xidx]:
-      tidx += 1
-    if tidx == ModelConstants.IDX_N - 1:
-      # if the Plan doesn't extend far enough, set plan_t to the max value (10s), then break
-      PLAN_T_IDXS[xidx] = ModelConstants.T_IDXS[ModelConstants.IDX_N - 1]
-      break
-    # interpolate to find `t` for the current xidx
-    current_x_val = plan_x[tidx]
-    next_x_val = plan_x[tidx+1]
-    p = (ModelConstants.X_IDXS[xidx] - current_x_val) / (next_x_val - current_x_val) if abs(next_x_val - current_x_val) > 1e-9 else float('nan')
-    PLAN_T_IDXS[xidx] = p * ModelConstants.T_IDXS[tidx+1] + (1 - p) * ModelConstants.T_IDXS[tidx]
+    modelV2.action.desiredCurvature = self.markers('desired_curvature', ()).item()
 
-  # lane lines
-  modelV2.init('laneLines', 6)
-  for i in range(6):
-    lane_line = modelV2.laneLines[i]
-    if i < 4:
-      fill_xyzt(lane_line, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['lane_lines'][0,i,:,0], net_output_data['lane_lines'][0,i,:,1])
-    else:
-      far_lane, near_lane, road_edge = (0, 1, 0) if i == 4 else (3, 2, 1)
+    # lane lines and road edges share the times of X_IDXS along the plan
+    lane_line_t = self.markers('lane_line_t', (6 + ModelConstants.NUM_ROAD_EDGES, ModelConstants.IDX_N))
+    lane_lines = np.concatenate([self.markers('lane_lines', (ModelConstants.NUM_LANE_LINES, 2, ModelConstants.IDX_N)),
+                                 self.markers('outer_lane_lines', (2, 2, ModelConstants.IDX_N)),
+                                 self.markers('road_edges', (ModelConstants.NUM_ROAD_EDGES, 2, ModelConstants.IDX_N))])
+    builders = list(modelV2.init('laneLines', 6)) + list(modelV2.init('roadEdges', ModelConstants.NUM_ROAD_EDGES))
+    for builder, t, (y, z) in zip(builders, lane_line_t, lane_lines, strict=True):
+      fill_xyzt(builder, t.tolist(), X_IDXS, y, z)
+    modelV2.laneLineStds = self.markers('lane_line_stds', (ModelConstants.NUM_LANE_LINES,)).tolist()
+    modelV2.laneLineProbs = self.markers('lane_line_probs', (ModelConstants.NUM_LANE_LINES,)).tolist()
+    modelV2.roadEdgeStds = self.markers('road_edge_stds', (ModelConstants.NUM_ROAD_EDGES,)).tolist()
+
+    # leads, x, y, v, a and their stds
+    leads = self.markers('leads', (ModelConstants.LEAD_MHP_SELECTION, 2 * ModelConstants.LEAD_WIDTH, ModelConstants.LEAD_TRAJ_LEN))
+    lead_probs = self.markers('lead_probs', (ModelConstants.LEAD_MHP_SELECTION,))
+    for i, lead in enumerate(modelV2.init('leadsV3', ModelConstants.LEAD_MHP_SELECTION)):
+      fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *leads[i])
+      lead.prob = lead_probs[i].item()
+      lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
+
+    # meta
+    meta = modelV2.meta
+    meta.desireState = self.markers('desire_state', (ModelConstants.DESIRE_PRED_WIDTH,)).tolist()
+    meta.desirePrediction = self.markers('desire_prediction', (ModelConstants.DESIRE_PRED_LEN * ModelConstants.DESIRE_PRED_WIDTH,)).tolist()
+    meta.engagedProb = self.markers('engaged_prob', ()).item()
+    disengage_predictions = meta.init('disengagePredictions')
+    disengage_predictions.t = ModelConstants.META_T_IDXS
+    probs = self.markers('disengage_predictions', (len(DISENGAGE_PREDICTIONS), len(ModelConstants.META_T_IDXS)))
+    for field, p in zip(DISENGAGE_PREDICTIONS, probs, strict=True):
+      setattr(disengage_predictions, field, p.tolist())
+
+    # temporal pose, trans, transStd, rot and rotStd
+    temporal_pose = modelV2.temporalPose
+    temporal_pose.trans, temporal_pose.transStd, temporal_pose.rot, temporal_pose.rotStd = self.markers('temporal_pose', (4, 3)).tolist()
+
+    # lists of floats are 4 byte aligned, so every marker is a word of the serialized message
+    self.dat = np.frombuffer(bytearray(msg.to_bytes()), dtype=np.uint8)
+    self.floats = self.dat.view(np.float32)
+    words = self.dat.view(np.uint32)
+    positions = np.nonzero((words >= self.marker(0)) & (words < self.marker(self.n_markers)))[0]
+    positions = positions[np.argsort(words[positions])]
+    assert np.array_equal(words[positions], np.arange(self.marker(0), self.marker(self.n_markers))), "modelV2 template markers not found"
+    self.idxs = {name: positions[start:start + int(np.prod(shape))].reshape(shape) for name, (start, shape) in self.groups.items()}
+
+  @staticmethod
+  def marker(i: int) -> int:
+    # large float32s, unlike the pointers and zeros around them
+    return 0x7f000000 + i
+
+  def markers(self, name: str, shape: tuple[int, ...]) -> np.ndarray:
+    size = int(np.prod(shape))
+    self.groups[name] = (self.n_markers, shape)
+    markers = np.arange(self.marker(self.n_markers), self.marker(self.n_markers + size), dtype=np.uint32).view(np.float32)
+    self.n_markers += size
+    return markers.astype(np.float64).reshape(shape)
+
+  def __setitem__(self, name: str, value) -> None:
+    self.floats[self.idxs[name]] = value
+
+  def new_message(self) -> capnp._DynamicStructBuilder:
+    with log.Event.from_bytes(self.dat) as msg:
+      msg = msg.as_builder()
+    msg.logMonoTime = int(time.monotonic() * 1e9)
+    return msg
+
+class PublishState:
+  def __init__(self):
+    self.disengage_buffer = np.zeros(ModelConstants.CONFIDENCE_BUFFER_LEN*ModelConstants.DISENGAGE_WIDTH, dtype=np.float32)
+    self.prev_brake_5ms2_probs = np.zeros(ModelConstants.FCW_5MS2_PROBS_WIDTH, dtype=np.float32)
+    self.prev_brake_3ms2_probs = np.zeros(ModelConstants.FCW_3MS2_PROBS_WIDTH, dtype=np.float32)
+    self.template = ModelV2Template()
 
-      near_lane_y = net_output_data['lane_lines'][0,near_lane,:,0]
-      road_edge_y = net_output_data['road_edges'][0,road_edge,:,0]
-      far_lane_y = net_output_data['lane_lines'][0,far_lane,:,0]
+def get_plan_t_idxs(plan_x: np.ndarray) -> np.ndarray:
+  """Times at X_IDXS according to the model plan. If the plan doesn't extend far enough, the first X_IDXS past it gets
+  the max time (10s) and the rest are nan."""
+  plan_x = plan_x.astype(np.float64)
+  # the first plan point that is further away than each X_IDXS, the running max is sorted even if the plan isn't
+  tidx = np.searchsorted(np.maximum.accumulate(plan_x[1:]), X_IDXS[1:])
+  in_plan = tidx < ModelConstants.IDX_N - 1
+  tidx = np.minimum(tidx, ModelConstants.IDX_N - 2)
 
-      road_edge_distance = abs(np.linalg.norm(road_edge_y - near_lane_y))
-      far_lane_distance = abs(np.linalg.norm(far_lane_y - near_lane_y))
+  # interpolate to find `t` for each X_IDXS
+  dx = plan_x[tidx+1] - plan_x[tidx]
+  p = (X_IDXS[1:] - plan_x[tidx]) / np.where(np.abs(dx) > 1e-9, dx, np.nan)
+  plan_t_idxs = np.zeros(ModelConstants.IDX_N)
+  plan_t_idxs[1:] = np.where(in_plan, p * T_IDXS[tidx+1] + (1 - p) * T_IDXS[tidx], np.nan)
+  if not in_plan.all():
+    plan_t_idxs[1 + np.argmin(in_plan)] = T_IDXS[-1]
+  return plan_t_idxs
 
-      if road_edge_distance < far_lane_distance:
-        closest_lane_y = road_edge_y
-      else:
-        closest_lane_y = far_lane_y
+def fill_model_msg(net_output_data: dict[str, np.ndarray], publish_state: PublishState,
+                   vipc_frame_id: int, vipc_frame_id_extra: int, frame_id: int, frame_drop: float,
+                   timestamp_eof: int, timestamp_llk: int, model_execution_time: float,
+                   nav_enabled: bool, valid: bool, secret_good_openpilot: bool) -> capnp._DynamicStructBuilder:
+  template = publish_state.template
 
-      diff_y = closest_lane_y - near_lane_y
-      new_lane_y = near_lane_y + diff_y / 2
+  # plan
+  template['plan'] = net_output_data['plan'][0,:,:Plan.ORIENTATION_RATE.stop].T
+  template['plan_stds'] = net_output_data['plan_stds'][0,:,Plan.POSITION].T
 
-      fill_xyzt(lane_line, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), new_lane_y, net_output_data['lane_lines'][0,near_lane,:,1])
+  # lateral planning
+  template['desired_curvature'] = net_output_data['desired_curvature'][0,0]
 
-  modelV2.laneLineStds = net_output_data['lane_lines_stds'][0,:,0,0].tolist()
-  modelV2.laneLineProbs = net_output_data['lane_lines_prob'][0,1::2].tolist()
+  # lane lines
+  lane_lines = net_output_data['lane_lines'][0]
+  road_edges = net_output_data['road_edges'][0]
+  template['lane_line_t'] = get_plan_t_idxs(net_output_data['plan'][0,:,Plan.POSITION][:,0])
+  template['lane_lines'] = lane_lines.transpose(0, 2, 1)
+
+  # the outer lane lines are halfway between the inner lane lines and the closest of the outer lane lines and road edges
+  near_lane = lane_lines[[1, 2]]
+  near_lane_y = near_lane[:,:,0]
+  road_edge_y = road_edges[:,:,0]
+  far_lane_y = lane_lines[[0, 3],:,0]
+  road_edge_closer = np.linalg.norm(road_edge_y - near_lane_y, axis=1) < np.linalg.norm(far_lane_y - near_lane_y, axis=1)
+  closest_lane_y = np.where(road_edge_closer[:,None], road_edge_y, far_lane_y)
+  template['outer_lane_lines'] = np.stack([near_lane_y + (closest_lane_y - near_lane_y) / 2, near_lane[:,:,1]], axis=1)
+
+  template['lane_line_stds'] = net_output_data['lane_lines_stds'][0,:,0,0]
+  template['lane_line_probs'] = net_output_data['lane_lines_prob'][0,1::2]
 
   # road edges
-  modelV2.init('roadEdges', 2)
-  for i in range(2):
-    road_edge = modelV2.roadEdges[i]
-    fill_xyzt(road_edge, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['road_edges'][0,i,:,0], net_output_data['road_edges'][0,i,:,1])
-  modelV2.roadEdgeStds = net_output_data['road_edges_stds'][0,:,0,0].tolist()
+  template['road_edges'] = road_edges.transpose(0, 2, 1)
+  template['road_edge_stds'] = net_output_data['road_edges_stds'][0,:,0,0]
 
   # leads
-  modelV2.init('leadsV3', 3)
-  for i in range(3):
-    lead = modelV2.leadsV3[i]
-    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *net_output_data['lead'][0,i].T, *net_output_data['lead_stds'][0,i].T)
-    lead.prob = net_output_data['lead_prob'][0,i].tolist()
-    lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
+  template['leads'] = np.concatenate([net_output_data['lead'][0], net_output_data['lead_stds'][0]], axis=2).transpose(0, 2, 1)
+  template['lead_probs'] = net_output_data['lead_prob'][0]
 
   # meta
-  meta = modelV2.meta
-  meta.desireState = net_output_data['desire_state'][0].reshape(-1).tolist()
-  meta.desirePrediction = net_output_data['desire_pred'][0].reshape(-1).tolist()
-  meta.engagedProb = net_output_data['meta'][0,Meta.ENGAGED].item()
-  meta.init('disengagePredictions')
-  disengage_predictions = meta.disengagePredictions
-  disengage_predictions.t = ModelConstants.META_T_IDXS
-  disengage_predictions.brakeDisengageProbs = net_output_data['meta'][0,Meta.BRAKE_DISENGAGE].tolist()
-  disengage_predictions.gasDisengageProbs = net_output_data['meta'][0,Meta.GAS_DISENGAGE].tolist()
-  disengage_predictions.steerOverrideProbs = net_output_data['meta'][0,Meta.STEER_OVERRIDE].tolist()
-  disengage_predictions.brake3MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_3].tolist()
-  disengage_predictions.brake4MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_4].tolist()
-  disengage_predictions.brake5MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_5].tolist()
+  template['desire_state'] = net_output_data['desire_state'][0].reshape(-1)
+  template['desire_prediction'] = net_output_data['desire_pred'][0].reshape(-1)
+  template['engaged_prob'] = net_output_data['meta'][0,Meta.ENGAGED][0]
+  template['disengage_predictions'] = np.stack([net_output_data['meta'][0,s] for s in DISENGAGE_PREDICTIONS.values()])
+
+  # temporal pose
+  if secret_good_openpilot:
+    template['temporal_pose'] = 0.
+  else:
+    template['temporal_pose'] = np.stack([net_output_data['sim_pose'][0,:3], net_output_data['sim_pose_stds'][0,:3],
+                                          net_output_data['sim_pose'][0,3:], net_output_data['sim_pose_stds'][0,3:]])
+
+  frame_age = frame_id - vipc_frame_id if frame_id > vipc_frame_id else 0
+  msg = template.new_message()
+  msg.valid = valid
+
+  modelV2 = msg.modelV2
+  modelV2.frameId = vipc_frame_id
+  modelV2.frameIdExtra = vipc_frame_id_extra
+  modelV2.frameAge = frame_age
+  modelV2.frameDropPerc = frame_drop * 100
+  modelV2.timestampEof = timestamp_eof
+  modelV2.locationMonoTime = timestamp_llk
+  modelV2.modelExecutionTime = model_execution_time
+  modelV2.navEnabled = nav_enabled
 
   publish_state.prev_brake_5ms2_probs[:-1] = publish_state.prev_brake_5ms2_probs[1:]
   publish_state.prev_brake_5ms2_probs[-1] = net_output_data['meta'][0,Meta.HARD_BRAKE_5][0]
@@ -158,20 +231,7 @@ def fill_model_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str,
   publish_state.prev_brake_3ms2_probs[-1] = net_output_data['meta'][0,Meta.HARD_BRAKE_3][0]
   hard_brake_predicted = (publish_state.prev_brake_5ms2_probs > ModelConstants.FCW_THRESHOLDS_5MS2).all() and \
     (publish_state.prev_brake_3ms2_probs > ModelConstants.FCW_THRESHOLDS_3MS2).all()
-  meta.hardBrakePredicted = hard_brake_predicted.item()
-
-  # temporal pose
-  temporal_pose = modelV2.temporalPose
-  if secret_good_openpilot:
-    temporal_pose.trans = np.zeros((3,), dtype=np.float32).reshape(-1).tolist()
-    temporal_pose.transStd = np.zeros((3,), dtype=np.float32).reshape(-1).tolist()
-    temporal_pose.rot = np.zeros((3,), dtype=np.float32).reshape(-1).tolist()
-    temporal_pose.rotStd = np.zeros((3,), dtype=np.float32).reshape(-1).tolist()
-  else:
-    temporal_pose.trans = net_output_data['sim_pose'][0,:3].tolist()
-    temporal_pose.transStd = net_output_data['sim_pose_stds'][0,:3].tolist()
-    temporal_pose.rot = net_output_data['sim_pose'][0,3:].tolist()
-    temporal_pose.rotStd = net_output_data['sim_pose_stds'][0,3:].tolist()
+  modelV2.meta.hardBrakePredicted = hard_brake_predicted.item()
 
   # confidence
   if vipc_frame_id % (2*ModelConstants.MODEL_FREQ) == 0:
@@ -200,6 +260,8 @@ def fill_model_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str,
   if SEND_RAW_PRED:
     modelV2.rawPredictions = net_output_data['raw_pred'].tobytes()
 
+  return msg
+
 def fill_pose_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str, np.ndarray],
                   vipc_frame_id: int, vipc_dropped_frames: int, timestamp_eof: int, live_calib_seen: bool) -> None:
   msg.valid = live_calib_seen & (vipc_dropped_frames < 1)
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class HistoryBuffer:
+  """
+  The last `length` rows pushed, oldest first. Every row is stored twice, `length` rows apart, so the
+  history is always a contiguous view and a push writes one row twice instead of shifting all of them.
+  """
+  def __init__(self, length: int, width: int, dtype=np.float32):
+    self.length = length
+    self.buf = np.zeros((2 * length, width), dtype=dtype)
+    self.idx = 0  # the oldest row, overwritten by the next push
+
+  def push(self, row: np.ndarray) -> None:
+    self.buf[self.idx] = row
+    self.buf[self.idx + self.length] = row
+    self.idx = (self.idx + 1) % self.length
+
+  @property
+  def history(self) -> np.ndarray:
+    return self.buf[self.idx:self.idx + self.length]
+
+  @property
+  def flat(self) -> np.ndarray:
+    return self.history.reshape(-1)
+
+
+class FramePairBuffer:
+  """
+  The last `length` frames pushed, of which only the oldest and newest are read, as one contiguous array.
+  Frames are written to slots in decreasing order, which puts the oldest frame right before the newest one.
+  When the newest frame is in the first slot it is also written after the last, where the oldest frame is.
+  """
+  def __init__(self, length: int, size: int, dtype=np.float32):
+    self.length = length
+    self.size = size
+    self.buf = np.zeros((length + 1) * size, dtype=dtype)
+    self.idx = 0  # slot of the newest frame
+
+  def push(self, frame: np.ndarray) -> None:
+    self.idx = (self.idx - 1) % self.length
+    self.buf[self.idx * self.size:(self.idx + 1) * self.size] = frame
+    if self.idx == 0:
+      self.buf[self.length * self.size:] = frame
+
+  @property
+  def pair(self) -> np.ndarray:
+    start = self.length - 1 if self.idx == 0 else self.idx - 1
+    return self.buf[start * self.size:(start + 2) * self.size]
@@ -22,6 +22,7 @@ from openpilot.selfdrive.modeld.runners import ModelRunner, Runtime
 from openpilot.selfdrive.modeld.parse_model_outputs import Parser
 from openpilot.selfdrive.modeld.fill_model_msg import fill_model_msg, fill_pose_msg, PublishState
 from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.history import FramePairBuffer, HistoryBuffer
 from openpilot.selfdrive.modeld.models.commonmodel_pyx import ModelFrame, CLContext
 
 from openpilot.selfdrive.frogpilot.controls.lib.frogpilot_variables import FrogPilotVariables
@@ -70,24 +71,31 @@ class ModelState:
     self.frame = ModelFrame(context)
     self.wide_frame = ModelFrame(context)
     self.prev_desire = np.zeros(ModelConstants.DESIRE_LEN, dtype=np.float32)
-    self.full_features_20Hz = np.zeros((ModelConstants.FULL_HISTORY_BUFFER_LEN, ModelConstants.FEATURE_LEN), dtype=np.float32)
-    self.desire_20Hz =  np.zeros((ModelConstants.FULL_HISTORY_BUFFER_LEN + 1, ModelConstants.DESIRE_LEN), dtype=np.float32)
+    history_len = ModelConstants.HISTORY_BUFFER_LEN_SECRET if SECRET_GOOD_OPENPILOT else ModelConstants.HISTORY_BUFFER_LEN
+
+    # the history inputs are ring buffers, the model reads them through views that are set before every run
+    self.prev_desired_curv = HistoryBuffer(history_len + 1, ModelConstants.PREV_DESIRED_CURV_LEN)
+    if SECRET_GOOD_OPENPILOT:
+      # kept at 20Hz, the model gets every 4th frame of features and the max desire of every 4 frames
+      self.full_features_20Hz = HistoryBuffer(ModelConstants.FULL_HISTORY_BUFFER_LEN, ModelConstants.FEATURE_LEN)
+      self.desire_20Hz = HistoryBuffer(ModelConstants.FULL_HISTORY_BUFFER_LEN + 1, ModelConstants.DESIRE_LEN)
+      self.input_imgs_20hz = FramePairBuffer(5, MODEL_FRAME_SIZE)
+      self.big_input_imgs_20hz = FramePairBuffer(5, MODEL_FRAME_SIZE)
+    else:
+      self.features = HistoryBuffer(history_len, ModelConstants.FEATURE_LEN)
+      self.desire = HistoryBuffer(history_len + 1, ModelConstants.DESIRE_LEN)
+
     self.inputs = {
-      'desire': np.zeros(ModelConstants.DESIRE_LEN * (ModelConstants.HISTORY_BUFFER_LEN_SECRET+1 if SECRET_GOOD_OPENPILOT else ModelConstants.HISTORY_BUFFER_LEN+1), dtype=np.float32),
+      'desire': np.zeros(ModelConstants.DESIRE_LEN * (history_len+1), dtype=np.float32) if SECRET_GOOD_OPENPILOT else self.desire.flat,
       'traffic_convention': np.zeros(ModelConstants.TRAFFIC_CONVENTION_LEN, dtype=np.float32),
       'lateral_control_params': np.zeros(ModelConstants.LATERAL_CONTROL_PARAMS_LEN, dtype=np.float32),
-      'prev_desired_curv': np.zeros(ModelConstants.PREV_DESIRED_CURV_LEN * (ModelConstants.HISTORY_BUFFER_LEN_SECRET+1 if SECRET_GOOD_OPENPILOT else ModelConstants.HISTORY_BUFFER_LEN+1), dtype=np.float32),
+      'prev_desired_curv': self.prev_desired_curv.flat,
       **({'nav_features': np.zeros(ModelConstants.NAV_FEATURE_LEN, dtype=np.float32),
           'nav_instructions': np.zeros(ModelConstants.NAV_INSTRUCTION_LEN, dtype=np.float32)} if not DISABLE_NAV else {}),
-      'features_buffer': np.zeros((ModelConstants.HISTORY_BUFFER_LEN_SECRET if SECRET_GOOD_OPENPILOT else ModelConstants.HISTORY_BUFFER_LEN) * ModelConstants.FEATURE_LEN, dtype=np.float32),
+      'features_buffer': np.zeros(history_len * ModelConstants.FEATURE_LEN, dtype=np.float32) if SECRET_GOOD_OPENPILOT else self.features.flat,
       **({'radar_tracks': np.zeros(ModelConstants.RADAR_TRACKS_LEN * ModelConstants.RADAR_TRACKS_WIDTH, dtype=np.float32)} if DISABLE_RADAR else {}),
     }
 
-    self.input_imgs_20hz = np.zeros(MODEL_FRAME_SIZE*5, dtype=np.float32)
-    self.big_input_imgs_20hz = np.zeros(MODEL_FRAME_SIZE*5, dtype=np.float32)
-    self.input_imgs = np.zeros(MODEL_FRAME_SIZE*2, dtype=np.float32)
-    self.big_input_imgs = np.zeros(MODEL_FRAME_SIZE*2, dtype=np.float32)
-
     with open(METADATA_PATH, 'rb') as f:
       model_metadata = pickle.load(f)
 
@@ -113,14 +121,13 @@ class ModelState:
     # Model decides when action is completed, so desire input is just a pulse triggered on rising edge
     inputs['desire'][0] = 0
 
+    new_desire = np.where(inputs['desire'] - self.prev_desire > .99, inputs['desire'], 0)
     if SECRET_GOOD_OPENPILOT:
-      new_desire = np.where(inputs['desire'] - self.prev_desire > .99, inputs['desire'], 0)
-      self.desire_20Hz[:-1] = self.desire_20Hz[1:]
-      self.desire_20Hz[-1] = new_desire
-      self.inputs['desire'][:] = self.desire_20Hz.reshape((25,4,-1)).max(axis=1).flatten()
+      self.desire_20Hz.push(new_desire)
+      self.desire_20Hz.history.reshape((25,4,-1)).max(axis=1, out=self.inputs['desire'].reshape((25,-1)))
     else:
-      self.inputs['desire'][:-ModelConstants.DESIRE_LEN] = self.inputs['desire'][ModelConstants.DESIRE_LEN:]
-      self.inputs['desire'][-ModelConstants.DESIRE_LEN:] = np.where(inputs['desire'] - self.prev_desire > .99, inputs['desire'], 0)
+      self.desire.push(new_desire)
+      self.set_history_input('desire', self.desire)
 
     self.prev_desire[:] = inputs['desire']
 
@@ -133,19 +140,12 @@ class ModelState:
       self.inputs['radar_tracks'][:] = inputs['radar_tracks']
 
     if SECRET_GOOD_OPENPILOT:
-      new_img = self.frame.prepareSecret(buf, transform.flatten(), self.model.getCLBuffer("input_imgs"))
-      self.input_imgs_20hz[:-MODEL_FRAME_SIZE] = self.input_imgs_20hz[MODEL_FRAME_SIZE:]
-      self.input_imgs_20hz[-MODEL_FRAME_SIZE:] = new_img
-      self.input_imgs[:MODEL_FRAME_SIZE] = self.input_imgs_20hz[:MODEL_FRAME_SIZE]
-      self.input_imgs[MODEL_FRAME_SIZE:] = self.input_imgs_20hz[-MODEL_FRAME_SIZE:]
-      self.model.setInputBuffer("input_imgs", self.input_imgs)
+      # the model gets the frames from now and 4 frames ago
+      self.input_imgs_20hz.push(self.frame.prepareSecret(buf, transform.flatten(), self.model.getCLBuffer("input_imgs")))
+      self.model.setInputBuffer("input_imgs", self.input_imgs_20hz.pair)
       if wbuf is not None:
-        new_big_img = self.wide_frame.prepareSecret(wbuf, transform_wide.flatten(), self.model.getCLBuffer("big_input_imgs"))
-        self.big_input_imgs_20hz[:-MODEL_FRAME_SIZE] = self.big_input_imgs_20hz[MODEL_FRAME_SIZE:]
-        self.big_input_imgs_20hz[-MODEL_FRAME_SIZE:] = new_big_img
-        self.big_input_imgs[:MODEL_FRAME_SIZE] = self.big_input_imgs_20hz[:MODEL_FRAME_SIZE]
-        self.big_input_imgs[MODEL_FRAME_SIZE:] = self.big_input_imgs_20hz[-MODEL_FRAME_SIZE:]
-        self.model.setInputBuffer("big_input_imgs", self.big_input_imgs)
+        self.big_input_imgs_20hz.push(self.wide_frame.prepareSecret(wbuf, transform_wide.flatten(), self.model.getCLBuffer("big_input_imgs")))
+        self.model.setInputBuffer("big_input_imgs", self.big_input_imgs_20hz.pair)
     else:
       # if getCLBuffer is not None, frame will be None
       self.model.setInputBuffer("input_imgs", self.frame.prepare(buf, transform.flatten(), self.model.getCLBuffer("input_imgs")))
@@ -159,18 +159,22 @@ class ModelState:
     outputs = self.parser.parse_outputs(self.slice_outputs(self.output), SECRET_GOOD_OPENPILOT)
 
     if SECRET_GOOD_OPENPILOT:
-      self.full_features_20Hz[:-1] = self.full_features_20Hz[1:]
-      self.full_features_20Hz[-1] = outputs['hidden_state'][0, :]
-      idxs = np.arange(-4,-100,-4)[::-1]
-      self.inputs['features_buffer'][:] = self.full_features_20Hz[idxs].flatten()
+      self.full_features_20Hz.push(outputs['hidden_state'][0, :])
+      # every 4th frame, ending 4 frames ago
+      features = self.full_features_20Hz.history[-4 * ModelConstants.HISTORY_BUFFER_LEN_SECRET::4]
+      self.inputs['features_buffer'].reshape(features.shape)[:] = features
     else:
-      self.inputs['features_buffer'][:-ModelConstants.FEATURE_LEN] = self.inputs['features_buffer'][ModelConstants.FEATURE_LEN:]
-      self.inputs['features_buffer'][-ModelConstants.FEATURE_LEN:] = outputs['hidden_state'][0, :]
+      self.features.push(outputs['hidden_state'][0, :])
+      self.set_history_input('features_buffer', self.features)
 
-    self.inputs['prev_desired_curv'][:-ModelConstants.PREV_DESIRED_CURV_LEN] = self.inputs['prev_desired_curv'][ModelConstants.PREV_DESIRED_CURV_LEN:]
-    self.inputs['prev_desired_curv'][-ModelConstants.PREV_DESIRED_CURV_LEN:] = outputs['desired_curvature'][0, :]
+    self.prev_desired_curv.push(outputs['desired_curvature'][0, :])
+    self.set_history_input('prev_desired_curv', self.prev_desired_curv)
     return outputs
 
+  def set_history_input(self, name: str, history: HistoryBuffer) -> None:
+    self.inputs[name] = history.flat
+    self.model.setInputBuffer(name, self.inputs[name])
+
 
 def main(demo=False):
   cloudlog.warning("modeld init")
@@ -244,9 +248,6 @@ def main(demo=False):
 
   DH = DesireHelper()
 
-  # FrogPilot variables
-  update_toggles = False
-
   while True:
     # Keep receiving frames until we are at least 1 frame ahead of previous extra frame
     while meta_main.timestamp_sof < meta_extra.timestamp_sof + 25000000:
@@ -358,10 +359,9 @@ def main(demo=False):
     model_execution_time = mt2 - mt1
 
     if model_output is not None:
-      modelv2_send = messaging.new_message('modelV2')
       posenet_send = messaging.new_message('cameraOdometry')
-      fill_model_msg(modelv2_send, model_output, publish_state, meta_main.frame_id, meta_extra.frame_id, frame_id, frame_drop_ratio,
-                      meta_main.timestamp_eof, timestamp_llk, model_execution_time, nav_enabled, live_calib_seen, SECRET_GOOD_OPENPILOT)
+      modelv2_send = fill_model_msg(model_output, publish_state, meta_main.frame_id, meta_extra.frame_id, frame_id, frame_drop_ratio,
+                                    meta_main.timestamp_eof, timestamp_llk, model_execution_time, nav_enabled, live_calib_seen, SECRET_GOOD_OPENPILOT)
 
       desire_state = modelv2_send.modelV2.meta.desireState
       l_lane_change_prob = desire_state[log.Desire.laneChangeLeft]
@@ -380,10 +380,7 @@ def main(demo=False):
 
     # Update FrogPilot parameters
     if FrogPilotVariables.toggles_updated:
-      update_toggles = True
-    elif update_toggles:
-      FrogPilotVariables.update_frogpilot_params()
-      update_toggles = False
+      FrogPilotVariables.load_frogpilot_params()
 
 if __name__ == "__main__":
   try:
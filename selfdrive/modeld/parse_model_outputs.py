@@ -13,9 +13,23 @@ def softmax(x, axis=-1):
   x /= np.sum(x, axis=axis, keepdims=True)
   return x
 
+def take_hypotheses(x, flat_idxs, out):
+  # out[f, i] = x[f, idxs[f, i]] for every frame f, with flat_idxs = idxs + f * n_hypotheses
+  np.take(x.reshape((x.shape[0] * x.shape[1], -1)), flat_idxs, axis=0, out=out.reshape((flat_idxs.shape[0], -1)))
+  return out
+
 class Parser:
   def __init__(self, ignore_missing=False):
     self.ignore_missing = ignore_missing
+    # parsed outputs are written to these and reused for the next frames with the same shapes,
+    # they are sized by the first outputs parsed, which follow the model metadata
+    self.buffers: dict[str, np.ndarray] = {}
+
+  def get_buffer(self, name, shape, dtype):
+    buf = self.buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+      buf = self.buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
 
   def check_missing(self, outs, name):
     if name not in outs and not self.ignore_missing:
@@ -42,42 +56,49 @@ class Parser:
     raw = outs[name]
     raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
 
-    pred_mu = raw[:,:,:(raw.shape[2] - out_N)//2]
+    n_frames = raw.shape[0]
     n_values = (raw.shape[2] - out_N)//2
     pred_mu = raw[:,:,:n_values]
-    pred_std = np.exp(raw[:,:,n_values: 2*n_values])
+    pred_log_std = raw[:,:,n_values: 2*n_values]
 
     if in_N > 1:
-      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
-      for i in range(out_N):
-        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+      weights = self.get_buffer(name + '_weights', (n_frames, in_N, out_N), raw.dtype)
+      weights[:] = raw[:,:,-out_N:]
+      softmax(weights, axis=1)
 
+      hypotheses = self.get_buffer(name + '_hypotheses', (n_frames, in_N, n_values), raw.dtype)
+      stds_hypotheses = self.get_buffer(name + '_stds_hypotheses', (n_frames, in_N, n_values), raw.dtype)
+      frame_offsets = np.arange(0, n_frames * in_N, in_N)[:,None]
       if out_N == 1:
-        for fidx in range(weights.shape[0]):
-          idxs = np.argsort(weights[fidx][:,0])[::-1]
-          weights[fidx] = weights[fidx][idxs]
-          pred_mu[fidx] = pred_mu[fidx][idxs]
-          pred_std[fidx] = pred_std[fidx][idxs]
-      full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
+        # the hypotheses sorted by weight, most likely first
+        order = (np.argsort(weights[:,:,0], axis=1)[:,::-1] + frame_offsets).reshape(-1)
+        take_hypotheses(weights, order, weights)
+        take_hypotheses(pred_mu, order, hypotheses)
+        take_hypotheses(pred_log_std, order, stds_hypotheses)
+      else:
+        hypotheses[:] = pred_mu
+        stds_hypotheses[:] = pred_log_std
+      np.exp(stds_hypotheses, out=stds_hypotheses)
+
+      full_shape = tuple([n_frames, in_N] + list(out_shape))
       outs[name + '_weights'] = weights
-      outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
-      outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
-
-      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      for fidx in range(weights.shape[0]):
-        for hidx in range(out_N):
-          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
-          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
-          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+      outs[name + '_hypotheses'] = hypotheses.reshape(full_shape)
+      outs[name + '_stds_hypotheses'] = stds_hypotheses.reshape(full_shape)
+
+      # the most likely hypothesis for each selection, the last one on exact ties. The unstable argsort used before
+      # never defined which tied hypothesis won, so on ties this can pick a different one than it did
+      best = (in_N - 1 - np.argmax(weights[:,::-1], axis=1) + frame_offsets).reshape(-1)
+      pred_mu_final = take_hypotheses(hypotheses, best, self.get_buffer(name, (n_frames, out_N, n_values), raw.dtype))
+      pred_std_final = take_hypotheses(stds_hypotheses, best, self.get_buffer(name + '_stds', (n_frames, out_N, n_values), raw.dtype))
     else:
-      pred_mu_final = pred_mu
-      pred_std_final = pred_std
+      pred_mu_final = self.get_buffer(name, pred_mu.shape, raw.dtype)
+      pred_mu_final[:] = pred_mu
+      pred_std_final = np.exp(pred_log_std, out=self.get_buffer(name + '_stds', pred_log_std.shape, raw.dtype))
 
     if out_N > 1:
-      final_shape = tuple([raw.shape[0], out_N] + list(out_shape))
+      final_shape = tuple([n_frames, out_N] + list(out_shape))
     else:
-      final_shape = tuple([raw.shape[0],] + list(out_shape))
+      final_shape = tuple([n_frames,] + list(out_shape))
     outs[name] = pred_mu_final.reshape(final_shape)
     outs[name + '_stds'] = pred_std_final.reshape(final_shape)
 
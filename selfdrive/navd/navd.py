@@ -72,7 +72,6 @@ class RouteEngine:
 
     self.approaching_intersection = False
     self.approaching_turn = False
-    self.update_toggles = False
 
     self.nav_speed_limit = 0
 
@@ -96,10 +95,7 @@ class RouteEngine:
 
     # Update FrogPilot parameters
     if FrogPilotVariables.toggles_updated:
-      self.update_toggles = True
-    elif self.update_toggles:
-      FrogPilotVariables.update_frogpilot_params()
-      self.update_toggles = False
+      FrogPilotVariables.load_frogpilot_params()
 
   def update_location(self):
     location = self.sm['liveLocationKalman']
@@ -95,8 +95,6 @@ class Soundd:
       AudibleAlert.uwu: MAX_VOLUME,
     }
 
-    self.update_toggles = False
-
     self.update_frogpilot_sounds()
 
   def load_sounds(self):
@@ -211,11 +209,8 @@ class Soundd:
 
         # Update FrogPilot parameters
         if FrogPilotVariables.toggles_updated:
-          self.update_toggles = True
-        elif self.update_toggles:
-          FrogPilotVariables.update_frogpilot_params()
+          FrogPilotVariables.load_frogpilot_params()
           self.update_frogpilot_sounds()
-          self.update_toggles = False
 
   def update_frogpilot_sounds(self):
     self.volume_map = {
@@ -32,6 +32,7 @@ from cereal import log
 from cereal.services import SERVICE_LIST
 from openpilot.common.api import Api
 from openpilot.common.file_helpers import CallbackReader
+from openpilot.common.inotify import IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW, Inotify
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware import HARDWARE, PC
@@ -47,6 +48,9 @@ LOCAL_PORT_WHITELIST = {8022}
 
 LOG_ATTR_NAME = 'user.upload'
 LOG_ATTR_VALUE_MAX_UNIX_TIME = int.to_bytes(2147483647, 4, sys.byteorder)
+# small rotated logs are forwarded together, up to the size of one full log file
+LOG_BATCH_MAX_SIZE = 256 * 1024
+LOG_BATCH_MAX_FILES = 32
 RECONNECT_TIMEOUT_S = 70
 
 RETRY_DELAY = 10  # seconds
@@ -549,86 +553,173 @@ def takeSnapshot() -> str | dict[str, str] | None:
     raise Exception("not available while camerad is started")
 
 
-def get_logs_to_send_sorted() -> list[str]:
-  # TODO: scan once then use inotify to detect file creation/deletion
-  curr_time = int(time.time())
-  logs = []
-  for log_entry in os.listdir(Paths.swaglog_root()):
-    log_path = os.path.join(Paths.swaglog_root(), log_entry)
-    time_sent = 0
+class SwaglogIndex:
+  """
+  Send state of the files in the swaglog directory. The directory is only scanned on startup,
+  after that the files rotated in and out by the swaglog handler are tracked with inotify.
+  Without inotify the directory is scanned on every update.
+  """
+  def __init__(self, log_root: str):
+    self.log_root = log_root
+    self.time_sent: dict[str, int] = {}
+    self.inotify: Inotify | None = None
     try:
-      value = getxattr(log_path, LOG_ATTR_NAME)
+      self.inotify = Inotify()
+      # watch before scanning, so files created in between aren't missed
+      self.inotify.add_watch(log_root, IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM)
+    except OSError:
+      cloudlog.exception("athena.log_handler.inotify_unavailable")
+      self.close()
+
+    try:
+      self.scan()
+    except Exception:
+      self.close()
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def close(self) -> None:
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
+
+  def read_time_sent(self, log_entry: str) -> int:
+    try:
+      value = getxattr(os.path.join(self.log_root, log_entry), LOG_ATTR_NAME)
       if value is not None:
-        time_sent = int.from_bytes(value, sys.byteorder)
-    except (ValueError, TypeError):
+        return int.from_bytes(value, sys.byteorder)
+    except (OSError, ValueError, TypeError):
       pass
+    return 0
+
+  def scan(self) -> None:
+    self.time_sent = {log_entry: self.read_time_sent(log_entry) for log_entry in os.listdir(self.log_root)}
+
+  def update(self) -> None:
+    if self.inotify is None:
+      self.scan()
+      return
+
+    overflow = False
+    while len(events := self.inotify.read()):
+      for event in events:
+        if event.mask & IN_Q_OVERFLOW:
+          overflow = True
+        elif event.mask & (IN_CREATE | IN_MOVED_TO):
+          self.time_sent[event.name] = self.read_time_sent(event.name)
+        elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+          self.time_sent.pop(event.name, None)
+
+    if overflow:
+      self.scan()
+
+  def mark_sent(self, log_entry: str, value: bytes) -> None:
+    if log_entry not in self.time_sent:
+      return  # deleted by log rotation
+    self.time_sent[log_entry] = int.from_bytes(value, sys.byteorder)
+    try:
+      setxattr(os.path.join(self.log_root, log_entry), LOG_ATTR_NAME, value)
+    except OSError:
+      pass  # file could be deleted by log rotation
+
+  def get_logs_to_send_sorted(self) -> list[str]:
+    curr_time = int(time.time())
+    # excluding most recent (active) log file
+    logs = sorted(self.time_sent)[:-1]
     # assume send failed and we lost the response if sent more than one hour ago
-    if not time_sent or curr_time - time_sent > 3600:
-      logs.append(log_entry)
-  # excluding most recent (active) log file
-  return sorted(logs)[:-1]
+    return [log_entry for log_entry in logs if not self.time_sent[log_entry] or curr_time - self.time_sent[log_entry] > 3600]
 
 
 def log_handler(end_event: threading.Event) -> None:
   if PC:
     return
 
-  log_files = []
+  log_files: list[str] = []
   last_scan = 0.
-  while not end_event.is_set():
-    try:
-      curr_scan = time.monotonic()
-      if curr_scan - last_scan > 10:
-        log_files = get_logs_to_send_sorted()
-        last_scan = curr_scan
-
-      # send one log
-      curr_log = None
-      if len(log_files) > 0:
-        log_entry = log_files.pop() # newest log file
-        cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
-        try:
-          curr_time = int(time.time())
-          log_path = os.path.join(Paths.swaglog_root(), log_entry)
-          setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
-          with open(log_path) as f:
-            jsonrpc = {
-              "method": "forwardLogs",
-              "params": {
-                "logs": f.read()
-              },
-              "jsonrpc": "2.0",
-              "id": log_entry
-            }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-            curr_log = log_entry
-        except OSError:
-          pass  # file could be deleted by log rotation
-
-      # wait for response up to ~100 seconds
-      # always read queue at least once to process any old responses that arrive
-      for _ in range(100):
-        if end_event.is_set():
-          break
-        try:
-          log_resp = json.loads(log_recv_queue.get(timeout=1))
-          log_entry = log_resp.get("id")
-          log_success = "result" in log_resp and log_resp["result"].get("success")
-          cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
-          if log_entry and log_success:
-            log_path = os.path.join(Paths.swaglog_root(), log_entry)
-            try:
-              setxattr(log_path, LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
-            except OSError:
-              pass  # file could be deleted by log rotation
-          if curr_log == log_entry:
+  index: SwaglogIndex | None = None
+  try:
+    while not end_event.is_set():
+      try:
+        # built here, so a missing log dir is retried like any other error
+        if index is None:
+          index = SwaglogIndex(Paths.swaglog_root())
+
+        curr_scan = time.monotonic()
+        if curr_scan - last_scan > 10:
+          index.update()
+          log_files = index.get_logs_to_send_sorted()
+          last_scan = curr_scan
+
+        # send a batch of logs, starting with the newest log file
+        curr_log = None
+        batch: list[str] = []
+        logs: list[str] = []
+        size = 0
+        while len(log_files) > 0 and len(batch) < LOG_BATCH_MAX_FILES:
+          log_entry = log_files[-1]
+          try:
+            with open(os.path.join(Paths.swaglog_root(), log_entry)) as f:
+              dat = f.read()
+          except OSError:
+            log_files.pop()
+            continue  # file could be deleted by log rotation
+
+          if len(batch) > 0 and size + len(dat) > LOG_BATCH_MAX_SIZE:
             break
-        except queue.Empty:
-          if curr_log is None:
+          log_files.pop()
+          batch.insert(0, log_entry)
+          logs.insert(0, dat)
+          size += len(dat)
+
+        if len(batch) > 0:
+          # a single log keeps its name as id, a batch is identified by all of its log names
+          curr_log = ",".join(batch)
+          cloudlog.debug(f"athena.log_handler.forward_request {curr_log}")
+          curr_time = int.to_bytes(int(time.time()), 4, sys.byteorder)
+          for log_entry in batch:
+            index.mark_sent(log_entry, curr_time)
+
+          jsonrpc = {
+            "method": "forwardLogs",
+            "params": {
+              "logs": "".join(logs)
+            },
+            "jsonrpc": "2.0",
+            "id": curr_log
+          }
+          low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
+
+        # wait for response up to ~100 seconds
+        # always read queue at least once to process any old responses that arrive
+        for _ in range(100):
+          if end_event.is_set():
             break
-
-    except Exception:
-      cloudlog.exception("athena.log_handler.exception")
+          try:
+            log_resp = json.loads(log_recv_queue.get(timeout=1))
+            log_entry = log_resp.get("id")
+            log_success = "result" in log_resp and log_resp["result"].get("success")
+            cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
+            if log_entry and log_success:
+              for entry in log_entry.split(","):
+                index.mark_sent(entry, LOG_ATTR_VALUE_MAX_UNIX_TIME)
+            if curr_log == log_entry:
+              break
+          except queue.Empty:
+            if curr_log is None:
+              break
+
+      except Exception:
+        cloudlog.exception("athena.log_handler.exception")
+        if index is None:
+          end_event.wait(1)
+  finally:
+    if index is not None:
+      index.close()
 
 
 def stat_handler(end_event: threading.Event) -> None:
@@ -211,8 +211,6 @@ def hardware_thread(end_event, hw_queue) -> None:
 
   params_memory = Params("/dev/shm/params")
 
-  update_toggles = False
-
   while not end_event.is_set():
     sm.update(PANDA_STATES_TIMEOUT)
 
@@ -470,10 +468,7 @@ def hardware_thread(end_event, hw_queue) -> None:
 
     # Update FrogPilot parameters
     if FrogPilotVariables.toggles_updated:
-      update_toggles = True
-    elif update_toggles:
-      FrogPilotVariables.update_frogpilot_params(started_ts is not None)
-      update_toggles = False
+      FrogPilotVariables.load_frogpilot_params(started_ts is not None)
 
 def main():
   hw_queue = queue.Queue(maxsize=1)
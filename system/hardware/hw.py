@@ -50,6 +50,13 @@ class Paths:
     else:
       return "/data/stats/"
 
+  @staticmethod
+  def profile_root() -> str:
+    if PC:
+      return str(Path(Paths.comma_home()) / "profile")
+    else:
+      return "/data/profile/"
+
   @staticmethod
   def config_root() -> str:
     if PC:
@@ -8,6 +8,7 @@ SEGMENT_LENGTH = 60
 STATS_DIR_FILE_LIMIT = 10000
 STATS_SOCKET = "ipc:///tmp/stats"
 STATS_FLUSH_TIME_S = 60
+STATS_CLIENT_FLUSH_TIME_S = 5
 
 def get_available_percent(default=None):
   try:
@@ -1,20 +1,27 @@
 #!/usr/bin/env python3
+import base64
 import bz2
-import io
+import heapq
+import itertools
 import json
 import os
+import queue
 import random
 import requests
+import tempfile
 import threading
 import time
 import traceback
 import datetime
+import urllib.parse
 from typing import BinaryIO
-from collections.abc import Iterator
+from collections.abc import Callable, Hashable, Iterator
 
 from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.api import Api
+from openpilot.common.inotify import Inotify, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_ISDIR, IN_MOVE_SELF, IN_MOVED_FROM, IN_MOVED_TO, \
+                                     IN_Q_OVERFLOW
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware.hw import Paths
@@ -24,8 +31,15 @@ from openpilot.common.swaglog import cloudlog
 NetworkType = log.DeviceState.NetworkType
 UPLOAD_ATTR_NAME = 'user.upload'
 UPLOAD_ATTR_VALUE = b'1'
+# "<key> <blocks sent>" of an unfinished block upload, kept with the file so it's gone when the file is
+UPLOAD_BLOCKS_ATTR_NAME = 'user.upload_blocks'
 
 UPLOAD_QLOG_QCAM_MAX_SIZE = 5 * 1e6  # MB
+UPLOAD_BLOCK_SIZE = 4 * 1024 * 1024
+UPLOAD_BLOCK_RETRIES = 3
+# log dirs that couldn't be watched (e.g. max_user_watches reached) and candidates not allowed on the current
+# network are checked again after this long
+UPLOAD_QUEUE_RECHECK_TIME_S = 10
 
 allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
@@ -33,14 +47,70 @@ fake_upload = os.getenv("FAKEUPLOAD") is not None
 
 
 class FakeRequest:
-  def __init__(self):
-    self.headers = {"Content-Length": "0"}
+  def __init__(self, content_length: int = 0):
+    self.headers = {"Content-Length": str(content_length)}
 
 
 class FakeResponse:
-  def __init__(self):
-    self.status_code = 200
-    self.request = FakeRequest()
+  def __init__(self, status_code: int = 200, content_length: int = 0):
+    self.status_code = status_code
+    self.request = FakeRequest(content_length)
+
+
+def read_blocks(f: BinaryIO, compress: bool, block_size: int = UPLOAD_BLOCK_SIZE) -> Iterator[bytes]:
+  compressor = bz2.BZ2Compressor() if compress else None
+  buf = bytearray()
+  while True:
+    dat = f.read(block_size)
+    eof = not len(dat)
+    if compressor is not None:
+      dat = compressor.flush() if eof else compressor.compress(dat)
+    buf += dat
+
+    while len(buf) >= block_size or (eof and len(buf)):
+      yield bytes(buf[:block_size])
+      del buf[:block_size]
+
+    if eof:
+      break
+
+
+class BlockReader:
+  """Produces upload blocks on a worker thread, so compression overlaps with uploading"""
+  def __init__(self, f: BinaryIO, compress: bool, block_size: int = UPLOAD_BLOCK_SIZE, max_pending: int = 2):
+    self.blocks: queue.Queue = queue.Queue(maxsize=max_pending)
+    self.exit_event = threading.Event()
+    self.thread = threading.Thread(target=self.read_thread, args=(f, compress, block_size), daemon=True)
+    self.thread.start()
+
+  def put(self, item) -> None:
+    while not self.exit_event.is_set():
+      try:
+        self.blocks.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+
+  def read_thread(self, f: BinaryIO, compress: bool, block_size: int) -> None:
+    try:
+      for block in read_blocks(f, compress, block_size):
+        self.put(block)
+      self.put(None)
+    except Exception as e:
+      self.put(e)
+
+  def __iter__(self) -> Iterator[bytes]:
+    while True:
+      block = self.blocks.get()
+      if block is None:
+        return
+      if isinstance(block, Exception):
+        raise block
+      yield block
+
+  def close(self) -> None:
+    self.exit_event.set()
+    self.thread.join()
 
 
 def get_directory_sort(d: str) -> list[str]:
@@ -71,6 +141,177 @@ def clear_locks(root: str) -> None:
       cloudlog.exception("clear_locks failed")
 
 
+class UploadQueue:
+  """Upload candidates ordered like Uploader.next_file_to_upload, built with one scan of the log root
+  and kept up to date from inotify events instead of rescanning on every step. Log dirs that can't be
+  watched are rescanned every UPLOAD_QUEUE_RECHECK_TIME_S."""
+  WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+
+  def __init__(self, root: str, immediate_folders: list[str], immediate_priority: dict[str, int]):
+    self.root = root
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+
+    self.inotify: Inotify | None = None
+    self.built = False
+    self.heap: list[tuple] = []
+    self.entries: dict[str, tuple] = {}
+    self.locks: dict[str, set[str]] = {}
+    self.logdirs: dict[int, str] = {}
+    self.unwatched: set[str] = set()
+    self.last_unwatched_scan = 0.
+    # candidates allowed() rejected, kept off the heap until its key changes or they're due for a recheck
+    self.rejected: list[tuple] = []
+    self.rejected_key: Hashable = None
+    self.last_rejected_check = 0.
+
+  def _add(self, logdir: str, name: str) -> None:
+    if name.endswith(".lock"):
+      self.locks.setdefault(logdir, set()).add(name)
+      return
+
+    key = os.path.join(logdir, name)
+    immediate = any(f in os.path.join(self.root, key) for f in self.immediate_folders)
+    # only immediate folders and priority files are uploaded automatically
+    if key in self.entries or not (immediate or name in self.immediate_priority):
+      return
+
+    item = (0 if immediate else 1, get_directory_sort(logdir), self.immediate_priority.get(name, 1000), name, logdir)
+    self.entries[key] = item
+    heapq.heappush(self.heap, item)
+
+  def _remove(self, logdir: str, name: str) -> None:
+    if name.endswith(".lock"):
+      self.locks.get(logdir, set()).discard(name)
+    else:
+      # removed from the heap lazily
+      self.entries.pop(os.path.join(logdir, name), None)
+
+  def _scan_logdir(self, logdir: str) -> None:
+    path = os.path.join(self.root, logdir)
+    if self.inotify is not None:
+      try:
+        self.logdirs[self.inotify.add_watch(path, self.WATCH_MASK)] = logdir
+        self.unwatched.discard(logdir)
+      except OSError as e:
+        if logdir not in self.unwatched:
+          cloudlog.event("uploader_add_watch_failed", logdir=logdir, error=str(e))
+        self.unwatched.add(logdir)
+
+    try:
+      names = os.listdir(path)
+    except OSError:
+      self.unwatched.discard(logdir)
+      return
+
+    # without a watch, deleted lock files are only noticed by listing them again
+    self.locks.pop(logdir, None)
+    for name in names:
+      self._add(logdir, name)
+
+  def rebuild(self) -> None:
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
+    self.heap, self.entries, self.locks, self.logdirs = [], {}, {}, {}
+    self.unwatched, self.rejected = set(), []
+    self.built = False
+
+    try:
+      self.inotify = Inotify()
+      self.logdirs[self.inotify.add_watch(self.root, self.WATCH_MASK)] = ""
+    except (OSError, AttributeError):
+      # no inotify (or no log root yet), rescan on every update
+      if self.inotify is not None:
+        self.inotify.close()
+      self.inotify = None
+
+    for logdir in listdir_by_creation(self.root):
+      self._scan_logdir(logdir)
+    self.built = self.inotify is not None
+
+  def update(self) -> None:
+    if not self.built:
+      self.rebuild()
+      return
+
+    assert self.inotify is not None
+    for event in self.inotify.read(timeout=0):
+      if event.mask & IN_Q_OVERFLOW:
+        cloudlog.warning("uploader inotify queue overflow, rescanning")
+        self.rebuild()
+        return
+
+      logdir = self.logdirs.get(event.wd)
+      if logdir is None:
+        continue
+
+      if event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+        self.logdirs.pop(event.wd, None)
+        if logdir == "":
+          self.built = False
+      elif logdir == "":
+        if event.mask & IN_ISDIR and event.mask & (IN_CREATE | IN_MOVED_TO):
+          self._scan_logdir(event.name)
+        elif event.mask & IN_ISDIR and event.mask & (IN_DELETE | IN_MOVED_FROM):
+          self.locks.pop(event.name, None)
+          self.unwatched.discard(event.name)
+      elif event.mask & (IN_CREATE | IN_MOVED_TO):
+        self._add(logdir, event.name)
+      elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+        self._remove(logdir, event.name)
+
+    if len(self.unwatched) and time.monotonic() - self.last_unwatched_scan > UPLOAD_QUEUE_RECHECK_TIME_S:
+      self.last_unwatched_scan = time.monotonic()
+      for logdir in sorted(self.unwatched):
+        self._scan_logdir(logdir)
+
+  def next(self, allowed: Callable[[str, str, str], bool], allowed_key: Hashable = None) -> tuple[str, str, str] | None:
+    """allowed_key identifies what allowed() depends on, candidates it rejected are only
+    checked again once the key changes or after UPLOAD_QUEUE_RECHECK_TIME_S"""
+    self.update()
+
+    if allowed_key != self.rejected_key or time.monotonic() - self.last_rejected_check > UPLOAD_QUEUE_RECHECK_TIME_S:
+      for item in self.rejected:
+        heapq.heappush(self.heap, item)
+      self.rejected = []
+      self.rejected_key = allowed_key
+      self.last_rejected_check = time.monotonic()
+
+    # candidates stay queued until uploaded or deleted, skipped ones go back on the heap
+    skipped = []
+    ret = None
+    while len(self.heap):
+      item = heapq.heappop(self.heap)
+      _, _, _, name, logdir = item
+      key = os.path.join(logdir, name)
+      if self.entries.get(key) is not item:
+        continue
+
+      fn = os.path.join(self.root, key)
+      try:
+        is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
+      except OSError:
+        # deleter could have deleted, so skip
+        is_uploaded = True
+      if is_uploaded:
+        del self.entries[key]
+        continue
+
+      if len(self.locks.get(logdir, ())):
+        skipped.append(item)
+      elif not allowed(logdir, name, fn):
+        self.rejected.append(item)
+      else:
+        skipped.append(item)
+        ret = name, key, fn
+        break
+
+    for item in skipped:
+      heapq.heappush(self.heap, item)
+    return ret
+
+
 class Uploader:
   def __init__(self, dongle_id: str, root: str):
     self.dongle_id = dongle_id
@@ -84,58 +325,35 @@ class Uploader:
 
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.bz2": 0, "qcamera.ts": 1}
+    self.upload_queue = UploadQueue(self.root, self.immediate_folders, self.immediate_priority)
 
-  def list_upload_files(self, metered: bool) -> Iterator[tuple[str, str, str]]:
+  def get_requested_routes(self) -> list[str]:
     r = self.params.get("AthenadRecentlyViewedRoutes", encoding="utf8")
-    requested_routes = [] if r is None else r.split(",")
+    return [] if r is None else r.split(",")
 
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
+  def allowed_on_metered(self, logdir: str, name: str, ctime: float, requested_routes: list[str]) -> bool:
+    dt = datetime.timedelta(hours=12)
+    if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
+      return False
 
-      if any(name.endswith(".lock") for name in names):
-        continue
+    if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
+      return False
 
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
-        key = os.path.join(logdir, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
-          continue
-        if is_uploaded:
-          continue
-
-        # limit uploading on metered connections
-        if metered:
-          dt = datetime.timedelta(hours=12)
-          if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
-            continue
-
-          if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
-            continue
-
-        yield name, key, fn
+    return True
 
   def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
-    upload_files = list(self.list_upload_files(metered))
-
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return name, key, fn
+    if not metered:
+      return self.upload_queue.next(lambda logdir, name, fn: True)
 
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
+    requested_routes = self.get_requested_routes()
+    def allowed(logdir: str, name: str, fn: str) -> bool:
+      try:
+        ctime = os.path.getctime(fn)
+      except OSError:
+        return False
+      return self.allowed_on_metered(logdir, name, ctime, requested_routes)
 
-    return None
+    return self.upload_queue.next(allowed, (metered, tuple(requested_routes)))
 
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -150,15 +368,85 @@ class Uploader:
     if fake_upload:
       return FakeResponse()
 
+    compress = key.endswith('.bz2') and not fn.endswith('.bz2')
     with open(fn, "rb") as f:
-      data: BinaryIO
-      if key.endswith('.bz2') and not fn.endswith('.bz2'):
-        compressed = bz2.compress(f.read())
-        data = io.BytesIO(compressed)
-      else:
-        data = f
+      if headers.get("x-ms-blob-type") != "BlockBlob":
+        if not compress:
+          return requests.put(url, data=f, headers=headers, timeout=10)
+
+        # the compressed size isn't known up front, so it's spooled to disk and streamed from there with a Content-Length
+        with tempfile.TemporaryFile(dir=self.root) as tmp:
+          for block in read_blocks(f, compress):
+            tmp.write(block)
+          tmp.seek(0)
+          return requests.put(url, data=tmp, headers=headers, timeout=10)
+
+      reader = BlockReader(f, compress)
+      try:
+        blocks = iter(reader)
+        first_blocks = list(itertools.islice(blocks, 2))
+        if len(first_blocks) < 2:
+          return requests.put(url, data=b"".join(first_blocks), headers=headers, timeout=10)
+
+        return self.do_block_upload(key, fn, url, headers, itertools.chain(first_blocks, blocks))
+      finally:
+        reader.close()
 
-      return requests.put(url, data=data, headers=headers, timeout=10)
+  @staticmethod
+  def get_block_progress(key: str, fn: str) -> int:
+    try:
+      value = getxattr(fn, UPLOAD_BLOCKS_ATTR_NAME)
+      if value is None:
+        return 0
+      progress_key, _, blocks = value.decode().rpartition(" ")
+      return int(blocks) if progress_key == key else 0
+    except (OSError, ValueError):
+      return 0
+
+  @staticmethod
+  def set_block_progress(key: str, fn: str, blocks: int) -> None:
+    try:
+      setxattr(fn, UPLOAD_BLOCKS_ATTR_NAME, f"{key} {blocks}".encode())
+    except OSError:
+      pass  # deleter could have deleted, the upload starts over otherwise
+
+  def do_block_upload(self, key: str, fn: str, url: str, headers: dict[str, str], blocks: Iterator[bytes]):
+    # Put Block for each block, then commit them with Put Block List.
+    # Blocks already sent by an earlier attempt are skipped, uncommitted blocks are kept by the server for a week
+    headers = {k: v for k, v in headers.items() if k.lower() != "x-ms-blob-type"}
+    sep = "&" if urllib.parse.urlparse(url).query else "?"
+    done = self.get_block_progress(key, fn)
+
+    block_ids = []
+    content_length = 0
+    for i, block in enumerate(blocks):
+      block_id = base64.b64encode(f"{i:08d}".encode()).decode()
+      block_ids.append(block_id)
+      content_length += len(block)
+      if i < done:
+        continue
+
+      block_url = f"{url}{sep}comp=block&blockid={urllib.parse.quote(block_id)}"
+      for attempt in range(UPLOAD_BLOCK_RETRIES):
+        try:
+          resp = requests.put(block_url, data=block, headers=headers, timeout=10)
+          break
+        except requests.exceptions.RequestException:
+          if attempt == UPLOAD_BLOCK_RETRIES - 1:
+            raise
+          cloudlog.warning(f"upload block {i} of {key} failed, retrying")
+          time.sleep(0.5 * 2 ** attempt)
+      if resp.status_code != 201:
+        return resp
+      self.set_block_progress(key, fn, i + 1)
+
+    block_list = "".join(f"<Latest>{block_id}</Latest>" for block_id in block_ids)
+    data = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>'
+    resp = requests.put(f"{url}{sep}comp=blocklist", data=data, headers=headers, timeout=10)
+    if resp.status_code in (201, 400):
+      # 400 is an invalid block list, e.g. the uncommitted blocks expired, so the next attempt sends all of them
+      self.set_block_progress(key, fn, 0)
+    return FakeResponse(resp.status_code, content_length)
 
   def upload(self, name: str, key: str, fn: str, network_type: int, metered: bool) -> bool:
     try:
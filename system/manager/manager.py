@@ -13,8 +13,10 @@ from openpilot.common.params import Params, ParamKeyType
 from openpilot.common.text_window import TextWindow
 from openpilot.system.hardware import HARDWARE, PC
 from openpilot.system.manager.helpers import unblock_stdout, write_onroad_params, save_bootlog
-from openpilot.system.manager.process import ensure_running
+from openpilot.system.manager.process import PythonProcess, ensure_running, launcher
 from openpilot.system.manager.process_config import managed_processes
+from openpilot.system.manager.profiler import ManagerProfiler
+from openpilot.system.manager.zygote import ZYGOTE_PRELOAD, Zygote
 from openpilot.system.athena.registration import register, UNREGISTERED_DONGLE_ID
 from openpilot.common.swaglog import cloudlog, add_file_handler
 from openpilot.system.version import get_build_metadata, terms_version, training_version
@@ -358,14 +360,18 @@ def manager_init() -> None:
     params.put_bool("RecordFront", True)
 
   # set unset params
+  toggle_reset = params.get_bool("DoToggleReset")
+  current_values = params.get_many(k for k, _ in default_params)
+  stored_values = params_storage.get_many(k for k, _ in default_params)
+
+  new_values, backup_values = {}, {}
   for k, v in default_params:
-    if params.get(k) is None or params.get_bool("DoToggleReset"):
-      if params_storage.get(k) is None:
-        params.put(k, v)
-      else:
-        params.put(k, params_storage.get(k))
-    else:
-      params_storage.put(k, params.get(k))
+    if current_values[k] is None or toggle_reset:
+      new_values[k] = v if stored_values[k] is None else stored_values[k]
+    elif stored_values[k] != current_values[k]:
+      backup_values[k] = current_values[k]
+  params.put_many(new_values)
+  params_storage.put_many(backup_values)
 
   params.put_bool_nonblocking("DoToggleReset", False)
 
@@ -427,6 +433,9 @@ def manager_cleanup() -> None:
   for p in managed_processes.values():
     p.stop(block=True)
 
+  if PythonProcess.zygote is not None:
+    PythonProcess.zygote.stop()
+
   cloudlog.info("everything is dead")
 
 
@@ -446,12 +455,15 @@ def manager_thread() -> None:
   ignore += [x for x in os.getenv("BLOCK", "").split(",") if len(x) > 0]
 
   sm = messaging.SubMaster(['deviceState', 'carParams'], poll='deviceState')
-  pm = messaging.PubMaster(['managerState'])
+  pm = messaging.PubMaster(['managerState', 'managerProfile'])
+  profiler = ManagerProfiler()
 
   write_onroad_params(False, params)
   ensure_running(managed_processes.values(), False, params=params, CP=sm['carParams'], not_run=ignore)
 
   started_prev = False
+  exit_params = params.watch(("DoUninstall", "DoShutdown", "DoReboot"), timeout=0)
+  exit_values = next(exit_params)
 
   while True:
     sm.update(1000)
@@ -460,12 +472,14 @@ def manager_thread() -> None:
 
     if started and not started_prev:
       params.clear_all(ParamKeyType.CLEAR_ON_ONROAD_TRANSITION)
+      profiler.reset()
 
       error_log = os.path.join(sentry.CRASHES_DIR, 'error.txt')
       if os.path.isfile(error_log):
         os.remove(error_log)
 
     elif not started and started_prev:
+      profiler.write_summary()
       params.clear_all(ParamKeyType.CLEAR_ON_OFFROAD_TRANSITION)
       params_memory.clear_all(ParamKeyType.CLEAR_ON_OFFROAD_TRANSITION)
 
@@ -487,10 +501,15 @@ def manager_thread() -> None:
     msg.managerState.processes = [p.get_process_state_msg() for p in managed_processes.values()]
     pm.send('managerState', msg)
 
+    profile_msg = profiler.update(managed_processes.values())
+    if profile_msg is not None:
+      pm.send('managerProfile', profile_msg)
+
     # Exit main loop when uninstall/shutdown/reboot is needed
+    exit_values.update(next(exit_params))
     shutdown = False
-    for param in ("DoUninstall", "DoShutdown", "DoReboot"):
-      if params.get_bool(param):
+    for param, value in exit_values.items():
+      if value == b"1":
         shutdown = True
         params.put("LastManagerExitReason", f"{param} {datetime.datetime.now()}")
         cloudlog.warning(f"Shutting down manager - {param} set")
@@ -507,6 +526,11 @@ def main() -> None:
   # SystemExit on sigterm
   signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
 
+  # fork python processes from a copy of the preimported manager, before it has any sockets or threads
+  if os.getenv("NO_ZYGOTE") is None:
+    PythonProcess.zygote = Zygote(ZYGOTE_PRELOAD, launcher)
+    PythonProcess.zygote.start()
+
   try:
     manager_thread()
   except Exception:
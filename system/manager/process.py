@@ -16,15 +16,18 @@ import openpilot.system.sentry as sentry
 from openpilot.common.basedir import BASEDIR
 from openpilot.common.params import Params
 from openpilot.common.swaglog import cloudlog
+from openpilot.system.manager.profiler import ImportTimer, record_startup
+from openpilot.system.manager.zygote import Zygote, ZygoteChild
 
 WATCHDOG_FN = "/dev/shm/wd_"
 ENABLE_WATCHDOG = os.getenv("NO_WATCHDOG") is None
 
 
-def launcher(proc: str, name: str) -> None:
+def launcher(proc: str, name: str, start_time: float | None = None) -> None:
   try:
     # import the process
-    mod = importlib.import_module(proc)
+    with ImportTimer() as import_timer:
+      mod = importlib.import_module(proc)
 
     # rename the process
     setproctitle(proc)
@@ -36,6 +39,10 @@ def launcher(proc: str, name: str) -> None:
     cloudlog.bind(daemon=name)
     sentry.set_tag("daemon", name)
 
+    if start_time is not None:
+      profile = record_startup(start_time, import_timer)
+      cloudlog.event("process_startup", name=name, startup_ms=profile["startup_time"] * 1000, import_ms=profile["import_time"] * 1000)
+
     # exec the process
     mod.main()
   except KeyboardInterrupt:
@@ -67,7 +74,7 @@ class ManagerProcess(ABC):
   daemon = False
   sigkill = False
   should_run: Callable[[bool, Params, car.CarParams], bool]
-  proc: Process | None = None
+  proc: Process | ZygoteChild | None = None
   enabled = True
   name = ""
 
@@ -198,6 +205,9 @@ class NativeProcess(ManagerProcess):
 
 
 class PythonProcess(ManagerProcess):
+  # when set, processes are forked from the zygote instead of the manager
+  zygote: Zygote | None = None
+
   def __init__(self, name, module, should_run, enabled=True, sigkill=False, watchdog_max_dt=None):
     self.name = name
     self.module = module
@@ -221,8 +231,16 @@ class PythonProcess(ManagerProcess):
       return
 
     cloudlog.info(f"starting python {self.module}")
-    self.proc = Process(name=self.name, target=self.launcher, args=(self.module, self.name))
-    self.proc.start()
+    args = (self.module, self.name, time.monotonic())
+    if self.zygote is not None and self.zygote.is_alive():
+      try:
+        self.proc = self.zygote.spawn(self.name, args)
+      except RuntimeError:
+        cloudlog.exception(f"zygote failed to start {self.name}")
+
+    if self.proc is None:
+      self.proc = Process(name=self.name, target=self.launcher, args=args)
+      self.proc.start()
     self.watchdog_seen = False
     self.shutting_down = False
 
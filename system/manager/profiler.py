@@ -0,0 +1,257 @@
+import datetime
+import importlib.abc
+import json
+import os
+import sys
+import time
+from collections.abc import Iterable
+
+import capnp
+import psutil
+
+import cereal.messaging as messaging
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.common.swaglog import cloudlog
+from openpilot.system.hardware.hw import Paths
+
+PROFILE_FN = "/dev/shm/profile_"
+PROFILE_INTERVAL = 5.  # s
+PROFILE_SLOWEST_IMPORTS = 10
+
+
+class TimedLoader:
+  def __init__(self, loader, timer: 'ImportTimer', name: str):
+    self.loader = loader
+    self.timer = timer
+    self.name = name
+
+  def __getattr__(self, attr):
+    return getattr(self.loader, attr)
+
+  def create_module(self, spec):
+    t = time.monotonic()
+    module = self.loader.create_module(spec)
+    dt = time.monotonic() - t
+    self.timer.times[self.name] = dt
+    if len(self.timer.stack):
+      self.timer.stack[-1] += dt
+    return module
+
+  def exec_module(self, module):
+    # the module only ever sees its real loader
+    module.__loader__ = self.loader
+    module.__spec__.loader = self.loader
+
+    self.timer.stack.append(0.)
+    t = time.monotonic()
+    try:
+      self.loader.exec_module(module)
+    finally:
+      dt = time.monotonic() - t
+      children = self.timer.stack.pop()
+      self.timer.times[self.name] = self.timer.times.get(self.name, 0.) + dt - children
+      if len(self.timer.stack):
+        self.timer.stack[-1] += dt
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+  """Records how long each module imported while active takes, excluding the modules it imports"""
+  def __init__(self):
+    self.times: dict[str, float] = {}
+    self.stack: list[float] = []
+
+  def __enter__(self):
+    sys.meta_path.insert(0, self)
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    sys.meta_path.remove(self)
+
+  def find_spec(self, fullname, path, target=None):
+    for finder in sys.meta_path:
+      if finder is self or not hasattr(finder, "find_spec"):
+        continue
+
+      spec = finder.find_spec(fullname, path, target)
+      if spec is not None:
+        if hasattr(spec.loader, "exec_module"):
+          spec.loader = TimedLoader(spec.loader, self, fullname)
+        return spec
+    return None
+
+  @property
+  def total(self) -> float:
+    return sum(self.times.values())
+
+  def slowest(self, n: int) -> list[tuple[str, float]]:
+    return sorted(self.times.items(), key=lambda x: x[1], reverse=True)[:n]
+
+
+def write_profile(profile: dict) -> None:
+  with atomic_write_in_dir(PROFILE_FN + str(os.getpid()), overwrite=True) as f:
+    json.dump(profile, f)
+
+
+def record_startup(start_time: float, import_timer: ImportTimer) -> dict:
+  """Called by python processes right before main(), the manager reads this for the profile"""
+  profile = {
+    "startup_time": time.monotonic() - start_time,
+    "import_time": import_timer.total,
+    "slowest_imports": import_timer.slowest(PROFILE_SLOWEST_IMPORTS),
+  }
+  write_profile(profile)
+
+  # only processes publishing through a PubMaster report their first message
+  send = messaging.PubMaster.send
+
+  def first_send(self, s, dat):
+    messaging.PubMaster.send = send
+    profile["first_message_time"] = time.monotonic() - start_time
+    write_profile(profile)
+    return send(self, s, dat)
+
+  messaging.PubMaster.send = first_send
+  return profile
+
+
+class ProcessProfile:
+  def __init__(self, name: str, pid: int):
+    self.name = name
+    self.pid = pid
+    self.startup: dict = {}
+
+    self.process = psutil.Process(pid)
+    self.process.cpu_percent()  # the first call only sets the reference point
+
+    self.rss = 0
+    self.uss = 0
+    self.cpu_usage = 0.
+    self.reset()
+
+  def reset(self) -> None:
+    self.samples = self.uss_samples = 0
+    self.rss_sum = self.rss_max = 0
+    self.uss_sum = self.uss_max = 0
+    self.cpu_usage_sum = self.cpu_usage_max = 0.
+
+  def update(self, sample_uss: bool) -> None:
+    if "first_message_time" not in self.startup:
+      try:
+        with open(PROFILE_FN + str(self.pid)) as f:
+          self.startup = json.load(f)
+      except (FileNotFoundError, ValueError):
+        pass
+
+    with self.process.oneshot():
+      self.cpu_usage = self.process.cpu_percent()
+      self.rss = self.process.memory_info().rss
+
+    # USS needs /proc/<pid>/smaps, which takes tens of ms to parse for large processes
+    if sample_uss:
+      self.uss = self.process.memory_full_info().uss
+      self.uss_samples += 1
+      self.uss_sum += self.uss
+      self.uss_max = max(self.uss_max, self.uss)
+
+    self.samples += 1
+    self.rss_sum += self.rss
+    self.rss_max = max(self.rss_max, self.rss)
+    self.cpu_usage_sum += self.cpu_usage
+    self.cpu_usage_max = max(self.cpu_usage_max, self.cpu_usage)
+
+  def summary(self) -> dict:
+    samples = max(self.samples, 1)
+    return {
+      "pid": self.pid,
+      "startup_time": self.startup.get("startup_time"),
+      "first_message_time": self.startup.get("first_message_time"),
+      "import_time": self.startup.get("import_time"),
+      "slowest_imports": self.startup.get("slowest_imports", []),
+      "samples": self.samples,
+      "rss_mean": self.rss_sum // samples,
+      "rss_max": self.rss_max,
+      "uss_samples": self.uss_samples,
+      "uss_mean": self.uss_sum // max(self.uss_samples, 1),
+      "uss_max": self.uss_max,
+      "cpu_usage_mean": self.cpu_usage_sum / samples,
+      "cpu_usage_max": self.cpu_usage_max,
+    }
+
+
+class ManagerProfiler:
+  """
+  Samples memory and CPU usage of the managed processes every PROFILE_INTERVAL, along with the
+  startup times python processes report, for managerProfile and the summary written when going offroad.
+  This runs in the manager loop, so the expensive USS is only sampled for one process per interval.
+  """
+  def __init__(self):
+    self.profiles: dict[str, ProcessProfile] = {}
+    self.last_sample = 0.
+    self.uss_turn = 0
+
+  def reset(self) -> None:
+    # start over for the next drive, keeping the startup times of processes that are still running
+    for name in [name for name, profile in self.profiles.items() if not profile.process.is_running()]:
+      self.remove_profile_file(name)
+      del self.profiles[name]
+
+    for profile in self.profiles.values():
+      profile.reset()
+
+  def update(self, procs: Iterable) -> capnp._DynamicStructBuilder | None:
+    if time.monotonic() - self.last_sample < PROFILE_INTERVAL:
+      return None
+    self.last_sample = time.monotonic()
+
+    alive = [p for p in procs if p.proc is not None and p.proc.pid is not None and p.proc.exitcode is None]
+    uss_idx = self.uss_turn % max(len(alive), 1)
+    self.uss_turn += 1
+
+    running = []
+    for i, p in enumerate(alive):
+      pid = p.proc.pid
+      try:
+        if p.name not in self.profiles or self.profiles[p.name].pid != pid:
+          self.remove_profile_file(p.name)
+          self.profiles[p.name] = ProcessProfile(p.name, pid)
+        self.profiles[p.name].update(i == uss_idx)
+        running.append(self.profiles[p.name])
+      except psutil.Error:
+        pass
+
+    msg = messaging.new_message('managerProfile', valid=True)
+    processes = msg.managerProfile.init('processes', len(running))
+    for state, profile in zip(processes, running, strict=True):
+      state.name = profile.name
+      state.pid = profile.pid
+      state.startupTime = profile.startup.get("startup_time", 0.)
+      state.firstMessageTime = profile.startup.get("first_message_time", 0.)
+      state.importTime = profile.startup.get("import_time", 0.)
+      imports = state.init('slowestImports', len(profile.startup.get("slowest_imports", [])))
+      for imp, (module, t) in zip(imports, profile.startup.get("slowest_imports", []), strict=True):
+        imp.module = module
+        imp.time = t
+      state.rss = profile.rss
+      state.uss = profile.uss
+      state.cpuUsagePercent = profile.cpu_usage
+    return msg
+
+  def remove_profile_file(self, name: str) -> None:
+    if name in self.profiles:
+      try:
+        os.unlink(PROFILE_FN + str(self.profiles[name].pid))
+      except FileNotFoundError:
+        pass
+
+  def write_summary(self) -> None:
+    summary = {
+      "time": datetime.datetime.now().isoformat(),
+      "processes": {name: profile.summary() for name, profile in sorted(self.profiles.items())},
+    }
+
+    try:
+      os.makedirs(Paths.profile_root(), exist_ok=True)
+      with atomic_write_in_dir(os.path.join(Paths.profile_root(), "manager_profile.json"), overwrite=True) as f:
+        json.dump(summary, f, indent=2)
+    except OSError:
+      cloudlog.exception("failed to write manager profile summary")
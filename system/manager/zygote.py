@@ -0,0 +1,206 @@
+import gc
+import importlib
+import os
+import signal
+import sys
+import threading
+from collections import deque
+from collections.abc import Callable
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection, wait
+
+from setproctitle import setproctitle
+
+from openpilot.common.swaglog import cloudlog
+
+# heavy modules and capnp schemas most python processes import, more can be added with ZYGOTE_PRELOAD=mod1,mod2
+ZYGOTE_PRELOAD = [
+  "numpy",
+  "capnp",
+  "cereal",
+  "cereal.messaging",
+  "openpilot.common.params",
+  "openpilot.common.realtime",
+  "openpilot.common.swaglog",
+  "opendbc.can.parser",
+  "openpilot.selfdrive.car.interfaces",
+] + [x for x in os.getenv("ZYGOTE_PRELOAD", "").split(",") if len(x) > 0]
+
+SPAWN_TIMEOUT = 10.
+
+
+class ZygoteChild:
+  """The parts of multiprocessing.Process the manager uses, for a process forked by the zygote"""
+  def __init__(self, name: str):
+    self.name = name
+    self.pid: int | None = None
+    self.exitcode: int | None = None
+    self.started = threading.Event()
+    self.exited = threading.Event()
+
+  def is_alive(self) -> bool:
+    return self.pid is not None and self.exitcode is None
+
+  def join(self, timeout: float | None = None) -> None:
+    self.exited.wait(timeout)
+
+
+def zygote_child(conn: Connection, wakeup_fds: tuple[int, int], process: Process) -> None:
+  # undo the zygote's setup, the process should look like it was forked by the manager
+  signal.set_wakeup_fd(-1)
+  signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+  signal.signal(signal.SIGINT, signal.default_int_handler)
+  for fd in wakeup_fds:
+    os.close(fd)
+  conn.close()
+
+  # run it the way multiprocessing starts a forked Process: it becomes the current process without the
+  # zygote's children and finalizers, and its own children are joined and finalizers run when it exits
+  exitcode = 1
+  try:
+    exitcode = process._bootstrap()
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(exitcode)
+
+
+def zygote_main(conn: Connection, modules: list[str], target: Callable) -> None:
+  setproctitle("system.manager.zygote")
+  cloudlog.bind(daemon="zygote")
+
+  # the manager stops the zygote by closing the pipe
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  for module in modules:
+    try:
+      importlib.import_module(module)
+    except Exception:
+      cloudlog.exception(f"zygote failed to preimport {module}")
+
+  # keep the garbage collector from writing to the preloaded objects, so their pages stay shared
+  gc.collect()
+  gc.freeze()
+
+  wakeup_r, wakeup_w = os.pipe()
+  os.set_blocking(wakeup_r, False)
+  os.set_blocking(wakeup_w, False)
+  signal.set_wakeup_fd(wakeup_w)
+  signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+  while True:
+    ready = wait([conn, wakeup_r])
+
+    if wakeup_r in ready:
+      try:
+        os.read(wakeup_r, 4096)
+      except BlockingIOError:
+        pass
+
+    # reap before forking, so pids reported as exited are never reused by a new child first
+    while True:
+      try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+      except ChildProcessError:
+        break
+      if pid == 0:
+        break
+      conn.send(("exit", pid, os.waitstatus_to_exitcode(status)))
+
+    if conn in ready:
+      try:
+        name, args = conn.recv()
+      except EOFError:
+        break
+
+      # created before forking, so its parent is the zygote
+      process = Process(name=name, target=target, args=args)
+      pid = os.fork()
+      if pid == 0:
+        zygote_child(conn, (wakeup_r, wakeup_w), process)
+      conn.send(("started", pid, None))
+
+
+class Zygote:
+  """
+  Fork server for python processes. It is forked from the manager before it starts any processes,
+  imports the heavy modules once and forks processes from that image, so they start without
+  importing and share the preloaded pages copy-on-write.
+  """
+  def __init__(self, modules: list[str], target: Callable):
+    self.modules = modules
+    self.target = target
+    self.proc: Process | None = None
+    self.conn: Connection | None = None
+    self.lock = threading.Lock()
+    self.pending: deque[ZygoteChild] = deque()
+    self.children: dict[int, ZygoteChild] = {}
+
+  def start(self) -> None:
+    cloudlog.info(f"starting zygote preimporting {len(self.modules)} modules")
+    self.conn, child_conn = Pipe()
+    # not daemonic, daemonic processes can't start children with multiprocessing. manager_cleanup stops it
+    self.proc = Process(name="zygote", target=zygote_main, args=(child_conn, self.modules, self.target))
+    self.proc.start()
+    child_conn.close()
+    threading.Thread(target=self.reader_thread, args=(self.conn,), daemon=True).start()
+
+  def stop(self) -> None:
+    if self.proc is None:
+      return
+
+    self.conn.close()
+    self.proc.join(5)
+    if self.proc.exitcode is None:
+      self.proc.kill()
+      self.proc.join()
+    self.proc = None
+
+  def is_alive(self) -> bool:
+    return self.proc is not None and self.proc.is_alive()
+
+  def spawn(self, name: str, args: tuple) -> ZygoteChild:
+    child = ZygoteChild(name)
+    with self.lock:
+      try:
+        self.conn.send((name, args))
+      except OSError as e:
+        raise RuntimeError(f"zygote failed to start {name}") from e
+      # the zygote answers in request order
+      self.pending.append(child)
+
+    if not child.started.wait(SPAWN_TIMEOUT) or child.pid is None:
+      raise RuntimeError(f"zygote failed to start {name}")
+    return child
+
+  def reader_thread(self, conn: Connection) -> None:
+    while True:
+      try:
+        kind, pid, exitcode = conn.recv()
+      except (EOFError, OSError):
+        break
+
+      with self.lock:
+        if kind == "started":
+          child = self.pending.popleft()
+          child.pid = pid
+          self.children[pid] = child
+          child.started.set()
+        elif kind == "exit" and pid in self.children:
+          child = self.children.pop(pid)
+          child.exitcode = exitcode
+          child.exited.set()
+
+    # without the zygote nothing reports the children exiting, kill them so the manager starts them again
+    with self.lock:
+      for pid, child in self.children.items():
+        try:
+          os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+          pass
+        child.exitcode = -signal.SIGKILL
+        child.exited.set()
+      self.children.clear()
+
+      while len(self.pending):
+        self.pending.popleft().started.set()
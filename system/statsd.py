@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
+import atexit
+import math
 import os
+import struct
 import zmq
 import time
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime, UTC
 from typing import NoReturn
+from collections.abc import Iterator
 
 from openpilot.common.params import Params
 from cereal.messaging import SubMaster
@@ -14,18 +18,173 @@ from openpilot.common.swaglog import cloudlog
 from openpilot.system.hardware import HARDWARE
 from openpilot.common.file_helpers import atomic_write_in_dir
 from openpilot.system.version import get_build_metadata
-from openpilot.system.loggerd.config import STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S
+from openpilot.system.loggerd.config import STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S, \
+                                          STATS_CLIENT_FLUSH_TIME_S
 
 
 class METRIC_TYPE:
   GAUGE = 'g'
   SAMPLE = 'sa'
 
+
+# one message per client flush: the records below until the end of the message,
+# each record starts with RECORD_HEADER and the metric name
+RECORD_HEADER = struct.Struct("<BH")
+GAUGE_RECORD = struct.Struct("<d")
+SAMPLE_RECORD = struct.Struct("<IIdddIHH")  # count, non-finite count, sum, min, max, zero count, positive bins, negative bins
+RECORD_TYPES = {METRIC_TYPE.GAUGE: 0, METRIC_TYPE.SAMPLE: 1}
+
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MAX_BINS = 1024
+SKETCH_MIN_VALUE = 1e-9
+
+
+class QuantileSketch:
+  """
+  Mergeable quantile sketch over logarithmically sized bins, quantiles are within
+  SKETCH_RELATIVE_ACCURACY of the true value. The number of bins is capped, when
+  exceeded the bins closest to zero are merged, so only the low quantiles lose accuracy.
+  Non-finite values are only counted, they'd make every other statistic meaningless.
+  """
+  gamma = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+  log_gamma = math.log(gamma)
+
+  def __init__(self):
+    self.count = 0
+    self.nonfinite_count = 0
+    self.sum = 0.
+    self.min = math.inf
+    self.max = -math.inf
+    self.zero_count = 0
+    self.positive: dict[int, int] = defaultdict(int)
+    self.negative: dict[int, int] = defaultdict(int)
+
+  def add(self, value: float) -> None:
+    if not math.isfinite(value):
+      self.nonfinite_count += 1
+      return
+
+    self.count += 1
+    self.sum += value
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+
+    if value > SKETCH_MIN_VALUE:
+      bins = self.positive
+    elif value < -SKETCH_MIN_VALUE:
+      bins = self.negative
+    else:
+      self.zero_count += 1
+      return
+
+    bins[math.ceil(math.log(abs(value)) / self.log_gamma)] += 1
+    if len(bins) > SKETCH_MAX_BINS:
+      self._collapse(bins)
+
+  def merge(self, other: 'QuantileSketch') -> None:
+    self.count += other.count
+    self.nonfinite_count += other.nonfinite_count
+    self.sum += other.sum
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    self.zero_count += other.zero_count
+    for bins, other_bins in ((self.positive, other.positive), (self.negative, other.negative)):
+      for key, count in other_bins.items():
+        bins[key] += count
+      if len(bins) > SKETCH_MAX_BINS:
+        self._collapse(bins)
+
+  @staticmethod
+  def _collapse(bins: dict[int, int]) -> None:
+    keys = sorted(bins)
+    collapsed = keys[:len(keys) - SKETCH_MAX_BINS + 1]
+    bins[collapsed[-1]] += sum(bins.pop(key) for key in collapsed[:-1])
+
+  def _value(self, key: int) -> float:
+    return 2 * self.gamma ** key / (self.gamma + 1)
+
+  def quantile(self, q: float) -> float:
+    rank = int(round(q * (self.count - 1)))
+
+    # walk the bins from the lowest value up
+    value = 0.
+    for key in sorted(self.negative, reverse=True):
+      rank -= self.negative[key]
+      if rank < 0:
+        value = -self._value(key)
+        break
+    else:
+      rank -= self.zero_count
+      if rank >= 0:
+        for key in sorted(self.positive):
+          rank -= self.positive[key]
+          if rank < 0:
+            value = self._value(key)
+            break
+    return min(max(value, self.min), self.max)
+
+  def pack(self) -> bytes:
+    dat = SAMPLE_RECORD.pack(self.count, self.nonfinite_count, self.sum, self.min, self.max, self.zero_count, len(self.positive), len(self.negative))
+    for bins in (self.positive, self.negative):
+      dat += struct.pack(f"<{len(bins)}i{len(bins)}I", *bins.keys(), *bins.values())
+    return dat
+
+  @classmethod
+  def unpack_from(cls, dat: bytes, offset: int) -> tuple['QuantileSketch', int]:
+    sketch = cls()
+    sketch.count, sketch.nonfinite_count, sketch.sum, sketch.min, sketch.max, sketch.zero_count, n_positive, n_negative = SAMPLE_RECORD.unpack_from(dat, offset)
+    offset += SAMPLE_RECORD.size
+    for bins, n in ((sketch.positive, n_positive), (sketch.negative, n_negative)):
+      values = struct.unpack_from(f"<{n}i{n}I", dat, offset)
+      bins.update(zip(values[:n], values[n:], strict=True))
+      offset += 8 * n
+    return sketch, offset
+
+
+def pack_metrics(gauges: dict[str, float], samples: dict[str, QuantileSketch]) -> bytes:
+  dat = b""
+  for name, value in gauges.items():
+    encoded = name.encode()
+    dat += RECORD_HEADER.pack(RECORD_TYPES[METRIC_TYPE.GAUGE], len(encoded)) + encoded + GAUGE_RECORD.pack(value)
+  for name, sketch in samples.items():
+    encoded = name.encode()
+    dat += RECORD_HEADER.pack(RECORD_TYPES[METRIC_TYPE.SAMPLE], len(encoded)) + encoded + sketch.pack()
+  return dat
+
+
+def unpack_metrics(dat: bytes) -> Iterator[tuple[str, str, float | QuantileSketch]]:
+  offset = 0
+  while offset < len(dat):
+    record_type, name_len = RECORD_HEADER.unpack_from(dat, offset)
+    offset += RECORD_HEADER.size
+    name = dat[offset:offset + name_len].decode()
+    offset += name_len
+
+    if record_type == RECORD_TYPES[METRIC_TYPE.GAUGE]:
+      value, = GAUGE_RECORD.unpack_from(dat, offset)
+      offset += GAUGE_RECORD.size
+      yield METRIC_TYPE.GAUGE, name, value
+    elif record_type == RECORD_TYPES[METRIC_TYPE.SAMPLE]:
+      sketch, offset = QuantileSketch.unpack_from(dat, offset)
+      yield METRIC_TYPE.SAMPLE, name, sketch
+    else:
+      raise ValueError(f"unknown metric record type {record_type}")
+
+
 class StatLog:
+  """
+  Aggregates metrics in the calling process and sends them to statsd every STATS_CLIENT_FLUSH_TIME_S:
+  the last value of each gauge and a quantile sketch of each sample. Metrics are flushed when a call
+  finds the last flush overdue, and at exit.
+  """
   def __init__(self):
     self.pid = None
     self.zctx = None
     self.sock = None
+    self.gauges: dict[str, float] = {}
+    self.samples: dict[str, QuantileSketch] = {}
+    self.last_flush_time = 0.
+    atexit.register(self.close)
 
   def connect(self) -> None:
     self.zctx = zmq.Context()
@@ -33,6 +192,7 @@ class StatLog:
     self.sock.setsockopt(zmq.LINGER, 10)
     self.sock.connect(STATS_SOCKET)
     self.pid = os.getpid()
+    self.last_flush_time = time.monotonic()
 
   def __del__(self):
     if self.sock is not None:
@@ -40,23 +200,44 @@ class StatLog:
     if self.zctx is not None:
       self.zctx.term()
 
-  def _send(self, metric: str) -> None:
+  def close(self) -> None:
+    # metrics aggregated before a fork belong to the parent, which flushes them itself
+    if self.sock is not None and os.getpid() == self.pid:
+      self.flush()
+
+  def _update(self) -> None:
     if os.getpid() != self.pid:
+      # metrics aggregated before a fork belong to the parent
+      self.gauges.clear()
+      self.samples.clear()
       self.connect()
+    elif time.monotonic() > self.last_flush_time + STATS_CLIENT_FLUSH_TIME_S:
+      self.flush()
+
+  def flush(self) -> None:
+    self.last_flush_time = time.monotonic()
+    if not len(self.gauges) and not len(self.samples):
+      return
 
     try:
-      self.sock.send_string(metric, zmq.NOBLOCK)
+      self.sock.send(pack_metrics(self.gauges, self.samples), zmq.NOBLOCK)
     except zmq.error.Again:
       # drop :/
       pass
+    self.gauges.clear()
+    self.samples.clear()
 
   def gauge(self, name: str, value: float) -> None:
-    self._send(f"{name}:{value}|{METRIC_TYPE.GAUGE}")
+    self._update()
+    self.gauges[name] = value
 
-  # Samples will be recorded in a buffer and at aggregation time,
+  # Samples will be recorded in a sketch and at aggregation time,
   # statistical properties will be logged (mean, count, percentiles, ...)
   def sample(self, name: str, value: float):
-    self._send(f"{name}:{value}|{METRIC_TYPE.SAMPLE}")
+    self._update()
+    if name not in self.samples:
+      self.samples[name] = QuantileSketch()
+    self.samples[name].add(value)
 
 
 def main() -> NoReturn:
@@ -104,7 +285,7 @@ def main() -> NoReturn:
   idx = 0
   last_flush_time = time.monotonic()
   gauges = {}
-  samples: dict[str, list[float]] = defaultdict(list)
+  samples: dict[str, QuantileSketch] = {}
   try:
     while True:
       started_prev = sm['deviceState'].started
@@ -113,20 +294,17 @@ def main() -> NoReturn:
       # Update metrics
       while True:
         try:
-          metric = sock.recv_string(zmq.NOBLOCK)
+          metrics = sock.recv(zmq.NOBLOCK)
           try:
-            metric_type = metric.split('|')[1]
-            metric_name = metric.split(':')[0]
-            metric_value = float(metric.split('|')[0].split(':')[1])
-
-            if metric_type == METRIC_TYPE.GAUGE:
-              gauges[metric_name] = metric_value
-            elif metric_type == METRIC_TYPE.SAMPLE:
-              samples[metric_name].append(metric_value)
-            else:
-              cloudlog.event("unknown metric type", metric_type=metric_type)
+            for metric_type, metric_name, metric_value in unpack_metrics(metrics):
+              if metric_type == METRIC_TYPE.GAUGE:
+                gauges[metric_name] = metric_value
+              elif metric_name in samples:
+                samples[metric_name].merge(metric_value)
+              else:
+                samples[metric_name] = metric_value
           except Exception:
-            cloudlog.event("malformed metric", metric=metric)
+            cloudlog.event("malformed metric", metric=metrics.hex())
         except zmq.error.Again:
           break
 
@@ -139,20 +317,18 @@ def main() -> NoReturn:
         for key, value in gauges.items():
           result += get_influxdb_line(f"gauge.{key}", value, current_time, tags)
 
-        for key, values in samples.items():
-          values.sort()
-          sample_count = len(values)
-          sample_sum = sum(values)
-
-          stats = {
-            'count': sample_count,
-            'min': values[0],
-            'max': values[-1],
-            'mean': sample_sum / sample_count,
-          }
-          for percentile in [0.05, 0.5, 0.95]:
-            value = values[int(round(percentile * (sample_count - 1)))]
-            stats[f"p{int(percentile * 100)}"] = value
+        for key, sketch in samples.items():
+          stats: dict[str, float] = {'count': sketch.count}
+          if sketch.count > 0:
+            stats.update({
+              'min': sketch.min,
+              'max': sketch.max,
+              'mean': sketch.sum / sketch.count,
+            })
+            for percentile in [0.05, 0.5, 0.95]:
+              stats[f"p{int(percentile * 100)}"] = sketch.quantile(percentile)
+          if sketch.nonfinite_count > 0:
+            stats['nonfinite_count'] = sketch.nonfinite_count
 
           result += get_influxdb_line(f"sample.{key}", stats, current_time, tags)
 
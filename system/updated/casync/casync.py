@@ -7,8 +7,9 @@ import struct
 import sys
 import time
 from abc import ABC, abstractmethod
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
 from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import IO
 
 import requests
@@ -31,15 +32,25 @@ CHUNK_DOWNLOAD_RETRIES = 3
 
 CAIBX_DOWNLOAD_TIMEOUT = 120
 
+EXTRACT_WORKERS = 8
+EXTRACT_MAX_PENDING = 64
+COALESCE_MAX_SIZE = 8 * 1024 * 1024
+
 Chunk = namedtuple('Chunk', ['sha', 'offset', 'length'])
 ChunkDict = dict[bytes, Chunk]
 
 
 class ChunkReader(ABC):
+  # readers that are safe to use from multiple threads are read from concurrently by extract
+  concurrent = False
+
   @abstractmethod
   def read(self, chunk: Chunk) -> bytes:
     ...
 
+  def read_many(self, chunks: list[Chunk]) -> list[bytes]:
+    return [self.read(chunk) for chunk in chunks]
+
 
 class BinaryChunkReader(ChunkReader):
   """Reads chunks from a local file"""
@@ -51,6 +62,22 @@ class BinaryChunkReader(ChunkReader):
     self.f.seek(chunk.offset)
     return self.f.read(chunk.length)
 
+  def read_many(self, chunks: list[Chunk]) -> list[bytes]:
+    """Reads runs of adjacent chunks with a single sequential read"""
+    ret = []
+    i = 0
+    while i < len(chunks):
+      j = i + 1
+      while j < len(chunks) and chunks[j].offset == chunks[j - 1].offset + chunks[j - 1].length:
+        j += 1
+
+      start = chunks[i].offset
+      self.f.seek(start)
+      dat = self.f.read(chunks[j - 1].offset + chunks[j - 1].length - start)
+      ret += [dat[c.offset - start:c.offset - start + c.length] for c in chunks[i:j]]
+      i = j
+    return ret
+
 
 class FileChunkReader(BinaryChunkReader):
   def __init__(self, path: str) -> None:
@@ -62,6 +89,7 @@ class FileChunkReader(BinaryChunkReader):
 
 class RemoteChunkReader(ChunkReader):
   """Reads lzma compressed chunks from a remote store"""
+  concurrent = True
 
   def __init__(self, url: str) -> None:
     super().__init__()
@@ -165,41 +193,90 @@ def build_chunk_dict(chunks: list[Chunk]) -> ChunkDict:
   return r
 
 
+def verify_chunk(bts: bytes, chunk: Chunk) -> bool:
+  return len(bts) == chunk.length and SHA512.new(bts, truncate="256").digest() == chunk.sha
+
+
+def read_verified(chunk_reader: ChunkReader, store_chunk: Chunk, chunk: Chunk) -> bytes | None:
+  bts = chunk_reader.read(store_chunk)
+  return bts if verify_chunk(bts, chunk) else None
+
+
 def extract(target: list[Chunk],
             sources: list[tuple[str, ChunkReader, ChunkDict]],
             out_path: str,
-            progress: Callable[[int], None] = None):
+            progress: Callable[[int], None] = None,
+            num_workers: int = EXTRACT_WORKERS):
+  """Chunks from concurrent readers are downloaded, decompressed and verified on a thread pool,
+  runs of chunks from local stores are read together. Chunks are written in order as they complete."""
   stats: dict[str, int] = defaultdict(int)
 
-  mode = 'rb+' if os.path.exists(out_path) else 'wb'
-  with open(out_path, mode) as out:
-    for cur_chunk in target:
+  def done(bts: bytes | None) -> Future:
+    f: Future = Future()
+    f.set_result(bts)
+    return f
 
-      # Find source for desired chunk
-      for name, chunk_reader, store_chunks in sources:
-        if cur_chunk.sha in store_chunks:
-          bts = chunk_reader.read(store_chunks[cur_chunk.sha])
+  def candidates(chunk: Chunk) -> list[tuple[str, ChunkReader, Chunk]]:
+    return [(name, chunk_reader, store_chunks[chunk.sha]) for name, chunk_reader, store_chunks in sources if chunk.sha in store_chunks]
 
-          # Check length
-          if len(bts) != cur_chunk.length:
-            continue
+  def start(chunk: Chunk, cands: list[tuple[str, ChunkReader, Chunk]], idx: int) -> Future:
+    if idx >= len(cands):
+      raise RuntimeError("Desired chunk not found in provided stores")
+    _, chunk_reader, store_chunk = cands[idx]
+    if chunk_reader.concurrent:
+      return pool.submit(read_verified, chunk_reader, store_chunk, chunk)
+    return done(read_verified(chunk_reader, store_chunk, chunk))
 
-          # Check hash
-          if SHA512.new(bts, truncate="256").digest() != cur_chunk.sha:
-            continue
+  def finish(out: IO[bytes], chunk: Chunk, cands: list[tuple[str, ChunkReader, Chunk]], idx: int, future: Future) -> None:
+    # fall back to the next source until one has a valid chunk
+    while (bts := future.result()) is None:
+      idx += 1
+      future = start(chunk, cands, idx)
 
-          # Write to output
-          out.seek(cur_chunk.offset)
-          out.write(bts)
+    out.seek(chunk.offset)
+    out.write(bts)
 
-          stats[name] += cur_chunk.length
+    stats[cands[idx][0]] += chunk.length
+    if progress is not None:
+      progress(sum(stats.values()))
 
-          if progress is not None:
-            progress(sum(stats.values()))
-
-          break
-      else:
-        raise RuntimeError("Desired chunk not found in provided stores")
+  pool = ThreadPoolExecutor(max_workers=num_workers)
+  mode = 'rb+' if os.path.exists(out_path) else 'wb'
+  try:
+    with open(out_path, mode) as out:
+      pending: deque = deque()
+      i = 0
+      while i < len(target):
+        cands = candidates(target[i])
+        if len(cands) and not cands[0][1].concurrent:
+          # batch the following chunks that come from the same local store
+          chunk_reader = cands[0][1]
+          run = [(target[i], cands)]
+          size = target[i].length
+          while i + len(run) < len(target) and len(run) < EXTRACT_MAX_PENDING and size < COALESCE_MAX_SIZE:
+            next_cands = candidates(target[i + len(run)])
+            if not len(next_cands) or next_cands[0][1] is not chunk_reader:
+              break
+            run.append((target[i + len(run)], next_cands))
+            size += target[i + len(run) - 1].length
+
+          for (chunk, chunk_cands), bts in zip(run, chunk_reader.read_many([c[0][2] for _, c in run]), strict=True):
+            if verify_chunk(bts, chunk):
+              pending.append((chunk, chunk_cands, 0, done(bts)))
+            else:
+              pending.append((chunk, chunk_cands, 1, start(chunk, chunk_cands, 1)))
+          i += len(run)
+        else:
+          pending.append((target[i], cands, 0, start(target[i], cands, 0)))
+          i += 1
+
+        while len(pending) > EXTRACT_MAX_PENDING:
+          finish(out, *pending.popleft())
+
+      while len(pending):
+        finish(out, *pending.popleft())
+  finally:
+    pool.shutdown(wait=True, cancel_futures=True)
 
   return stats
 
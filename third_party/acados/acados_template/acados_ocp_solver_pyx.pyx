@@ -587,6 +587,90 @@ cdef class AcadosOcpSolverCython:
                     self.nlp_solver, stage, field, <void *> value.data)
         return
 
+    def set_all_stages(self, str field_, value_):
+        """
+        Set numerical data for the stages 0, 1, ... from the rows of a 2D array in one call,
+        instead of calling set once per stage.
+
+            :param field: string in ['p', 'x', 'u', 'yref', 'lbx', 'ubx', 'lbu', 'ubu']
+            :param value: 2D numpy array with one row per stage, up to N+1 rows.
+
+            .. note:: stages where the field has fewer dimensions than the row, like yref
+                      at the terminal stage, are set from the start of their row.
+        """
+        if not isinstance(value_, np.ndarray) or value_.ndim != 2:
+            raise Exception(f"set_all_stages: value must be a 2D numpy array, got {type(value_)}.")
+        cost_fields = ['y_ref', 'yref']
+        constraints_fields = ['lbx', 'ubx', 'lbu', 'ubu']
+        out_fields = ['x', 'u']
+
+        if field_ not in ['p'] + cost_fields + constraints_fields + out_fields:
+            raise Exception("AcadosOcpSolverCython.set_all_stages(): {} is not a valid argument.\
+                \nPossible values are {}.".format(field_, ['p'] + cost_fields + constraints_fields + out_fields))
+
+        if value_.shape[0] > self.N + 1:
+            raise Exception(f"set_all_stages: got {value_.shape[0]} rows for {self.N + 1} stages.")
+
+        field = field_.encode('utf-8')
+        cdef cnp.ndarray[cnp.float64_t, ndim=2, mode="c"] value = np.ascontiguousarray(value_, dtype=np.float64)
+        cdef int n_cols = value.shape[1]
+        cdef int stage, dims
+        cdef double *row
+
+        for stage in range(value.shape[0]):
+            row = <double *> value.data + stage * n_cols
+            if field_ == 'p':
+                assert acados_solver.acados_update_params(self.capsule, stage, row, n_cols) == 0
+                continue
+
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, field)
+            if dims > n_cols:
+                raise Exception(f"set_all_stages: field {field_} has dimension {dims} at stage {stage}, got {n_cols}.")
+
+            if field_ in constraints_fields:
+                acados_solver_common.ocp_nlp_constraints_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, field, <void *> row)
+            elif field_ in cost_fields:
+                acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, field, <void *> row)
+            else:
+                acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, field, <void *> row)
+        return
+
+
+    def get_all_stages(self, str field_, out_):
+        """
+        Get the last solution for the stages 0, 1, ... into the rows of a preallocated
+        2D array in one call, instead of calling get once per stage.
+
+            :param field: string in ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+            :param out: C contiguous 2D float64 numpy array with one row per stage, its
+                        columns the dimension of the field.
+        """
+        out_fields = ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolverCython.get_all_stages(): {} is an invalid argument.\
+                    \n Possible values are {}.'.format(field_, out_fields))
+
+        cdef cnp.ndarray[cnp.float64_t, ndim=2, mode="c"] out = out_
+        if out.shape[0] > self.N + 1 or (field_ == 'pi' and out.shape[0] > self.N):
+            raise Exception(f"get_all_stages: got {out.shape[0]} rows for field {field_} with N = {self.N}.")
+
+        field = field_.encode('utf-8')
+        cdef int n_cols = out.shape[1]
+        cdef int stage, dims
+
+        for stage in range(out.shape[0]):
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, field)
+            if dims != n_cols:
+                raise Exception(f"get_all_stages: field {field_} has dimension {dims} at stage {stage}, got {n_cols}.")
+            acados_solver_common.ocp_nlp_out_get(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, stage, field, <void *> (<double *> out.data + stage * n_cols))
+        return out
+
     def cost_set(self, int stage, str field_, value_):
         """
         Set numerical data in the cost module of the solver.
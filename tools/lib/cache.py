@@ -1,5 +1,9 @@
 import os
+import pickle
 import urllib.parse
+from functools import wraps
+
+from openpilot.common.file_helpers import atomic_write_in_dir
 
 DEFAULT_CACHE_DIR = os.getenv("CACHE_ROOT", os.path.expanduser("~/.commacache"))
 
@@ -12,3 +16,26 @@ def cache_path_for_file_path(fn, cache_dir=DEFAULT_CACHE_DIR):
   else:
     cache_fn = f'{fn_parsed.hostname}_{fn_parsed.path.replace("/", "_")}'
   return os.path.join(dir_, cache_fn)
+
+
+def cache_fn(func):
+  @wraps(func)
+  def cache_inner(fn, *args, **kwargs):
+    if kwargs.pop('no_cache', None):
+      cache_path = None
+    else:
+      cache_dir = kwargs.pop('cache_dir', DEFAULT_CACHE_DIR)
+      cache_path = cache_path_for_file_path(fn, cache_dir)
+
+    if cache_path and os.path.exists(cache_path):
+      with open(cache_path, "rb") as cache_file:
+        cache_value = pickle.load(cache_file)
+    else:
+      cache_value = func(fn, *args, **kwargs)
+      if cache_path:
+        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
+          pickle.dump(cache_value, cache_file, -1)
+
+    return cache_value
+
+  return cache_inner
@@ -1,20 +1,17 @@
 import json
 import os
-import pickle
 import struct
 import subprocess
 import threading
 from enum import IntEnum
-from functools import wraps
 
 import numpy as np
 from lru import LRU
 
 import _io
-from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
+from openpilot.tools.lib.cache import cache_fn, DEFAULT_CACHE_DIR
 from openpilot.tools.lib.exceptions import DataUnreadableError
 from openpilot.tools.lib.vidindex import hevc_index
-from openpilot.common.file_helpers import atomic_write_in_dir
 
 from openpilot.tools.lib.filereader import FileReader, resolve_name
 
@@ -74,29 +71,6 @@ def ffprobe(fn, fmt=None):
   return json.loads(ffprobe_output)
 
 
-def cache_fn(func):
-  @wraps(func)
-  def cache_inner(fn, *args, **kwargs):
-    if kwargs.pop('no_cache', None):
-      cache_path = None
-    else:
-      cache_dir = kwargs.pop('cache_dir', DEFAULT_CACHE_DIR)
-      cache_path = cache_path_for_file_path(fn, cache_dir)
-
-    if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
-      cache_value = func(fn, *args, **kwargs)
-      if cache_path:
-        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
-
-    return cache_value
-
-  return cache_inner
-
-
 @cache_fn
 def index_stream(fn, ft):
   if ft != FrameType.h265_stream:
@@ -166,10 +140,10 @@ def rgb24tonv12(rgb):
   return nv12.clip(0, 255).astype('uint8')
 
 
-def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
+def ffmpeg_decode_args(vid_fmt, pix_fmt):
   threads = os.getenv("FFMPEG_THREADS", "0")
   cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
-  args = ["ffmpeg", "-v", "quiet",
+  return ["ffmpeg", "-v", "quiet",
           "-threads", threads,
           "-hwaccel", "none" if not cuda else "cuda",
           "-c:v", "hevc",
@@ -181,20 +155,60 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
           "-f", "rawvideo",
           "-pix_fmt", pix_fmt,
           "-"]
-  dat = subprocess.check_output(args, input=rawdat)
 
+
+def frame_shape(w, h, pix_fmt):
   if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt == "nv12":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv420p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
+    return (h, w, 3)
+  elif pix_fmt in ("nv12", "yuv420p"):
+    return (h*w*3//2,)
   elif pix_fmt == "yuv444p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
+    return (3, h, w)
   else:
     raise NotImplementedError
 
-  return ret
+
+def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
+  dat = subprocess.check_output(ffmpeg_decode_args(vid_fmt, pix_fmt), input=rawdat)
+  return np.frombuffer(dat, dtype=np.uint8).reshape((-1,) + frame_shape(w, h, pix_fmt))
+
+
+def decompress_video_data_into(rawdat, vid_fmt, w, h, pix_fmt, out, frame_slots):
+  # decoded frame i is written straight into out[j] for each j in frame_slots[i], other frames are dropped
+  frame = np.empty(frame_shape(w, h, pix_fmt), dtype=np.uint8)
+  last_frame = max(frame_slots)
+
+  proc = subprocess.Popen(ffmpeg_decode_args(vid_fmt, pix_fmt), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+  def write_thread():
+    try:
+      proc.stdin.write(rawdat)
+    except BrokenPipeError:
+      pass
+    finally:
+      proc.stdin.close()
+
+  t = threading.Thread(target=write_thread, daemon=True)
+  t.start()
+  try:
+    for i in range(last_frame + 1):
+      slots = frame_slots.get(i)
+      buf = memoryview(out[slots[0]] if slots else frame).cast('B')
+      read = 0
+      while read < len(buf):
+        n = proc.stdout.readinto(buf[read:])
+        if not n:
+          raise DataUnreadableError(f"ffmpeg returned {i} frames, expected at least {last_frame + 1}")
+        read += n
+
+      for slot in (slots or [])[1:]:
+        out[slot] = out[slots[0]]
+  finally:
+    # no need to decode the rest of the GOP
+    proc.kill()
+    proc.stdout.close()
+    proc.wait()
+    t.join()
 
 
 class BaseFrameReader:
@@ -497,6 +511,39 @@ class GOPFrameReader(BaseFrameReader):
 
       return self.frame_cache[(num, pix_fmt)]
 
+  def get_batch(self, nums, pix_fmt="yuv420p", out=None):
+    """Decodes the sorted frame numbers into one (N, ...) array, decoding each GOP only once.
+    out can be a preallocated array to decode into, e.g. one backed by shared memory."""
+    assert self.frame_count is not None
+
+    if pix_fmt not in ("nv12", "yuv420p", "rgb24", "yuv444p"):
+      raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
+
+    nums = list(nums)
+    if any(a > b for a, b in zip(nums, nums[1:], strict=False)):
+      raise ValueError("frame numbers must be sorted")
+    if len(nums) and (nums[0] < 0 or nums[-1] >= self.frame_count):
+      raise ValueError(f"frame numbers must be in [0, {self.frame_count})")
+
+    shape = (len(nums),) + frame_shape(self.w, self.h, pix_fmt)
+    if out is None:
+      out = np.empty(shape, dtype=np.uint8)
+    elif out.shape != shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+      raise ValueError(f"out must be a contiguous uint8 array of shape {shape}")
+
+    i = 0
+    while i < len(nums):
+      frame_b, num_frames, skip_frames, rawdat = self.get_gop(nums[i])
+
+      frame_slots: dict[int, list[int]] = {}
+      while i < len(nums) and nums[i] < frame_b + num_frames:
+        frame_slots.setdefault(skip_frames + nums[i] - frame_b, []).append(i)
+        i += 1
+
+      decompress_video_data_into(rawdat, self.vid_fmt, self.w, self.h, pix_fmt, out, frame_slots)
+
+    return out
+
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
 
@@ -1,21 +1,30 @@
 #!/usr/bin/env python3
 import bz2
 from functools import partial
+import heapq
 import multiprocessing
 import capnp
 import enum
+import numpy as np
+import io
 import os
 import pathlib
+import secrets
+import struct
 import sys
 import tqdm
 import urllib.parse
 import warnings
 
+from collections import deque
 from collections.abc import Callable, Iterable, Iterator
+from multiprocessing import resource_tracker, shared_memory
 from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
 from openpilot.common.swaglog import cloudlog
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.cache import cache_fn, cache_path_for_file_path, DEFAULT_CACHE_DIR
 from openpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from openpilot.tools.lib.openpilotci import get_url
 from openpilot.tools.lib.filereader import FileReader, file_exists, internal_source_available
@@ -26,10 +35,29 @@ LogIterable = Iterable[LogMessage]
 RawLogIterable = Iterable[bytes]
 
 
+# decompressed events are parsed in blocks of roughly this size when streaming
+STREAM_CHUNK_SIZE = 1024 * 1024
+# indexed events of uncompressed logs less than this far apart are fetched with one read, up to INDEXED_READ_MAX_SIZE
+INDEXED_READ_MAX_GAP = 64 * 1024
+INDEXED_READ_MAX_SIZE = 16 * 1024 * 1024
+
+
+def _capnp_message_size(buf: bytearray, offset: int) -> int | None:
+  # capnp stream framing: segment count - 1, then each segment's size in words, padded to 8 bytes
+  if len(buf) - offset < 4:
+    return None
+  num_segments = struct.unpack_from('<I', buf, offset)[0] + 1
+  header_size = (4 + 4 * num_segments + 7) & ~7
+  if len(buf) - offset < header_size:
+    return None
+  return header_size + 8 * sum(struct.unpack_from(f'<{num_segments}I', buf, offset + 4))
+
+
 class _LogFileReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None, stream=False):
     self.data_version = None
     self._only_union_types = only_union_types
+    self._stream = stream
 
     ext = None
     if not dat:
@@ -38,6 +66,14 @@ class _LogFileReader:
         # old rlogs weren't bz2 compressed
         raise Exception(f"unknown extension {ext}")
 
+    if stream:
+      if sort_by_time:
+        raise Exception("sort_by_time is not supported when streaming")
+      # nothing is read until iteration, so callers can stop early without decoding the whole file
+      self._fn, self._ext, self._dat = fn, ext, dat
+      return
+
+    if not dat:
       with FileReader(fn) as f:
         dat = f.read()
 
@@ -56,8 +92,51 @@ class _LogFileReader:
     self._ents = list(sorted(_ents, key=lambda x: x.logMonoTime) if sort_by_time else _ents)
     self._ts = [x.logMonoTime for x in self._ents]
 
+  def _decompressed_chunks(self) -> Iterator[bytes]:
+    with (io.BytesIO(self._dat) if self._dat else FileReader(self._fn)) as f:
+      decompressor = None
+      dat = f.read(STREAM_CHUNK_SIZE)
+      if self._ext == ".bz2" or dat.startswith(b'BZh9'):
+        decompressor = bz2.BZ2Decompressor()
+
+      while dat:
+        if decompressor is None:
+          yield dat
+        else:
+          while dat:
+            yield decompressor.decompress(dat)
+            if not decompressor.eof:
+              break
+            # multi-stream bz2 file, continue with the next stream
+            dat = decompressor.unused_data
+            decompressor = bz2.BZ2Decompressor()
+        dat = f.read(STREAM_CHUNK_SIZE)
+
+  def _stream_events(self) -> Iterator[capnp._DynamicStructReader]:
+    buf = bytearray()
+    for dat in self._decompressed_chunks():
+      buf += dat
+
+      # only hand complete messages to capnp, the rest stays buffered
+      end = 0
+      while (size := _capnp_message_size(buf, end)) is not None and end + size <= len(buf):
+        end += size
+      if end == 0:
+        continue
+
+      block = bytes(buf[:end])
+      del buf[:end]
+      try:
+        yield from capnp_log.Event.read_multiple_bytes(block)
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+        return
+
+    if len(buf):
+      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
+    for ent in (self._stream_events() if self._stream else self._ents):
       if self._only_union_types:
         try:
           ent.which()
@@ -68,6 +147,186 @@ class _LogFileReader:
         yield ent
 
 
+LOG_INDEX_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "log_index")
+
+
+LOG_COLUMNS_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "log_columns")
+#  capnp types that can be columns, enums are stored as their raw value
+COLUMN_DTYPES = {
+  'bool': np.bool_,
+  'int8': np.int8, 'int16': np.int16, 'int32': np.int32, 'int64': np.int64,
+  'uint8': np.uint8, 'uint16': np.uint16, 'uint32': np.uint32, 'uint64': np.uint64,
+  'float32': np.float32, 'float64': np.float64,
+  'enum': np.uint16,
+}
+
+
+def _is_bz2(fn, dat) -> bool:
+  return os.path.splitext(urllib.parse.urlparse(fn).path)[1] == ".bz2" or dat.startswith(b'BZh9')
+
+
+def _read_log(fn) -> bytes:
+  with FileReader(fn) as f:
+    dat = f.read()
+  return bz2.decompress(dat) if _is_bz2(fn, dat) else dat
+
+
+@cache_fn
+def index_log(fn, dat: bytes | None = None):
+  # dat is the decompressed log, if the caller already has it
+  if dat is None:
+    dat = _read_log(fn)
+
+  # offsets and sizes are into the decompressed log
+  services: dict[str, dict] = {}
+  offset = 0
+  try:
+    for ent in capnp_log.Event.read_multiple_bytes(dat):
+      size = _capnp_message_size(dat, offset)
+      try:
+        which = ent.which()
+      except capnp.lib.capnp.KjException:
+        which = None
+
+      if which is not None:
+        service = services.setdefault(which, {'count': 0, 'offsets': [], 'sizes': [],
+                                              'min_time': ent.logMonoTime, 'max_time': ent.logMonoTime})
+        service['count'] += 1
+        service['offsets'].append(offset)
+        service['sizes'].append(size)
+        service['min_time'] = min(service['min_time'], ent.logMonoTime)
+        service['max_time'] = max(service['max_time'], ent.logMonoTime)
+      offset += size
+  except capnp.KjException:
+    warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  return {
+    'services': services,
+    'length': offset,
+  }
+
+
+def get_log_index(fn, cache_dir=LOG_INDEX_CACHE_DIR, dat: bytes | None = None):
+  return index_log(fn, dat=dat, cache_dir=cache_dir)
+
+
+def _read_ranges(f, offsets: list[int], sizes: list[int]) -> Iterator[bytes]:
+  # ranges close together are fetched with a single read, remote files take a request for each read
+  i = 0
+  while i < len(offsets):
+    start, end = offsets[i], offsets[i] + sizes[i]
+    j = i + 1
+    while j < len(offsets) and end <= offsets[j] <= end + INDEXED_READ_MAX_GAP and offsets[j] + sizes[j] - start <= INDEXED_READ_MAX_SIZE:
+      end = offsets[j] + sizes[j]
+      j += 1
+
+    f.seek(start)
+    dat = f.read(end - start)
+    for offset, size in zip(offsets[i:j], sizes[i:j], strict=True):
+      yield dat[offset - start:offset - start + size]
+    i = j
+
+
+def read_indexed_events(fn, offsets: list[int], sizes: list[int], dat: bytes | None = None) -> Iterator[capnp._DynamicStructReader]:
+  """Reads the events at offsets and sizes from the log index, out of dat if the decompressed log is already
+  in memory. Uncompressed logs are only read at the events, bz2 logs can't be read at an offset and are
+  decompressed whole, so for those the index only helps skip logs."""
+  if dat is None:
+    with FileReader(fn) as f:
+      header = f.read(4)
+      if not _is_bz2(fn, header):
+        for event_dat in _read_ranges(f, offsets, sizes):
+          yield from capnp_log.Event.read_multiple_bytes(event_dat)
+        return
+    dat = _read_log(fn)
+
+  for offset, size in zip(offsets, sizes, strict=True):
+    yield from capnp_log.Event.read_multiple_bytes(dat[offset:offset + size])
+
+
+def _get_field(msg, field: str):
+  for name in field.split('.'):
+    msg = getattr(msg, name)
+  return msg
+
+
+def _column_type(service: str, field: str) -> str:
+  # from the schema, so a column has the same dtype whether or not a segment has any messages
+  schema = capnp_log.Event.schema
+  column_type = 'struct'
+  for name in (service, *field.split('.')):
+    if column_type not in ('struct', 'group') or name not in schema.fields:
+      raise ValueError(f"{service}.{field} isn't a field in the log schema")
+    schema_field = schema.fields[name]
+    proto = schema_field.proto
+    column_type = proto.slot.type.which() if proto.which() == 'slot' else proto.which()
+    if column_type in ('struct', 'group'):
+      schema = schema_field.schema
+
+  if column_type not in COLUMN_DTYPES:
+    raise ValueError(f"{service}.{field} is a {column_type} field, only primitive fields can be columns")
+  return column_type
+
+
+def column_cache_path(fn, service: str, field: str, sort_by_time: bool = False, cache_dir=LOG_COLUMNS_CACHE_DIR) -> str:
+  return cache_path_for_file_path(fn, cache_dir) + f"_{service}.{field}{'_sorted' if sort_by_time else ''}.npy"
+
+
+def _load_log_shared(fn, name: str, only_union_types=False):
+  # runs in a worker: decompress and parse the log, then hand the raw events back through shared memory named
+  # by the parent, so the parent can release it without waiting for the worker
+  dat = _read_log(fn)
+
+  times, offsets, sizes = [], [], []
+  offset = 0
+  try:
+    for ent in capnp_log.Event.read_multiple_bytes(dat):
+      size = _capnp_message_size(dat, offset)
+      try:
+        if only_union_types:
+          ent.which()
+        times.append(ent.logMonoTime)
+        offsets.append(offset)
+        sizes.append(size)
+      except capnp.lib.capnp.KjException:
+        pass
+      offset += size
+  except capnp.KjException:
+    warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  shm = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+  shm.buf[:offset] = dat[:offset]
+  shm.close()
+  # ownership moves to the reading process, which unlinks it
+  resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+
+  order = np.argsort(np.array(times, dtype=np.uint64), kind='stable')
+  return offset, np.array(times, dtype=np.uint64)[order], np.array(offsets, dtype=np.int64)[order], np.array(sizes, dtype=np.int64)[order]
+
+
+def _attach_log_shared(name: str, length: int) -> bytes:
+  shm = shared_memory.SharedMemory(name=name)
+  try:
+    return bytes(shm.buf[:length])
+  finally:
+    shm.close()
+    shm.unlink()
+
+
+def _unlink_log_shared(name: str) -> None:
+  try:
+    shm = shared_memory.SharedMemory(name=name)
+  except FileNotFoundError:
+    return  # the worker didn't get to it
+  shm.close()
+  shm.unlink()
+
+
+def _sorted_log_events(dat: bytes, times: np.ndarray, offsets: np.ndarray, sizes: np.ndarray):
+  for pos, (t, offset, size) in enumerate(zip(times.tolist(), offsets.tolist(), sizes.tolist(), strict=True)):
+    yield t, pos, next(iter(capnp_log.Event.read_multiple_bytes(dat[offset:offset + size])))
+
+
 class ReadMode(enum.StrEnum):
   RLOG = "r"  # only read rlogs
   QLOG = "q"  # only read qlogs
@@ -244,26 +503,89 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               default_source=auto_source, sort_by_time=False, only_union_types=False):
+               default_source=auto_source, sort_by_time=False, only_union_types=False, stream=False,
+               index=False):
     self.default_mode = default_mode
     self.default_source = default_source
     self.identifier = identifier
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    self.stream = stream
+    self.index = index
 
     self.__lrs: dict[int, _LogFileReader] = {}
     self.reset()
 
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time,
+                                       only_union_types=self.only_union_types, stream=self.stream)
     return self.__lrs[i]
 
   def __iter__(self):
     for i in range(len(self.logreader_identifiers)):
       yield from self._get_lr(i)
 
+  def iter_sorted(self, num_processes: int | None = None) -> Iterator[capnp._DynamicStructReader]:
+    """Iterates over all segments ordered by logMonoTime. Up to num_processes segments are decompressed and
+    parsed ahead in worker processes, and merged as their time ranges overlap."""
+    num_processes = num_processes or os.cpu_count() or 1
+
+    with multiprocessing.Pool(num_processes) as pool:
+      identifiers = iter(self.logreader_identifiers)
+      pending: deque[tuple[str, multiprocessing.pool.AsyncResult]] = deque()
+
+      def submit():
+        fn = next(identifiers, None)
+        if fn is not None:
+          name = f"lr_{secrets.token_hex(8)}"
+          pending.append((name, pool.apply_async(_load_log_shared, (fn, name, self.only_union_types))))
+
+      def push(heap, seg, events):
+        ev = next(events, None)
+        if ev is not None:
+          heapq.heappush(heap, (ev[0], seg, ev[1], ev[2], events))
+
+      for _ in range(num_processes):
+        submit()
+
+      heap: list = []
+      upcoming = None
+      seg = 0
+      try:
+        while True:
+          if upcoming is None and len(pending):
+            name, result = pending[0]
+            length, times, offsets, sizes = result.get()
+            pending.popleft()
+            submit()
+            dat = _attach_log_shared(name, length)
+            if len(times):
+              upcoming = (int(times[0]), _sorted_log_events(dat, times, offsets, sizes))
+
+          # segments are mostly sequential, only start merging the next one once its first event is due
+          if upcoming is not None and (not len(heap) or upcoming[0] <= heap[0][0]):
+            push(heap, seg, upcoming[1])
+            upcoming = None
+            seg += 1
+            continue
+
+          if not len(heap):
+            if len(pending):
+              continue
+            break
+
+          _, cur_seg, _, ent, events = heapq.heappop(heap)
+          yield ent
+          push(heap, cur_seg, events)
+      finally:
+        # stop loading ahead without waiting for the workers or their errors, then release the shared
+        # memory of segments that were loaded but never consumed
+        pool.terminate()
+        for name, _ in pending:
+          _unlink_log_shared(name)
+
   def _run_on_segment(self, func, i):
     return func(self._get_lr(i))
 
@@ -275,14 +597,77 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
         ret.extend(p)
       return ret
 
+  def _segment_columns(self, i, column_types: dict[str, dict[str, str]], cache: bool) -> dict[str, dict[str, np.ndarray]]:
+    fn = self.logreader_identifiers[i]
+
+    columns: dict[str, dict[str, np.ndarray]] = {service: {} for service in column_types}
+    missing: dict[str, dict[str, list]] = {}
+    for service, types in column_types.items():
+      for name, column_type in types.items():
+        path = column_cache_path(fn, service, name, self.sort_by_time)
+        if cache and os.path.exists(path):
+          columns[service][name] = np.load(path).astype(COLUMN_DTYPES[column_type], copy=False)
+        else:
+          missing.setdefault(service, {})[name] = []
+
+    # decode every column that isn't cached in a single pass over the log
+    if len(missing):
+      for ent in self._get_lr(i):
+        which = ent.which()
+        if which in missing:
+          msg = getattr(ent, which)
+          for name, values in missing[which].items():
+            if name == 'logMonoTime':
+              values.append(ent.logMonoTime)
+            elif column_types[which][name] == 'enum':
+              values.append(_get_field(msg, name).raw)
+            else:
+              values.append(_get_field(msg, name))
+
+      for service, names in missing.items():
+        for name, values in names.items():
+          column = np.array(values, dtype=COLUMN_DTYPES[column_types[service][name]])
+          columns[service][name] = column
+          if cache:
+            with atomic_write_in_dir(column_cache_path(fn, service, name, self.sort_by_time), mode="wb", overwrite=True) as f:
+              np.save(f, column)
+
+    return columns
+
+  def to_columns(self, fields: dict[str, list[str]], cache: bool = False) -> dict[str, dict[str, np.ndarray]]:
+    """Returns contiguous arrays of scalar fields for each service, e.g. {'carState': ['vEgo', 'cruiseState.speed']}.
+    Every service also gets a logMonoTime column. With cache, columns are stored per log and reused on later calls.
+    The dtypes follow the log schema, enums are their raw values. Raises ValueError for fields that aren't primitive."""
+    column_types = {service: {'logMonoTime': 'uint64', **{name: _column_type(service, name) for name in names}}
+                    for service, names in fields.items()}
+    segments = [self._segment_columns(i, column_types, cache) for i in range(len(self.logreader_identifiers))]
+    return {service: {name: np.concatenate([seg[service][name] for seg in segments]) for name in ('logMonoTime', *names)}
+            for service, names in fields.items()}
+
   def reset(self):
     self.logreader_identifiers = self._parse_identifiers(self.identifier)
 
   @staticmethod
-  def from_bytes(dat):
-    return _LogFileReader("", dat=dat)
+  def from_bytes(dat, stream=False):
+    return _LogFileReader("", dat=dat, stream=stream)
+
+  def _filter_indexed(self, msg_type: str):
+    for fn in self.logreader_identifiers:
+      # when the index has to be built, the events are read from the log decompressed for it
+      dat = None
+      if not os.path.exists(cache_path_for_file_path(fn, LOG_INDEX_CACHE_DIR)):
+        dat = _read_log(fn)
+
+      service = get_log_index(fn, dat=dat)['services'].get(msg_type)
+      if service is None:
+        continue
+
+      events = read_indexed_events(fn, service['offsets'], service['sizes'], dat)
+      yield from sorted(events, key=lambda x: x.logMonoTime) if self.sort_by_time else events
 
   def filter(self, msg_type: str):
+    if self.index:
+      return (getattr(m, msg_type) for m in self._filter_indexed(msg_type))
     return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
 
   def first(self, msg_type: str):
@@ -1,7 +1,14 @@
+import atexit
+import fcntl
+import json
 import logging
 import os
+import re
 import socket
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, suppress
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
@@ -12,6 +19,15 @@ from openpilot.system.hardware.hw import Paths
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Number of chunks downloaded ahead of each read
+PREFETCH_CHUNKS = int(os.environ.get("FILEREADER_PREFETCH", "4"))
+#  Total size of cached chunks before the least recently used are evicted
+CACHE_SIZE_LIMIT = int(os.environ.get("FILEREADER_CACHE_SIZE", str(10 * 1000 * 1000 * K)))
+#  Longest time access times of cached chunks are kept in memory before they're written to the index
+INDEX_PERSIST_INTERVAL = 10.
+#  Cached chunks are named <url hash>_<chunk number>, older versions used a float chunk number
+CHUNK_NAME_RE = re.compile(r"[0-9a-f]{64}_\d+")
+OLD_CHUNK_NAME_RE = re.compile(r"([0-9a-f]{64}_\d+)\.0")
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -24,12 +40,151 @@ class URLFileException(Exception):
   pass
 
 
+class ChunkCache:
+  """
+  Size-bounded LRU cache of downloaded chunks, tracked in a single index file instead of per-chunk lookups.
+  The index is kept in memory, added chunks and access times are batched and only written to the index file,
+  which is also when chunks are evicted, every INDEX_PERSIST_INTERVAL seconds and at exit.
+  """
+  def __init__(self, root: str, size_limit: int=CACHE_SIZE_LIMIT):
+    self.root = root
+    self.size_limit = size_limit
+    self._index_path = os.path.join(root, "chunk_index")
+    self._lock_path = os.path.join(root, "chunk_index.lock")
+    self._lock = threading.Lock()
+    #  name -> [size, last access time]
+    self._index: dict[str, list]|None = None
+    self._used: dict[str, float] = {}
+    self._added: dict[str, list] = {}
+    self._last_persist = time.monotonic()
+
+  def path(self, name: str) -> str:
+    return os.path.join(self.root, name)
+
+  def __contains__(self, name: str) -> bool:
+    with self._lock:
+      if self._index is None:
+        self._index = self._read_index()
+        if self._index is None:
+          self._sync()
+        else:
+          self._index.update(self._added)
+      assert self._index is not None
+      return name in self._index
+
+  def add(self, name: str, size: int) -> None:
+    with self._lock:
+      self._added[name] = [size, time.time()]
+      if self._index is not None:
+        self._index[name] = self._added[name]
+      self._sync_if_due()
+
+  def touch(self, names: list[str]) -> None:
+    with self._lock:
+      now = time.time()
+      for name in names:
+        self._used[name] = now
+      self._sync_if_due()
+
+  def flush(self) -> None:
+    with self._lock:
+      if len(self._added) or len(self._used):
+        self._sync()
+
+  def _sync_if_due(self) -> None:
+    if time.monotonic() - self._last_persist > INDEX_PERSIST_INTERVAL:
+      self._sync()
+
+  @contextmanager
+  def _locked(self):
+    with open(self._lock_path, "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      yield
+
+  def _read_index(self) -> dict[str, list]|None:
+    try:
+      with open(self._index_path) as f:
+        return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+
+  def _scan(self) -> dict[str, list]:
+    #  Chunks cached before there was an index, the ones named with a float chunk number are renamed
+    index = {}
+    for name in os.listdir(self.root):
+      if (match := OLD_CHUNK_NAME_RE.fullmatch(name)) is not None:
+        old_path, name = self.path(name), match.group(1)
+        if os.path.exists(self.path(name)) or os.path.getsize(old_path) == 0:
+          os.remove(old_path)
+          continue
+        os.replace(old_path, self.path(name))
+      elif CHUNK_NAME_RE.fullmatch(name) is None:
+        continue
+
+      with suppress(FileNotFoundError):
+        stat = os.stat(self.path(name))
+        index[name] = [stat.st_size, stat.st_mtime]
+    return index
+
+  def _sync(self) -> None:
+    #  Merges pending changes into the index file, which other processes may have changed. Called with self._lock held
+    with self._locked():
+      index = self._read_index()
+      if index is None:
+        index = self._scan()
+      for name, access_time in self._used.items():
+        if name in index:
+          index[name][1] = max(index[name][1], access_time)
+      for name, (size, access_time) in self._added.items():
+        index[name] = [size, max(access_time, index[name][1]) if name in index else access_time]
+
+      total = sum(size for size, _ in index.values())
+      if total > self.size_limit:
+        for name, (size, _) in sorted(index.items(), key=lambda item: item[1][1]):
+          if total <= self.size_limit:
+            break
+          del index[name]
+          total -= size
+          with suppress(FileNotFoundError):
+            os.remove(self.path(name))
+
+      with atomic_write_in_dir(self._index_path, mode="w", overwrite=True) as f:
+        json.dump(index, f)
+
+    self._index = index
+    self._used.clear()
+    self._added.clear()
+    self._last_persist = time.monotonic()
+
+
 class URLFile:
   _pool_manager: PoolManager|None = None
+  _executor: ThreadPoolExecutor|None = None
+  _inflight: dict[str, Future] = {}
+  _inflight_lock = threading.Lock()
+  _chunk_caches: dict[str, ChunkCache] = {}
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._executor = None
+    URLFile._inflight = {}
+    URLFile._inflight_lock = threading.Lock()
+    URLFile._chunk_caches = {}
+
+  @staticmethod
+  def chunk_cache(root: str) -> ChunkCache:
+    #  Shared by all files, so the index is only loaded once
+    with URLFile._inflight_lock:
+      if root not in URLFile._chunk_caches:
+        URLFile._chunk_caches[root] = ChunkCache(root)
+      return URLFile._chunk_caches[root]
+
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=max(PREFETCH_CHUNKS, 1) * 2, thread_name_prefix="urlfile")
+    return URLFile._executor
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -39,12 +194,13 @@ class URLFile:
       URLFile._pool_manager = PoolManager(num_pools=10, maxsize=100, socket_options=socket_options, retries=retries)
     return URLFile._pool_manager
 
-  def __init__(self, url: str, timeout: int=10, debug: bool=False, cache: bool|None=None):
+  def __init__(self, url: str, timeout: int=10, debug: bool=False, cache: bool|None=None, prefetch: int=PREFETCH_CHUNKS):
     self._url = url
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
     self._length: int|None = None
     self._debug = debug
+    self._prefetch = prefetch
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
     if cache is not None:
@@ -52,6 +208,7 @@ class URLFile:
 
     if not self._force_download:
       os.makedirs(Paths.download_cache_root(), exist_ok=True)
+      self._cache = URLFile.chunk_cache(Paths.download_cache_root())
 
   def __enter__(self):
     return self
@@ -86,6 +243,41 @@ class URLFile:
         file_length.write(str(self._length))
     return self._length
 
+  def _chunk_name(self, chunk: int) -> str:
+    return hash_256(self._url) + "_" + str(chunk)
+
+  def _download_chunk(self, chunk: int, name: str) -> bytes:
+    full_path = self._cache.path(name)
+    #  Another reader may have finished downloading it since the index was loaded
+    try:
+      with open(full_path, "rb") as cached_file:
+        data = cached_file.read()
+    except FileNotFoundError:
+      data = self._read_range(chunk * CHUNK_SIZE, CHUNK_SIZE)
+      if len(data):
+        with atomic_write_in_dir(full_path, mode="wb", overwrite=True) as new_cached_file:
+          new_cached_file.write(data)
+
+    if len(data):
+      self._cache.add(name, len(data))
+    return data
+
+  def _fetch_chunk(self, chunk: int) -> Future:
+    name = self._chunk_name(chunk)
+    with URLFile._inflight_lock:
+      future = URLFile._inflight.get(name)
+      if future is None:
+        future = URLFile.executor().submit(self._download_chunk, chunk, name)
+        URLFile._inflight[name] = future
+      else:
+        return future
+
+    def done(_):
+      with URLFile._inflight_lock:
+        URLFile._inflight.pop(name, None)
+    future.add_done_callback(done)
+    return future
+
   def read(self, ll: int|None=None) -> bytes:
     if self._force_download:
       return self.read_aux(ll=ll)
@@ -93,44 +285,37 @@ class URLFile:
     file_begin = self._pos
     file_end = self._pos + ll if ll is not None else self.get_length()
     assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
+    #  We have to align with chunks we store. The first chunk is the latest chunk that starts before or at our file
+    first_chunk = file_begin // CHUNK_SIZE
+    end_chunk = max(first_chunk + 1, -(-file_end // CHUNK_SIZE))
+    num_chunks = -(-self.get_length() // CHUNK_SIZE)
+
+    #  Start downloads for every missing chunk, including the next few after this read
+    futures = {}
+    for chunk in range(first_chunk, max(end_chunk, min(end_chunk + self._prefetch, num_chunks))):
+      if self._chunk_name(chunk) not in self._cache:
+        futures[chunk] = self._fetch_chunk(chunk)
+
     response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
+    for chunk in range(first_chunk, end_chunk):
+      if chunk in futures:
+        data = futures[chunk].result()
       else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
+        try:
+          with open(self._cache.path(self._chunk_name(chunk)), "rb") as cached_file:
+            data = cached_file.read()
+        except FileNotFoundError:
+          #  Evicted since the index was loaded
+          data = self._fetch_chunk(chunk).result()
+
+      position = chunk * CHUNK_SIZE
       response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
-
-  def read_aux(self, ll: int|None=None) -> bytes:
-    download_range = False
-    headers = {}
-    if self._pos != 0 or ll is not None:
-      if ll is None:
-        end = self.get_length() - 1
-      else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
-        return b""
-      headers['Range'] = f"bytes={self._pos}-{end}"
-      download_range = True
+    self._cache.touch([self._chunk_name(chunk) for chunk in range(first_chunk, end_chunk) if chunk not in futures])
+    self._pos = file_end
+    return response
 
+  def _get(self, headers: dict[str, str], download_range: bool) -> bytes:
     if self._debug:
       t1 = time.time()
 
@@ -149,7 +334,29 @@ class URLFile:
       raise URLFileException(f"Error, requested range but got unexpected response {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
     if (not download_range) and response_code != 200:  # OK
       raise URLFileException(f"Error {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
+    return ret
+
+  def _read_range(self, start: int, ll: int) -> bytes:
+    #  Unlike read_aux, this doesn't use or move the file position, so it's safe to call from other threads
+    end = min(start + ll, self.get_length()) - 1
+    if start > end:
+      return b""
+    return self._get({'Range': f"bytes={start}-{end}"}, True)
+
+  def read_aux(self, ll: int|None=None) -> bytes:
+    download_range = False
+    headers = {}
+    if self._pos != 0 or ll is not None:
+      if ll is None:
+        end = self.get_length() - 1
+      else:
+        end = min(self._pos + ll, self.get_length()) - 1
+      if self._pos >= end:
+        return b""
+      headers['Range'] = f"bytes={self._pos}-{end}"
+      download_range = True
 
+    ret = self._get(headers, download_range)
     self._pos += len(ret)
     return ret
 
@@ -161,4 +368,10 @@ class URLFile:
     return self._url
 
 
+def _flush_chunk_caches() -> None:
+  for cache in URLFile._chunk_caches.values():
+    cache.flush()
+
+
 os.register_at_fork(after_in_child=URLFile.reset)
+atexit.register(_flush_chunk_caches)
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
 import os
 import struct
 from enum import IntEnum
 
+import numpy as np
+
 from openpilot.tools.lib.filereader import FileReader
 
 DEBUG = int(os.getenv("DEBUG", "0"))
@@ -120,32 +123,22 @@ class VideoFileInvalid(Exception):
   pass
 
 def get_ue(dat: bytes, start_idx: int, skip_bits: int) -> tuple[int, int]:
-  prefix_val = 0
-  prefix_len = 0
-  suffix_val = 0
-  suffix_len = 0
-
-  i = start_idx
-  while i < len(dat):
-    j = 7
-    while j >= 0:
-      if skip_bits > 0:
-        skip_bits -= 1
-      elif prefix_val == 0:
-        prefix_val = (dat[i] >> j) & 1
-        prefix_len += 1
-      else:
-        suffix_val = (suffix_val << 1) | ((dat[i] >> j) & 1)
-        suffix_len += 1
-      j -= 1
-
-      if prefix_val == 1 and prefix_len - 1 == suffix_len:
-        val = 2**(prefix_len-1) - 1 + suffix_val
-        size = prefix_len + suffix_len
-        return val, size
-    i += 1
-
-  raise VideoFileInvalid("invalid exponential-golomb code")
+  # 9.2 Parsing process for 0-th order Exp-Golomb codes
+  # leadingZeroBits zeros, a one, then leadingZeroBits more bits: value is the code read as an integer minus one
+  num_bytes = (skip_bits + 7) // 8 + 8
+  while True:
+    window = dat[start_idx:start_idx + num_bytes]
+    avail = len(window) * 8 - skip_bits
+    bits = int.from_bytes(window, "big") & ((1 << max(avail, 0)) - 1)
+    if bits != 0:
+      leading_zeros = avail - bits.bit_length()
+      size = 2 * leading_zeros + 1
+      if size <= avail:
+        return (bits >> (avail - size)) - 1, size
+
+    if start_idx + num_bytes >= len(dat):
+      raise VideoFileInvalid("invalid exponential-golomb code")
+    num_bytes *= 2
 
 def require_nal_unit_start(dat: bytes, nal_unit_start: int) -> None:
   if nal_unit_start < 1:
@@ -155,10 +148,7 @@ def require_nal_unit_start(dat: bytes, nal_unit_start: int) -> None:
     raise VideoFileInvalid("data must begin with start code")
 
 def get_hevc_nal_unit_length(dat: bytes, nal_unit_start: int) -> int:
-  try:
-    pos = dat.index(NAL_UNIT_START_CODE, nal_unit_start + NAL_UNIT_START_CODE_SIZE)
-  except ValueError:
-    pos = -1
+  pos = dat.find(NAL_UNIT_START_CODE, nal_unit_start + NAL_UNIT_START_CODE_SIZE)
 
   # length of NAL unit is byte count up to next NAL unit start index
   nal_unit_len = (pos if pos != -1 else len(dat)) - nal_unit_start
@@ -258,38 +248,69 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
-def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
-  with FileReader(hevc_file_name) as f:
-    dat = f.read()
+def get_hevc_nal_unit_starts(dat: bytes) -> np.ndarray:
+  # every 0x01 preceded by two zero bytes is a start code, emulation prevention guarantees none occur inside a NAL unit
+  arr = np.frombuffer(dat, dtype=np.uint8)
+  ones = np.flatnonzero(arr[NAL_UNIT_START_CODE_SIZE - 1:] == 1)
+  return ones[(arr[ones] == 0) & (arr[ones + 1] == 0)]
 
+def hevc_index_data(dat: bytes, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
   if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
     raise VideoFileInvalid("data is too short")
 
   if dat[0] != 0x00:
     raise VideoFileInvalid("first byte must be 0x00")
 
-  prefix_dat = b""
+  prefix_dat = []
   frame_types = list()
 
   i = 1 # skip past first byte 0x00
   try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
-      nal_unit_type = get_hevc_nal_unit_type(dat, i)
-      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
-      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
-        if is_first_slice:
-          frame_types.append((slice_type, i))
-      i += nal_unit_len
+    require_nal_unit_start(dat, i)
+
+    arr = np.frombuffer(dat, dtype=np.uint8)
+    starts = get_hevc_nal_unit_starts(dat)
+    ends = np.append(starts[1:], len(dat))
+
+    # only the last NAL unit can be cut short of its header
+    header_end = NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE
+    truncated = starts[-1] + header_end > len(dat)
+    if truncated:
+      starts, ends = starts[:-1], ends[:-1]
+
+    nal_unit_types = (arr[starts + NAL_UNIT_START_CODE_SIZE] >> 1) & 0x3F
+    is_parameter_set = np.isin(nal_unit_types, HEVC_PARAMETER_SET_NAL_UNITS)
+    # 7.3.6.1 first_slice_segment_in_pic_flag is the first bit after the NAL unit header,
+    # slices without any header data are also parsed so they fail the same way
+    rbsp_starts = starts + header_end
+    is_first_slice = np.isin(nal_unit_types, HEVC_CODED_SLICE_SEGMENT_NAL_UNITS) & \
+                     ((rbsp_starts >= len(dat)) | (arr.take(rbsp_starts, mode='clip') >> 7 == 1))
+
+    # only slice headers of the first slice in each picture need to be bit-parsed
+    for idx in np.flatnonzero(is_parameter_set | is_first_slice).tolist():
+      i = int(starts[idx])
+      if is_parameter_set[idx]:
+        prefix_dat.append(dat[i:int(ends[idx])])
+      else:
+        slice_type, _ = get_hevc_slice_type(dat, i, HevcNalUnitType(int(nal_unit_types[idx])))
+        frame_types.append((slice_type, i))
+
+    if truncated:
+      i = int(ends[-1]) if len(ends) else 1
+      raise VideoFileInvalid("data to short to contain nal unit header")
   except Exception as e:
     if not allow_corrupt:
       raise
     print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
 
-  return frame_types, len(dat), prefix_dat
+  return frame_types, len(dat), b"".join(prefix_dat)
+
+def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
+  with FileReader(hevc_file_name) as f:
+    # local files are memory mapped rather than read into memory
+    if hasattr(f, "fileno") and os.fstat(f.fileno()).st_size > 0:
+      return hevc_index_data(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), allow_corrupt)
+    return hevc_index_data(f.read(), allow_corrupt)
 
 def main() -> None:
   parser = argparse.ArgumentParser()